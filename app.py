@@ -1,33 +1,153 @@
+import time
+# Taken before the imports so the startup time logged once ready covers them too
+STARTED_AT = time.monotonic()
+
 import discord
 from discord import app_commands
 from discord.ext import commands
-import yt_dlp
 import asyncio
 import os
 from dotenv import load_dotenv
+import copy
 import functools
+import hashlib
+import json
+import statistics
+import threading
+import math
 from collections import deque
 
+from audio_cache import AudioCache
+from download_budget import DownloadBudget
+from extraction import ExtractionPool
+from growing_file import GrowingFile
+from job_broker import JobBroker, JobError, LocalBroker
+from lazy_import import lazy_import
+from loop_lag import CountingExecutor, LoopLagMonitor
+import media_worker
+from metrics import Registry, serve_metrics
+from outbox import Outbox
+from metadata_cache import MetadataCache
+from session_store import SessionStore
+from single_flight import SingleFlight
+from title_index import TitleIndex
+from transcode import convert_to_opus, measure_loudness, opus_paths
+from tracks import DOWNLOADING, PENDING, PLAYING, READY, Track, TrackQueue
+
+# yt-dlp is loaded on first use rather than at startup
+yt_dlp = lazy_import('yt_dlp')
+
 load_dotenv()
 DISCORD_BOT_TOKEN = os.getenv('DISCORD_BOT_TOKEN')
+# Seconds an idle guild player is kept around before it is evicted
+IDLE_PLAYER_TIMEOUT = int(os.getenv('IDLE_PLAYER_TIMEOUT', '900'))
+# Number of tracks downloaded concurrently per guild
+DOWNLOAD_WORKERS = int(os.getenv('DOWNLOAD_WORKERS', '3'))
+# How many upcoming tracks may be downloading or waiting to play at once
+DOWNLOAD_LOOKAHEAD = int(os.getenv('DOWNLOAD_LOOKAHEAD', '5'))
+# Bytes that downloaded and downloading tracks waiting to be played may take up on disk, in
+# total and per guild. A guild stops downloading at either limit, except for the next track to
+# play, and starts again once usage is back under DOWNLOAD_BUDGET_LOW_WATER of it; 0 is no limit
+DOWNLOAD_BUDGET_BYTES = int(os.getenv('DOWNLOAD_BUDGET_BYTES', str(4 * 1024 ** 3)))
+GUILD_DOWNLOAD_BUDGET_BYTES = int(os.getenv('GUILD_DOWNLOAD_BUDGET_BYTES', str(512 * 1024 ** 2)))
+DOWNLOAD_BUDGET_LOW_WATER = float(os.getenv('DOWNLOAD_BUDGET_LOW_WATER', '0.75'))
+# Playlists are loaded one page at a time; the next page is fetched once fewer than
+# PLAYLIST_LOW_WATER tracks are left in the queue
+PLAYLIST_PAGE_SIZE = int(os.getenv('PLAYLIST_PAGE_SIZE', '25'))
+PLAYLIST_LOW_WATER = int(os.getenv('PLAYLIST_LOW_WATER', '10'))
+# 'download' saves each track to disk before playing it, 'stream' feeds the media URL straight to FFmpeg
+PLAYBACK_MODE = os.getenv('PLAYBACK_MODE', 'download')
+# A stream that ends this quickly without being skipped is treated as failed and downloaded instead
+STREAM_FAILURE_WINDOW = float(os.getenv('STREAM_FAILURE_WINDOW', '3'))
+# Finished tracks are kept here across plays and restarts; a budget of 0 disables the cache
+AUDIO_CACHE_DIR = os.getenv('AUDIO_CACHE_DIR', 'cache')
+AUDIO_CACHE_MAX_BYTES = int(os.getenv('AUDIO_CACHE_MAX_BYTES', str(2 * 1024 ** 3)))
+# Extraction results are cached in memory and in SQLite. Titles and thumbnails are kept for
+# METADATA_TTL seconds, playlist listings and full results (with expiring media URLs) for less.
+METADATA_CACHE_PATH = os.getenv('METADATA_CACHE_PATH', os.path.join(AUDIO_CACHE_DIR, 'metadata.sqlite3'))
+METADATA_MEMORY_ENTRIES = int(os.getenv('METADATA_MEMORY_ENTRIES', '1024'))
+METADATA_TTL = int(os.getenv('METADATA_TTL', str(7 * 24 * 3600)))
+METADATA_PLAYLIST_TTL = int(os.getenv('METADATA_PLAYLIST_TTL', '3600'))
+METADATA_STREAM_TTL = int(os.getenv('METADATA_STREAM_TTL', '1800'))
+# FFmpeg used to turn downloads into Opus files
+FFMPEG_BINARY = os.getenv('FFMPEG_BINARY', 'ffmpeg')
+# Tracks are played at LOUDNESS_TARGET LUFS (EBU R128 integrated loudness), measured once when
+# they are downloaded; 'off' plays them as they are. A track within LOUDNESS_TOLERANCE dB of the
+# target is passed through untouched, any other gets a fixed gain while FFmpeg encodes it.
+LOUDNESS_TARGET = os.getenv('LOUDNESS_TARGET', '-14')
+LOUDNESS_TARGET = None if LOUDNESS_TARGET.lower() == 'off' else float(LOUDNESS_TARGET)
+LOUDNESS_TOLERANCE = float(os.getenv('LOUDNESS_TOLERANCE', '1'))
+# The next track's FFmpeg source is opened and starts buffering this many seconds before the
+# current track ends (right away when the length is unknown); 0 turns pre-opening off
+GAPLESS_PRELOAD_SECONDS = float(os.getenv('GAPLESS_PRELOAD_SECONDS', '10'))
+# A track the player is waiting for starts playing from its still-growing download once this many
+# seconds of it are on disk; 0 always waits for the whole download
+PROGRESSIVE_BUFFER_SECONDS = float(os.getenv('PROGRESSIVE_BUFFER_SECONDS', '10'))
+# Prometheus metrics are served on http://METRICS_HOST:METRICS_PORT/metrics; port 0 turns them off
+METRICS_HOST = os.getenv('METRICS_HOST', '127.0.0.1')
+METRICS_PORT = int(os.getenv('METRICS_PORT', '9108'))
+# Extractions run in this many long-lived worker processes, by default one per CPU between 2
+# and 8 (0 runs them on threads in the bot process), and are abandoned after EXTRACT_TIMEOUT seconds
+EXTRACT_WORKERS = int(os.getenv('EXTRACT_WORKERS', str(min(max(os.cpu_count() or 1, 2), 8))))
+EXTRACT_TIMEOUT = float(os.getenv('EXTRACT_TIMEOUT', '60'))
+# Extraction, downloads, FFmpeg conversion and loudness analysis are handed to media_worker.py
+# processes, on this host or others, that connect to this address ('unix:/path/to.sock' or
+# 'tcp:host:port'); 'local' runs the same jobs inside the bot, and unset keeps the media work in
+# the bot as before. A job a worker has not acked within WORKER_ACK_TIMEOUT seconds, or whose
+# worker goes silent for WORKER_HEALTH_TIMEOUT, is retried elsewhere up to WORKER_MAX_ATTEMPTS
+# times in all; one no worker takes up within WORKER_QUEUE_TIMEOUT fails. Workers must send
+# WORKER_TOKEN when they connect; it is required for a TCP address.
+WORKER_BROKER = os.getenv('WORKER_BROKER', '')
+WORKER_TOKEN = os.getenv('WORKER_TOKEN', '')
+WORKER_ACK_TIMEOUT = float(os.getenv('WORKER_ACK_TIMEOUT', '10'))
+WORKER_HEALTH_TIMEOUT = float(os.getenv('WORKER_HEALTH_TIMEOUT', '15'))
+WORKER_MAX_ATTEMPTS = int(os.getenv('WORKER_MAX_ATTEMPTS', '3'))
+WORKER_QUEUE_TIMEOUT = float(os.getenv('WORKER_QUEUE_TIMEOUT', '60'))
+# Event loop stalls longer than this many seconds are logged; 0 turns the warning off
+LOOP_LAG_WARNING = float(os.getenv('LOOP_LAG_WARNING', '0.25'))
+# Every guild's queue and playback position are saved here every SESSION_SAVE_INTERVAL seconds
+# and resumed after a restart; an interval of 0 turns this off
+SESSION_STORE_PATH = os.getenv('SESSION_STORE_PATH', os.path.join(AUDIO_CACHE_DIR, 'sessions.sqlite3'))
+SESSION_SAVE_INTERVAL = float(os.getenv('SESSION_SAVE_INTERVAL', '5'))
+# Titles of every resolved track are indexed here for /search and /play autocomplete, keeping
+# the TITLE_INDEX_MAX_ENTRIES seen most recently. /search asks YouTube for SEARCH_RESULTS
+# results when no indexed title matches.
+TITLE_INDEX_PATH = os.getenv('TITLE_INDEX_PATH', os.path.join(AUDIO_CACHE_DIR, 'titles.sqlite3'))
+TITLE_INDEX_MAX_ENTRIES = int(os.getenv('TITLE_INDEX_MAX_ENTRIES', '200000'))
+SEARCH_RESULTS = int(os.getenv('SEARCH_RESULTS', '10'))
 
 intents = discord.Intents.default()
 intents.message_content = True
-bot = commands.Bot(command_prefix='/', intents=intents)
+# Let discord.py pick the shard count so one process can serve many guilds
+bot = commands.AutoShardedBot(command_prefix='/', intents=intents)
 
 os.makedirs('downloads', exist_ok=True)
-
-# Clean up leftover files in downloads directory at startup
-for filename in os.listdir('downloads'):
-    file_path = os.path.join('downloads', filename)
-    try:
-        if os.path.isfile(file_path):
+os.makedirs(os.path.dirname(SESSION_STORE_PATH) or '.', exist_ok=True)
+session_store = SessionStore(SESSION_STORE_PATH)
+saved_sessions = session_store.load() if SESSION_SAVE_INTERVAL > 0 else {}
+
+# Clean up leftover files in downloads directory at startup, except those the saved
+# sessions will play once they resume
+kept_files = {os.path.normpath(entry['file']) for session in saved_sessions.values()
+              for entry in [session['current'], *session['queue']] if entry and entry.get('file')}
+for dirpath, dirnames, filenames in os.walk('downloads', topdown=False):
+    for filename in filenames:
+        file_path = os.path.join(dirpath, filename)
+        if os.path.normpath(file_path) in kept_files:
+            continue
+        try:
             os.remove(file_path)
-    except Exception as e:
-        print(f"Failed to delete {file_path}. Reason: {e}")
+        except Exception as e:
+            print(f"Failed to delete {file_path}. Reason: {e}")
+    for dirname in dirnames:
+        try:
+            os.rmdir(os.path.join(dirpath, dirname))
+        except OSError:
+            pass  # Still holds files of a saved session
 
 ydl_opts = {
-    'format': 'bestaudio/best',
+    # Prefer Opus sources so they can be passed through to Discord without re-encoding
+    'format': 'bestaudio[acodec=opus]/bestaudio/best',
     'outtmpl': 'downloads/%(id)s.%(ext)s',
     'restrictfilenames': True,
     'noplaylist': False,
@@ -36,22 +156,314 @@ ydl_opts = {
     'ignoreerrors': False,
     'no_warnings': True,
     'default_search': 'auto',
-    'playlist_items': '1-25',
-    'postprocessors': [{
-        'key': 'FFmpegExtractAudio',
-        'preferredcodec': 'mp3',
-        'preferredquality': '192',
-    }],
 }
 
+audio_cache = AudioCache(AUDIO_CACHE_DIR, AUDIO_CACHE_MAX_BYTES) if AUDIO_CACHE_MAX_BYTES > 0 else None
+download_budget = DownloadBudget(DOWNLOAD_BUDGET_BYTES, GUILD_DOWNLOAD_BUDGET_BYTES, DOWNLOAD_BUDGET_LOW_WATER)
+# Downloaded files outside the audio cache -> number of queued or playing tracks using them
+file_refs = {}
+
+
+def hold_file(path):
+    """Count one more track using a downloaded file."""
+    if audio_cache and audio_cache.owns(path):
+        audio_cache.pin(path)
+    else:
+        path = os.path.normpath(path)
+        file_refs[path] = file_refs.get(path, 0) + 1
+
+
+def drop_file(path):
+    """Count one track fewer using a downloaded file; True once nothing uses it and it can go."""
+    if audio_cache and audio_cache.owns(path):
+        # Cached files stay on disk for the next request; just let them be evicted again
+        audio_cache.release(path)
+        return False
+    path = os.path.normpath(path)
+    users = file_refs.pop(path, 0) - 1
+    if users > 0:
+        file_refs[path] = users
+        return False
+    return True
+
+
+def under_directory(path, directory):
+    # Whether path is inside directory once '..' and symlinks are resolved
+    directory = os.path.realpath(directory)
+    return os.path.commonpath([os.path.realpath(path), directory]) == directory
+
+
+def remove_file(path):
+    if os.path.exists(path):
+        try:
+            os.remove(path)
+        except PermissionError:
+            print(f"Could not delete file {path}. It will be deleted later.")
+
+
+# One download per video at a time, however many tracks in however many guilds want it;
+# a download nobody waits for any more hands its file straight back
+shared_downloads = SingleFlight(lambda result: hold_file(result[0]),
+                                lambda result: drop_file(result[0]) and remove_file(result[0]))
+
+
+def pause_download(track):
+    # A paused track gives up its download slot straight away, even while other tracks keep
+    # the download it shares with them going
+    track.pause_download()
+    shared_downloads.leave(track.interrupt)
+
+
+def file_in_use(path):
+    path = os.path.normpath(path)
+    return file_refs.get(path, 0) > 0 or any(
+        path in map(os.path.normpath, flight.files) for flight in shared_downloads.flights.values())
+
+
+def remove_unused_downloads(directory, remove_directory=False):
+    # Files in a guild's directory can belong to a download other guilds share, so only
+    # those no track anywhere still uses are removed
+    if not os.path.isdir(directory):
+        return
+    for filename in os.listdir(directory):
+        file_path = os.path.join(directory, filename)
+        try:
+            if os.path.isfile(file_path) and not file_in_use(file_path):
+                os.remove(file_path)
+        except Exception as e:
+            print(f"Failed to delete {file_path}. Reason: {e}")
+    if remove_directory:
+        try:
+            os.rmdir(directory)
+        except OSError:
+            pass  # Still holds files shared with another guild's tracks
+
+
+@functools.lru_cache(maxsize=4096)
+def cache_key_for_url(url):
+    # Work out the cache key from the URL alone so a cache hit needs no network round-trip.
+    # Keys derived here are only used for lookups; entries are always published under the
+    # extractor and id that yt-dlp reports after the download.
+    if not url.startswith(('http://', 'https://')):
+        return None
+    for ie in yt_dlp.extractor.gen_extractor_classes():
+        if ie.ie_key() == 'Generic':
+            continue
+        if ie.suitable(url):
+            video_id = ie.get_temp_id(url)
+            return AudioCache.make_key(ie.ie_key(), video_id) if video_id else None
+    return None
+
+def warm_up():
+    # Load yt-dlp and compile every extractor's URL pattern, which the first cache_key_for_url
+    # call would otherwise pay for on a user's /play
+    for ie in yt_dlp.extractor.gen_extractor_classes():
+        ie.suitable('')
+
+os.makedirs(os.path.dirname(METADATA_CACHE_PATH) or '.', exist_ok=True)
+metadata_cache = MetadataCache(
+    METADATA_CACHE_PATH, METADATA_MEMORY_ENTRIES, METADATA_TTL,
+    {'entries': METADATA_PLAYLIST_TTL, 'info': METADATA_STREAM_TTL})
+os.makedirs(os.path.dirname(TITLE_INDEX_PATH) or '.', exist_ok=True)
+title_index = TitleIndex(TITLE_INDEX_PATH, TITLE_INDEX_MAX_ENTRIES)
+
+metrics = Registry()
+extraction_seconds = metrics.histogram(
+    'music_extraction_seconds', 'yt-dlp extraction time on metadata cache misses', ('guild', 'kind'))
+download_seconds = metrics.histogram(
+    'music_download_seconds', 'Download and convert time of tracks not in the audio cache', ('guild',))
+time_to_first_audio_seconds = metrics.histogram(
+    'music_time_to_first_audio_seconds', 'Time from /play to the first track starting', ('guild',))
+track_gap_seconds = metrics.histogram(
+    'music_track_gap_seconds', 'Silence between consecutive tracks', ('guild',),
+    buckets=(0.001, 0.0025, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1, 2.5, 5, 10))
+metrics_runner = None
+
+extraction_pool = ExtractionPool(EXTRACT_WORKERS, EXTRACT_TIMEOUT) if EXTRACT_WORKERS > 0 else None
+if WORKER_BROKER == 'local':
+    job_broker = LocalBroker(media_worker.HANDLERS)
+elif WORKER_BROKER:
+    job_broker = JobBroker(WORKER_BROKER, WORKER_ACK_TIMEOUT, WORKER_HEALTH_TIMEOUT, WORKER_MAX_ATTEMPTS,
+                           WORKER_QUEUE_TIMEOUT, WORKER_TOKEN)
+else:
+    job_broker = None
+loop_lag = LoopLagMonitor(warn_after=LOOP_LAG_WARNING)
+# Cache lookups, file work and downloads run on the loop's default executor
+default_executor = CountingExecutor()
+
+def extract_options(flat, playlist_items=None):
+    opts = ydl_opts.copy()
+    if flat:
+        opts['extract_flat'] = True
+        if playlist_items:
+            opts['playlist_items'] = playlist_items
+    else:
+        opts.pop('extract_flat', None)
+        opts['noplaylist'] = True
+    return opts
+
+async def extract_info(url, fields=('info',), flat=False, playlist_items=None, guild=None):
+    # Every lookup goes through the metadata cache; yt-dlp only runs on a miss
+    opts = extract_options(flat, playlist_items)
+
+    def extract():
+        with yt_dlp.YoutubeDL(opts) as ydl:
+            return ydl.sanitize_info(ydl.extract_info(url, download=False))
+
+    async def fetch():
+        loop = asyncio.get_running_loop()
+        started = time.monotonic()
+        if job_broker:
+            info = await asyncio.wait_for(job_broker.submit('resolve', {'url': url, 'opts': opts}), EXTRACT_TIMEOUT)
+        elif extraction_pool:
+            info = await extraction_pool.run(url, opts)
+        else:
+            info = await loop.run_in_executor(None, extract)
+        extraction_seconds.observe(time.monotonic() - started, guild=guild or '', kind='flat' if flat else 'full')
+        await loop.run_in_executor(None, title_index.add, resolved_tracks(url, info))
+        if flat and info.get('_type', 'video') == 'video':
+            # A single video is fully resolved even in flat mode, so it doubles as the full result
+            await loop.run_in_executor(None, metadata_cache.store, f"full:{url}", info)
+        return info
+
+    key = f"{'flat' if flat else 'full'}:{url}"
+    if flat and playlist_items:
+        key += f"#{playlist_items}"
+    return await metadata_cache.get(key, fields, fetch)
+
+def resolved_tracks(url, info):
+    # (url, title, duration) of a resolved video, or of every entry of a playlist or search
+    if info.get('_type') == 'playlist':
+        return [(entry.get('url'), entry.get('title'), entry.get('duration')) for entry in info.get('entries') or []
+                if entry and str(entry.get('url')).startswith(('http://', 'https://'))]
+    return [(info.get('webpage_url') or url, info.get('title'), info.get('duration'))]
+
+async def search_remote(query, guild=None):
+    # Runs through the metadata cache like any extraction, so repeating a search costs nothing
+    # for a while, and its results are indexed like every other resolved track
+    query = ' '.join(query.casefold().split())
+    info = await extract_info(f"ytsearch{SEARCH_RESULTS}:{query}", fields=('entries',), flat=True, guild=guild)
+    return resolved_tracks(None, {'_type': 'playlist', 'entries': info['entries']})
+
+def buffered_enough(progress):
+    # Whether a download has enough on disk to start playing while the rest comes in
+    downloaded = progress.get('downloaded_bytes') or 0
+    total = progress.get('total_bytes') or progress.get('total_bytes_estimate')
+    duration = (progress.get('info_dict') or {}).get('duration')
+    if total and downloaded >= total:
+        return True
+    if total and duration:
+        return downloaded >= total * PROGRESSIVE_BUFFER_SECONDS / duration
+    # Without a size and a length to go by, assume 128 kbit/s
+    return downloaded >= PROGRESSIVE_BUFFER_SECONDS * 16000
+
+def playback_gain(loudness):
+    # dB to play a track at with its (integrated loudness, true peak), or 0 to leave it alone.
+    # Quiet tracks are raised at most 12 dB, and only as far as their peaks stay below -1 dBTP.
+    if LOUDNESS_TARGET is None or loudness is None:
+        return 0
+    integrated, peak = loudness
+    gain = min(LOUDNESS_TARGET - integrated, -1 - peak, 12)
+    return round(gain, 1) if abs(gain) >= LOUDNESS_TOLERANCE else 0
+
+def playlist_page(start):
+    return f"{start}-{start + PLAYLIST_PAGE_SIZE - 1}"
+
+
+# Remote media URLs expire and drop connections, so let FFmpeg reconnect instead of ending the track
+FFMPEG_STREAM_OPTIONS = {
+    'before_options': '-reconnect 1 -reconnect_streamed 1 -reconnect_on_network_error 1 -reconnect_delay_max 5',
+    'options': '-vn',
+}
+
+# Opus frames (20 ms each) read from a pre-opened source before it starts playing
+PREBUFFER_PACKETS = 50
+# Tracks per page of the queue view; titles are cut so a page stays under Discord's
+# 1024-character field limit
+QUEUE_PAGE_SIZE = 10
+QUEUE_TITLE_WIDTH = 90
+
+
+def shorten(text, width=QUEUE_TITLE_WIDTH):
+    return text if len(text) <= width else text[:width - 1] + '…'
+
+def format_duration(seconds):
+    minutes, seconds = divmod(int(seconds), 60)
+    hours, minutes = divmod(minutes, 60)
+    return f"{hours}:{minutes:02}:{seconds:02}" if hours else f"{minutes}:{seconds:02}"
+
+
+class PrebufferedSource(discord.AudioSource):
+    """Reads the first packets of an FFmpeg source on a background thread.
+
+    By the time the voice client asks for audio, FFmpeg is running and its first second is
+    already in memory, so the switch does not wait for process startup or the first read.
+    """
+
+    def __init__(self, source, packets=PREBUFFER_PACKETS):
+        self.source = source
+        self.buffer = deque()
+        self.lock = threading.Lock()
+        self.closed = False
+        threading.Thread(target=self._fill, args=(packets,), daemon=True).start()
+
+    def _fill(self, packets):
+        try:
+            for _ in range(packets):
+                with self.lock:
+                    if self.closed:
+                        return
+                    data = self.source.read()
+                    self.buffer.append(data)
+                if not data:
+                    return
+        except Exception:
+            pass  # Cleaned up under us; read() reports the real state
+
+    def read(self):
+        # Buffered packets first; once they run out, read FFmpeg directly
+        with self.lock:
+            if self.buffer:
+                return self.buffer.popleft()
+            return self.source.read()
+
+    def is_opus(self):
+        return self.source.is_opus()
+
+    def cleanup(self):
+        self.closed = True
+        self.source.cleanup()
+
+
 class MusicPlayer:
-    def __init__(self):
-        self.download_queue = asyncio.Queue()
-        self.play_queue = deque()
-        self.play_queue_lock = asyncio.Lock()  # Lock for concurrency control
+    def __init__(self, guild_id=None):
+        self.guild_id = guild_id
+        # Each guild downloads into its own directory so stop() only touches its own files
+        self.download_dir = os.path.join('downloads', str(guild_id))
+        self.last_active = time.monotonic()
+        # Single queue of upcoming tracks; each track carries its own download state
+        self.queue = TrackQueue()
+        # Wakeup signals for the downloader and the player; set through notify_queue_changed()
+        self.queue_changed = asyncio.Event()
+        self.player_wakeup = asyncio.Event()
+        self.download_tasks = {}  # Running download task -> Track
+        self.held = set()  # Tracks with a file on disk, finished or not, counted against the download budget
+        self.current_track = None
+        self.next_source = None  # (track, audio source) opened ahead of time for the head of the queue
+        self.preload_due = False  # The current track is close enough to its end to open the next one
+        self.preload_task = None
+        self.track_ended_at = None
+        self.gaps = deque(maxlen=200)  # Seconds of silence between consecutive tracks
+        self.play_requested_at = None  # When a /play found nothing playing, for time-to-first-audio
         self.current_voice_client = None
         self.voice_channel = None
         self.text_channel = None
+        # Status and error notices and the now-playing message all go through the outbox
+        self.outbox = Outbox(lambda: self.text_channel)
+        self.control_view = None  # One MusicControlView per session, attached to the now-playing message
+        self.tracks_played = 0
+        self.queue_pages = {}  # Rendered queue pages, valid while queue.version is queue_pages_version
+        self.queue_pages_version = None
         self.is_playing = False
         self.is_paused = False
         self.downloader_task = None
@@ -66,9 +478,18 @@ class MusicPlayer:
         self.playback_finished_event = asyncio.Event()
         self.current_audio_source = None  # Keep track of the current audio source
         self.song_count = 0  # Initialize song count to 0
-        self.upcoming_queue = deque()  # New attribute for upcoming songs
-        self.cancel_download_event = asyncio.Event()
+        self.playlist_cursors = deque()  # Playlists with pages still to load
+        self.page_task = None
         self.tasks = []  # List to keep track of async tasks
+        self.playback_error = None
+        self.skip_requested = False
+        self.current_file = None  # File on disk backing the current track, if any
+        # Playback position of the current track: seconds played before position_started, plus
+        # the time since then while not paused
+        self.position_offset = 0.0
+        self.position_started = None
+        self.changes = 0  # Bumped on every queue change, so sessions are only re-saved when needed
+        self.saved_session = None  # What the session was last saved at
 
     async def connect_to_voice_channel(self, interaction):
         if interaction.user.voice is None:
@@ -96,97 +517,542 @@ class MusicPlayer:
                 return None
         return self.current_voice_client
 
-    async def start(self, interaction):
+    async def start(self, interaction=None):
         self.stop_event.clear()  # Reset stop_event
         self.playback_finished_event.clear()
         # Store the text channel for sending messages
-        self.text_channel = interaction.channel
+        if interaction is not None:
+            self.text_channel = interaction.channel
         if self.downloader_task is None or self.downloader_task.done():
             self.downloader_task = asyncio.create_task(self.downloader())
         if self.player_task is None or self.player_task.done():
             self.player_task = asyncio.create_task(self.player())
 
     async def downloader(self):
-        while not self.stop_event.is_set():
+        # Downloads run concurrently on DOWNLOAD_WORKERS slots, but only for the first
+        # DOWNLOAD_LOOKAHEAD tracks of the queue, so the downloader never races through a
+        # whole playlist. The player only takes the head of the queue, so tracks still play
+        # in order when a later one finishes first. Slots go to tracks by queue position, so
+        # a /play_next track is downloaded before the playlist behind it.
+        try:
+            while not self.stop_event.is_set():
+                self.queue_changed.clear()
+                self.schedule_downloads()
+                await self.queue_changed.wait()
+        except asyncio.CancelledError:
+            pass
+        finally:
+            for task, track in list(self.download_tasks.items()):
+                track.cancel_download()
+                task.cancel()
+        print("Downloader has exited")
+
+    def notify_queue_changed(self):
+        # Something about the queue changed (a track was added, removed or became ready)
+        self.changes += 1
+        self.queue_changed.set()
+        self.player_wakeup.set()
+        self.check_next_source()
+
+    def check_next_source(self):
+        # Keep the pre-opened source in step with the head of the queue: drop it when the
+        # head changes (skip, remove, move, play_next) and open one once the head is ready
+        head = self.queue.head()
+        if self.next_source and self.next_source[0] is not head:
+            self.discard_next_source()
+        if (self.preload_due and self.next_source is None and head is not None
+                and head.state == READY and not self.stop_event.is_set()):
             try:
-                url = await self.download_queue.get()
-                if url is None or self.stop_event.is_set():
-                    break
-                filename, title, thumbnail_url = await self.download_and_convert(url)
-                if self.stop_event.is_set():
-                    # Cleanup file if needed
-                    await self.cleanup_file(filename)
-                    break
-                else:
-                    async with self.play_queue_lock:
-                        self.play_queue.append((filename, title, thumbnail_url))
-                    if not self.first_song_ready.is_set():
-                        self.first_song_ready.set()
-            except asyncio.CancelledError:
-                break
+                source = self.create_audio_source(head.source, head.stream, head.codec, head.start_at,
+                                                  playback_gain(head.loudness))
             except Exception as e:
-                print(f"Error downloading {url}: {e}")
-                if self.text_channel:
-                    await self.text_channel.send(f"Error downloading {url}: {e}")
+                print(f"Could not pre-open {head.title or head.url}: {e}")
+                return
+            if isinstance(source, discord.FFmpegAudio):
+                source = PrebufferedSource(source)
+            self.next_source = (head, source)
+
+    def take_next_source(self, track):
+        # The previous track's preload is done with; the track taking over schedules its own
+        # once it plays, so nothing after it is opened before then
+        if self.preload_task:
+            self.preload_task.cancel()
+            self.preload_task = None
+        self.preload_due = False
+        if self.next_source and self.next_source[0] is track:
+            source = self.next_source[1]
+            self.next_source = None
+            return source
+        self.discard_next_source()
+        return None
+
+    def discard_next_source(self):
+        if self.next_source:
+            self.next_source[1].cleanup()
+            self.next_source = None
+
+    def schedule_preload(self, remaining):
+        # Open the next track's source shortly before this one ends, `remaining` seconds from
+        # now when its duration is known
+        if self.preload_task:
+            self.preload_task.cancel()
+        self.preload_task = None
+        self.preload_due = False
+        if GAPLESS_PRELOAD_SECONDS <= 0:
+            return
+        if remaining and remaining > GAPLESS_PRELOAD_SECONDS:
+            self.preload_task = asyncio.create_task(self.preload_after(remaining - GAPLESS_PRELOAD_SECONDS))
+        else:
+            self.preload_due = True
+            self.check_next_source()
+
+    async def preload_after(self, delay):
+        await asyncio.sleep(delay)
+        self.preload_due = True
+        self.check_next_source()
+
+    def gap_stats(self):
+        if not self.gaps:
+            return None
+        return {'count': len(self.gaps), 'p50': statistics.median(self.gaps), 'max': max(self.gaps)}
+
+    def schedule_downloads(self):
+        window = self.queue.window(DOWNLOAD_LOOKAHEAD)
+        head = self.queue.head()
+        over_budget = self.check_disk()
+        waiting = []
+        for track in window:
+            if track.state != PENDING:
                 continue
-        print("Downloader has exited")
+            if track is not head and over_budget:
+                # Picked up again once the budget frees up; the next track to play never waits
+                download_budget.wait(self.guild_id, self.queue_changed.set)
+                break
+            if len(self.download_tasks) >= DOWNLOAD_WORKERS:
+                waiting.append(track)
+                continue
+            track.start_download()
+            self.held.add(track)
+            track.task = asyncio.create_task(self.download_track(track))
+            self.download_tasks[track.task] = track
+            track.task.add_done_callback(lambda task: self.download_tasks.pop(task, None))
+        if waiting:
+            self.preempt_downloads(window, waiting)
+
+    def preempt_downloads(self, window, waiting):
+        # Every slot is taken while tracks nearer the head wait for one, e.g. right after
+        # /play_next. Pause the downloads furthest back so they give up their slots; a paused
+        # track goes back to PENDING and yt-dlp resumes its .part file when it gets a slot again.
+        positions = {track.id: index for index, track in enumerate(window)}
+
+        def rank(track):
+            return positions.get(track.id, math.inf)
+
+        running = list(self.download_tasks.values())
+        # Slots already being given up will go to the first waiting tracks
+        waiting = waiting[sum(track.pausing for track in running):]
+        running = sorted((track for track in running if not track.pausing), key=rank, reverse=True)
+        for track, victim in zip(waiting, running):
+            if rank(victim) <= rank(track):
+                break
+            print(f"Pausing download of {victim.title or victim.url} for {track.title or track.url}")
+            pause_download(victim)
+
+    def disk_usage(self):
+        return sum(track.size for track in self.held)
+
+    def check_disk(self):
+        # Report this guild's bytes on disk and, past a high-water mark, pause every download
+        # but the next track's; a paused download keeps its partial file and resumes later
+        download_budget.report(self.guild_id, self.disk_usage())
+        if not download_budget.over(self.guild_id):
+            return False
+        head = self.queue.head()
+        for track in self.download_tasks.values():
+            if track is not head and track.state == DOWNLOADING and not track.pausing:
+                print(f"Pausing download of {track.title or track.url}: over the download budget")
+                pause_download(track)
+        return True
+
+    def release_disk(self, track):
+        # The track's file is gone or no longer ours to count
+        if track in self.held:
+            self.held.discard(track)
+            track.size = 0
+            download_budget.report(self.guild_id, self.disk_usage())
+            self.queue_changed.set()
+
+    async def download_track(self, track):
+        loop = asyncio.get_running_loop()
+        reported_at = 0.0
+        written = set()
+
+        def on_progress(progress):
+            # Runs on the download thread after every block
+            nonlocal reported_at
+            track.size = progress.get('downloaded_bytes') or 0
+            written.update(path for path in (progress.get('tmpfilename'), progress.get('filename')) if path)
+            now = time.monotonic()
+            if now - reported_at < 0.25:
+                return
+            reported_at = now
+            playable = PROGRESSIVE_BUFFER_SECONDS > 0 and buffered_enough(progress)
+            loop.call_soon_threadsafe(self.download_progress, track, progress.get('tmpfilename') or progress['filename'],
+                                      (progress.get('info_dict') or {}).get('acodec'), playable)
 
-    async def download_and_convert(self, url):
+        complete = False
+        try:
+            source, title, thumbnail_url, is_stream, codec, loudness = await self.fetch_audio(
+                track.url, track.stream, track.interrupt, on_progress)
+            complete = True
+        except asyncio.CancelledError:
+            if track.state == DOWNLOADING:
+                track.state = PENDING
+            raise
+        except Exception as e:
+            if track.pausing and track in self.queue:
+                # Pre-empted by a track nearer the head, or over the download budget; it is
+                # rescheduled once a slot (or the budget) frees up
+                track.state = PENDING
+                track.paused_files = written
+                return
+            self.release_disk(track)
+            if track in self.queue:
+                self.queue.remove(track.id)
+            print(f"Error downloading {track.url}: {e}")
+            self.outbox.notify(f"Error downloading {track.url}: {e}")
+            return
+        finally:
+            if track.partial is not None:
+                track.partial.finish(complete)
+                if track.state != PLAYING:
+                    # The player never took it; it plays from the finished file, if there is one
+                    track.partial.close()
+                    track.partial = None
+            # Free the slot before waking the downloader, not when the task is reaped later
+            self.download_tasks.pop(track.task, None)
+            track.task = None
+            self.notify_queue_changed()
+        if self.stop_event.is_set() or track not in self.queue:
+            # Removed from the queue while downloading
+            if not is_stream:
+                await self.cleanup_file(source)
+            if track.state != PLAYING:
+                self.release_disk(track)
+            return
+        if is_stream:
+            self.release_disk(track)
+        else:
+            track.size = os.path.getsize(source) if os.path.exists(source) else 0
+            download_budget.report(self.guild_id, self.disk_usage())
+        track.source = source
+        if track.title != title:
+            track.title = title
+            self.queue.touch()
+        track.thumbnail = thumbnail_url
+        track.stream = is_stream
+        track.codec = codec
+        track.loudness = loudness
+        track.state = READY
+        if not self.first_song_ready.is_set():
+            self.first_song_ready.set()
+        self.notify_queue_changed()
+
+    def download_progress(self, track, path, codec, playable):
+        if track not in self.held:
+            return  # Released while the hook's call was queued
+        if self.check_disk():
+            download_budget.wait(self.guild_id, self.queue_changed.set)
+        if playable:
+            self.offer_partial(track, path, codec)
+
+    def offer_partial(self, track, path, codec):
+        # Enough of the track is on disk; if the player is waiting for it, let it start on the
+        # growing file while the rest downloads
+        if (track.partial is not None or track.state != DOWNLOADING or self.queue.head() is not track
+                or self.is_playing or self.stop_event.is_set()):
+            return
+        try:
+            track.partial = GrowingFile(path)
+        except OSError as e:
+            print(f"Could not open the partial download of {track.title or track.url}: {e}")
+            return
+        track.codec = codec
+        print(f"Starting {track.title or track.url} before its download has finished")
+        self.first_song_ready.set()
+        self.notify_queue_changed()
+
+    async def fetch_audio(self, url, stream=False, interrupt=None, on_progress=None):
+        started = time.monotonic()
+        if stream:
+            try:
+                source, title, thumbnail_url, codec = await self.resolve_stream(url)
+                print(f"Resolved {codec} stream for {title} in {time.monotonic() - started:.2f}s")
+                return source, title, thumbnail_url, True, codec, None
+            except Exception as e:
+                print(f"Streaming unavailable for {url}, downloading instead: {e}")
+        filename, title, thumbnail_url, codec, loudness = await self.download_and_convert(url, interrupt, on_progress)
+        size = os.path.getsize(filename) if os.path.exists(filename) else 0
+        print(f"Downloaded {title} as {codec} in {time.monotonic() - started:.2f}s ({size / 1e6:.1f} MB written)")
+        return filename, title, thumbnail_url, False, codec, loudness
+
+    async def release_tracks(self, tracks):
+        # Free whatever tracks that left the queue without being played were holding
+        self.check_next_source()
+        for track in tracks:
+            if track.task:
+                # Stops the transfer or the FFmpeg conversion, not just the task awaiting it
+                track.cancel_download()
+                track.task.cancel()
+            elif track.state == READY and not track.stream:
+                await self.cleanup_file(track.source)
+            # A paused download's partial file is kept only while another track's download uses it
+            for path in track.paused_files:
+                if not file_in_use(path):
+                    remove_file(path)
+            track.paused_files = ()
+            self.release_disk(track)
+        self.notify_queue_changed()
+
+    async def download_and_convert(self, url, interrupt=None, on_progress=None):
         loop = asyncio.get_event_loop()
-        ydl_opts_copy = ydl_opts.copy()
-        ydl_opts_copy.pop('extract_flat', None)  # Remove 'extract_flat' to get full info
+        if audio_cache:
+            key = await loop.run_in_executor(None, cache_key_for_url, url)
+            cached = audio_cache.lookup(key) if key else None
+            if cached:
+                print(f"Audio cache hit for {cached['title']}")
+                loudness = tuple(cached['loudness']) if cached.get('loudness') else None
+                return cached['path'], cached['title'], cached.get('thumbnail'), cached.get('codec'), loudness
+
+        # The same video queued twice, or in several guilds at once, is downloaded once; every
+        # track gets its own reference to the file, which cleanup_file drops again
+        info = (await extract_info(url, guild=self.guild_id))['info']
+        key = AudioCache.make_key(info.get('extractor_key'), info.get('id'))
+        return await shared_downloads.run(key, functools.partial(self.download_once, url), (interrupt, on_progress))
+
+    async def download_once(self, url, flight):
+        # Runs once for all the tracks waiting on flight; it stops early only when all of
+        # them have interrupted their downloads
+        loop = asyncio.get_event_loop()
+        started = time.monotonic()
+        if job_broker:
+            filename, info = await self.download_remote(url, flight)
+        else:
+            filename, info = await self.download_local(url, flight)
+        title = info.get('title', 'Unknown Title')
+        thumbnail_url = info.get('thumbnail')
+        codec = 'opus'
+        flight.files.add(filename)
+        flight.files.update(opus_paths(filename))
+        try:
+            filename = await self.convert_to_opus(filename, info.get('acodec'))
+            loudness = await self.analyze_loudness(filename)
+        except BaseException:
+            # Every track waiting on the download is gone, or the conversion failed for all of
+            # them; nothing else holds its files
+            for path in flight.files:
+                remove_file(path)
+            raise
+        if audio_cache:
+            key = AudioCache.make_key(info.get('extractor_key'), info.get('id'))
+            metadata = {'title': title, 'thumbnail': thumbnail_url, 'codec': codec, 'loudness': loudness}
+            # Published pinned, for the first track to take the file
+            publish = loop.run_in_executor(None, audio_cache.publish, key, filename, metadata)
+            try:
+                filename = await asyncio.shield(publish)
+            except asyncio.CancelledError:
+                # It still ends up in the cache, but no track is left to unpin it
+                publish.add_done_callback(lambda done: done.exception() or audio_cache.release(done.result()))
+                raise
+        else:
+            hold_file(filename)
+        download_seconds.observe(time.monotonic() - started, guild=self.guild_id)
+        return filename, title, thumbnail_url, codec, loudness
+
+    async def analyze_loudness(self, filename):
+        # Measured once per download and kept with the track (and in the audio cache), so
+        # playback only applies a fixed gain. A track that cannot be measured plays as it is.
+        if LOUDNESS_TARGET is None:
+            return None
+        try:
+            if job_broker:
+                return tuple(await job_broker.submit('loudness', {'filename': os.path.abspath(filename)}))
+            return await measure_loudness(FFMPEG_BINARY, filename)
+        except Exception as e:
+            print(f"Could not measure the loudness of {filename}: {e}")
+            return None
+
+    async def download_remote(self, url, flight):
+        # A media worker downloads into this guild's directory, which workers on other hosts
+        # must see at the same absolute path; it stops if cancelled
+        directory = os.path.abspath(self.download_dir)
+        opts = extract_options(flat=False)
+        opts['outtmpl'] = os.path.join(directory, '%(id)s.%(ext)s')
+        os.makedirs(directory, exist_ok=True)
+
+        def on_progress(d):
+            # Only paths in the guild's directory are taken, as they are removed if the download is
+            flight.files.update(path for path in (d.get('tmpfilename'), d.get('filename'))
+                                if path and os.path.isabs(path) and under_directory(path, directory))
+            flight.progress(d)
+
+        for attempt in range(2):
+            info = (await extract_info(url, guild=self.guild_id))['info']
+            try:
+                filename = await job_broker.submit('download', {'opts': opts, 'info': info}, on_progress,
+                                                   flight.interrupted)
+                break
+            except JobError:
+                if attempt or flight.interrupted():
+                    raise
+                # The cached media URLs may have expired; resolve once more and retry
+                await asyncio.get_running_loop().run_in_executor(
+                    None, metadata_cache.invalidate, f"full:{url}", ['info'])
+        self.check_worker_path(filename)
+        return filename, info
+
+    def check_worker_path(self, path):
+        # A worker's result is only ever a file in this guild's directory, which it then plays
+        # and deletes; a relative path would be the worker's, not ours
+        directory = os.path.abspath(self.download_dir)
+        if not os.path.isabs(path) or not under_directory(path, directory):
+            raise JobError(f"A media worker returned {path}, outside {directory}")
+
+    async def download_local(self, url, flight):
+        ydl_opts_copy = extract_options(flat=False)
+        ydl_opts_copy['outtmpl'] = os.path.join(self.download_dir, '%(id)s.%(ext)s')
+        os.makedirs(self.download_dir, exist_ok=True)
+
+        # Files the download is writing, so an abandoned one can be cleaned up after
+        written = flight.files
 
         # Add progress_hooks to ydl_opts_copy
         def progress_hook(d):
             if d['status'] == 'downloading':
-                if self.cancel_download_event.is_set():
-                    raise yt_dlp.utils.DownloadError("Download cancelled")
+                written.update(path for path in (d.get('tmpfilename'), d.get('filename')) if path)
+                if flight.interrupted():
+                    raise yt_dlp.utils.DownloadError("Download interrupted")
+                flight.progress(d)
 
         ydl_opts_copy['progress_hooks'] = [progress_hook]  # Add the progress_hook
 
         with yt_dlp.YoutubeDL(ydl_opts_copy) as ydl:
             try:
-                # Create a partial function to include download=True
-                extract_info_func = functools.partial(ydl.extract_info, url, download=True)
-                info = await loop.run_in_executor(None, extract_info_func)
+                try:
+                    # Download from the cached extraction result instead of resolving the URL again
+                    info = copy.deepcopy((await extract_info(url, guild=self.guild_id))['info'])
+                    info = await self.run_download(ydl, info, written)
+                except yt_dlp.utils.DownloadError:
+                    if flight.interrupted():
+                        raise
+                    # The cached media URLs may have expired; resolve once more and retry
+                    await asyncio.get_running_loop().run_in_executor(
+                        None, metadata_cache.invalidate, f"full:{url}", ['info'])
+                    info = copy.deepcopy((await extract_info(url, guild=self.guild_id))['info'])
+                    info = await self.run_download(ydl, info, written)
                 # Retrieve the processed file's path
                 if 'requested_downloads' in info and len(info['requested_downloads']) > 0:
                     filename = info['requested_downloads'][0]['filepath']
                 else:
                     filename = ydl.prepare_filename(info)
-                title = info.get('title', 'Unknown Title')
-                thumbnail_url = info.get('thumbnail')
             except Exception as e:
-                print(f"Error extracting info for {url}: {e}")
+                # A download paused or cancelled by every track waiting on it is no error
+                if not flight.interrupted():
+                    print(f"Error extracting info for {url}: {e}")
                 # Clean up any partial files
                 temp_filename = ydl.prepare_filename(info) if 'info' in locals() else None
                 if temp_filename and os.path.exists(temp_filename):
                     os.remove(temp_filename)
                 raise e
-        return filename, title, thumbnail_url
+        return filename, info
+
+    async def run_download(self, ydl, info, written):
+        loop = asyncio.get_running_loop()
+        future = loop.run_in_executor(None, functools.partial(ydl.process_ie_result, info, download=True))
+        try:
+            return await asyncio.shield(future)
+        except asyncio.CancelledError:
+            # The worker thread stops at its next progress hook (every track waiting on it is interrupted);
+            # free the slot now and remove what it wrote once it has let go of the files
+            def discard(future):
+                if not future.cancelled():
+                    future.exception()
+                for path in written:
+                    try:
+                        os.remove(path)
+                    except FileNotFoundError:
+                        pass
+            future.add_done_callback(discard)
+            raise
+
+    async def convert_to_opus(self, filename, acodec):
+        # FFmpeg runs as our own subprocess, or a media worker's, so a cancelled track can kill
+        # it mid-conversion
+        if job_broker and filename != opus_paths(filename)[0]:
+            converted = await job_broker.submit('transcode', {'filename': os.path.abspath(filename), 'acodec': acodec})
+            self.check_worker_path(converted)
+            return converted
+        return await convert_to_opus(FFMPEG_BINARY, filename, acodec)
+
+    async def resolve_stream(self, url):
+        info = (await extract_info(url, guild=self.guild_id))['info']
+        # Only a single, directly playable format can be handed to FFmpeg
+        if not info or info.get('_type') == 'playlist' or not info.get('url'):
+            raise ValueError("no direct media URL")
+        return info['url'], info.get('title', 'Unknown Title'), info.get('thumbnail'), info.get('acodec')
+
+    def create_audio_source(self, source, is_stream, codec=None, start=0, gain=0):
+        # Discord speaks Opus, so an Opus source is copied straight through. Anything else, or a
+        # track played with a gain (in dB), is encoded to Opus once inside FFmpeg rather than
+        # decoded to PCM and re-encoded in Python.
+        options = dict(FFMPEG_STREAM_OPTIONS) if is_stream else {}
+        if isinstance(source, GrowingFile):
+            # A download still in progress is fed to FFmpeg through its stdin
+            options['pipe'] = True
+        if start:
+            # Seek before opening the input, e.g. for the track a restart interrupted
+            options['before_options'] = f"-ss {start:.2f} {options.get('before_options', '')}".strip()
+        if gain:
+            options['options'] = f"{options.get('options', '')} -af volume={gain}dB".strip()
+        elif codec == 'opus':
+            return discord.FFmpegOpusAudio(source, codec='copy', **options)
+        return discord.FFmpegOpusAudio(source, **options)
 
     async def player(self):
+        loop = asyncio.get_running_loop()
+        self.track_ended_at = None
         await self.first_song_ready.wait()
         while not self.stop_event.is_set():
             try:
                 # Get the next song from the queue
-                async with self.play_queue_lock:
-                    if not self.play_queue:
-                        if self.downloader_task and not self.downloader_task.done():
-                            # Wait for more songs to be downloaded
-                            await asyncio.sleep(1)
-                            continue
-                        else:
-                            # No more songs, exit the loop
-                            if self.text_channel and self.is_playing:
-                                await self.text_channel.send("No more songs in the queue.")
-                            await self.start_inactivity_timer()
-                            break
-                    else:
-                        item = self.play_queue.popleft()
-                if item is None or self.stop_event.is_set():
-                    continue  # Skip if the item is None or if stop event is set
-                filename, title, thumbnail_url = item
+                self.player_wakeup.clear()
+                track = self.queue.head()
+                if track is None:
+                    if self.playlist_cursors:
+                        # The next playlist page is still loading
+                        await self.player_wakeup.wait()
+                        continue
+                    # No more songs, exit the loop
+                    if self.song_count:
+                        self.outbox.notify("No more songs in the queue.")
+                    await self.start_inactivity_timer()
+                    break
+                if track.state != READY and track.partial is None:
+                    # Sleep until the downloader (or a queue edit) changes what's at the head
+                    await self.player_wakeup.wait()
+                    continue
+                self.queue.popleft()
+                # Play from the growing download only if it has not finished in the meantime
+                partial = track.partial if track.state != READY else None
+                track.state = PLAYING
+                self.current_track = track
+                prepared = self.take_next_source(track)
+                self.notify_queue_changed()
+                self.load_more_if_needed()
+                source, title, thumbnail_url, url, is_stream, codec, loudness = (
+                    partial or track.source, track.title, track.thumbnail, track.url, track.stream, track.codec,
+                    None if partial else track.loudness)
+                self.current_file = None if is_stream or partial else source
 
                 # Increment the song count before playing
                 self.song_count += 1
@@ -194,70 +1060,170 @@ class MusicPlayer:
                 self.is_paused = False  # Reset pause state
                 self.current_song = title
                 self.current_thumbnail = thumbnail_url
-                self.playback_finished_event.clear()
 
                 # Calculate total songs remaining (including current)
-                async with self.play_queue_lock:
-                    self.total_songs = len(self.play_queue) + 1  # +1 for current song
+                self.total_songs = len(self.queue) + 1  # +1 for current song
 
                 def after_playing(error):
                     if error:
                         print(f"Error playing audio: {error}")
+                        self.playback_error = error
                     # Close the audio source to release the file
                     if self.current_audio_source:
                         self.current_audio_source.cleanup()
                         self.current_audio_source = None
                     # Set is_playing to False
                     self.is_playing = False
+                    self.track_ended_at = time.monotonic()
                     # Signal that playback has ended
-                    bot.loop.call_soon_threadsafe(self.playback_finished_event.set)
-
-                self.current_audio_source = discord.FFmpegPCMAudio(filename)
-                self.current_voice_client.play(self.current_audio_source, after=after_playing)
-
-                # Send the now playing embed with the control buttons
-                embed = discord.Embed(title="🎵 Now Playing", color=discord.Color.purple())
-                embed.add_field(name=f"Song #{self.song_count}", value=title, inline=False)
-                if thumbnail_url:
-                    embed.set_thumbnail(url=thumbnail_url)
-                embed.set_footer(text="Use the buttons below to control playback")
-                view = MusicControlView(self)
-                await self.text_channel.send(embed=embed, view=view)
-
-                # Wait until the song is finished or skipped
-                await self.playback_finished_event.wait()
-                # Playback has finished
-
-                # Clean up audio source and file
-                if self.current_audio_source:
-                    self.current_audio_source.cleanup()
-                    self.current_audio_source = None
-                await self.cleanup_file(filename)
+                    loop.call_soon_threadsafe(self.playback_finished_event.set)
+
+                announced = False
+                while True:
+                    self.playback_finished_event.clear()
+                    self.playback_error = None
+                    self.skip_requested = False
+                    self.current_audio_source = prepared or self.create_audio_source(
+                        source, is_stream, codec, track.start_at, playback_gain(loudness))
+                    prepared = None
+                    self.current_voice_client.play(self.current_audio_source, after=after_playing)
+                    started = time.monotonic()
+                    self.is_playing = True
+                    self.position_offset = track.start_at
+                    self.position_started = started
+                    track.start_at = 0
+
+                    if not announced:
+                        if self.track_ended_at is not None:
+                            self.gaps.append(started - self.track_ended_at)
+                            track_gap_seconds.observe(started - self.track_ended_at, guild=self.guild_id)
+                            self.track_ended_at = None
+                        if self.play_requested_at is not None:
+                            time_to_first_audio_seconds.observe(started - self.play_requested_at, guild=self.guild_id)
+                            self.play_requested_at = None
+                        # A resumed track plays from position_offset, not from its start
+                        self.schedule_preload(track.duration and track.duration - self.position_offset)
+                        self.tracks_played += 1
+                        # Show the track on the now-playing message, which is edited in place
+                        embed = discord.Embed(title="🎵 Now Playing", color=discord.Color.purple())
+                        embed.add_field(name=f"Song #{self.song_count}", value=title, inline=False)
+                        if thumbnail_url:
+                            embed.set_thumbnail(url=thumbnail_url)
+                        embed.set_footer(text="Use the buttons below to control playback")
+                        if self.control_view is None:
+                            self.control_view = MusicControlView(self)
+                        self.outbox.show_now_playing(embed, self.control_view)
+                        announced = True
+
+                    # Wait until the song is finished or skipped
+                    await self.playback_finished_event.wait()
+                    # Playback has finished
+
+                    # Clean up audio source and file
+                    if self.current_audio_source:
+                        self.current_audio_source.cleanup()
+                        self.current_audio_source = None
+
+                    stream_failed = is_stream and not self.skip_requested and not self.stop_event.is_set() and (
+                        self.playback_error is not None or time.monotonic() - started < STREAM_FAILURE_WINDOW)
+                    if not stream_failed:
+                        break
+                    # The stream broke before it really started; fall back to the download path
+                    print(f"Stream for {title} failed, downloading instead")
+                    source, title, thumbnail_url, codec, loudness = await self.download_and_convert(url)
+                    is_stream = False
+                    self.current_file = source
+
+                if partial:
+                    partial.close()
+                    track.partial = None
+                    if track.task:
+                        # Skipped before its download finished
+                        track.cancel_download()
+                        track.task.cancel()
+                elif not is_stream:
+                    await self.cleanup_file(source)
+                    self.current_file = None
+                self.release_disk(track)
+                self.current_track = None
+                self.position_started = None
 
                 # Check if there are more songs to play
-                async with self.play_queue_lock:
-                    if not self.play_queue and (self.downloader_task is None or self.downloader_task.done()):
-                        if self.text_channel:
-                            await self.text_channel.send("No more songs in the queue.")
-                        await self.start_inactivity_timer()
-                        break  # Exit the loop since there are no more songs
+                if not self.queue and not self.playlist_cursors:
+                    self.outbox.notify("No more songs in the queue.")
+                    await self.start_inactivity_timer()
+                    break  # Exit the loop since there are no more songs
 
             except asyncio.CancelledError:
                 break
             except Exception as e:
                 print(f"Error in player: {e}")
-                if self.text_channel:
-                    await self.text_channel.send(f"An error occurred during playback: {e}")
+                self.outbox.notify(f"An error occurred during playback: {e}")
                 break
         print("Player has exited")
 
+    def playback_position(self):
+        if self.current_track is None:
+            return 0.0
+        if self.position_started is None:
+            return self.position_offset
+        return self.position_offset + time.monotonic() - self.position_started
+
+    def session_key(self):
+        # Changes whenever the snapshot would, except for the playback position
+        return (self.changes, self.current_track, self.voice_channel, self.text_channel)
+
+    def snapshot(self):
+        """The session to save, or None when there is nothing to resume."""
+        if self.current_track is None and not self.queue and not self.playlist_cursors:
+            return None
+        return {
+            'voice_channel': getattr(self.voice_channel, 'id', None),
+            'text_channel': getattr(self.text_channel, 'id', None),
+            'current': self.current_track.to_dict() if self.current_track else None,
+            'position': self.playback_position(),
+            'queue': [track.to_dict() for track in self.queue],
+            'cursors': [dict(cursor) for cursor in self.playlist_cursors],
+        }
+
+    async def resume_session(self, session, voice_channel, text_channel):
+        # Rebuild the queue of a session saved before a restart, with the interrupted track at
+        # its head, and pick up playback where it stopped. Files that are still on disk are
+        # played as they are; anything else is downloaded again.
+        tracks = []
+        for entry in [session['current'], *session['queue']]:
+            if not entry:
+                continue
+            path = entry.get('file')
+            if path and (not os.path.exists(path) or (audio_cache and audio_cache.owns(path)
+                                                      and not audio_cache.pin(path))):
+                entry = dict(entry, file=None)
+            track = Track.from_dict(entry)
+            if track.state == READY:
+                track.size = os.path.getsize(track.source)
+                self.held.add(track)
+                if not (audio_cache and audio_cache.owns(track.source)):
+                    hold_file(track.source)
+            tracks.append(track)
+        if session['current'] and tracks:
+            tracks[0].start_at = session['position']
+        self.voice_channel = voice_channel
+        self.text_channel = text_channel
+        self.current_voice_client = await voice_channel.connect()
+        self.playlist_cursors.extend(session['cursors'])
+        self.queue.extend(tracks)
+        if tracks and tracks[0].state == READY:
+            self.first_song_ready.set()
+        self.notify_queue_changed()
+        await self.start()
+        self.outbox.notify(f"Resumed after a restart with {len(tracks)} track(s) in the queue.")
+        return tracks
+
     async def playback_ended(self):
         # This method is called when playback of a song ends
-        async with self.play_queue_lock:
-            if not self.play_queue and (self.downloader_task is None or self.downloader_task.done()):
-                if self.text_channel:
-                    await self.text_channel.send("No more songs in the queue.")
-                await self.start_inactivity_timer()
+        if not self.queue and not self.playlist_cursors:
+            self.outbox.notify("No more songs in the queue.")
+            await self.start_inactivity_timer()
 
     async def start_inactivity_timer(self):
         if self.inactivity_task and not self.inactivity_task.done():
@@ -268,85 +1234,199 @@ class MusicPlayer:
         try:
             await asyncio.sleep(300)  # Wait for 5 minutes
             if not self.is_playing and self.current_voice_client and self.current_voice_client.is_connected():
-                await self.text_channel.send("No activity for 5 minutes. Disconnecting...")
+                self.outbox.notify("No activity for 5 minutes. Disconnecting...")
                 await self.cleanup()
         except asyncio.CancelledError:
             pass
 
     async def cleanup_file(self, filename):
-        if filename and os.path.exists(filename):
-            try:
-                os.remove(filename)
-            except PermissionError:
-                print(f"Could not delete file {filename}. It will be deleted later.")
+        # Another queued or playing track may share the file
+        if filename and drop_file(filename):
+            remove_file(filename)
 
-    async def add_to_queue(self, url, play_next=False):
+    async def add_to_queue(self, url, play_next=False, stream=None):
         if self.stop_event.is_set():
             # The bot is stopping or has been stopped; do not add to the queue
+            return 0
+
+        # Extract basic info without downloading; playlists only get their first page
+        info = await extract_info(url, fields=('_type', 'title', 'duration', 'entries', 'playlist_count'),
+                                  flat=True, playlist_items=playlist_page(1), guild=self.guild_id)
+
+        # Check after the potentially long operation
+        if self.stop_event.is_set():
+            return 0
+
+        if info['entries'] is not None:  # It's a playlist
+            added = await self.add_entries(info['entries'], play_next=play_next, stream=stream)
+            if not play_next:
+                self.follow_playlist(url, info, stream)
+            return added
+        # It's a single video
+        return await self.add_entries([{'url': url, 'title': info['title'], 'duration': info['duration']}],
+                                      play_next=play_next, stream=stream)
+
+    def follow_playlist(self, url, first_page, stream):
+        # Remember a playlist whose first page was full so later pages load as the queue drains
+        total = first_page['playlist_count']
+        if len(first_page['entries'] or []) < PLAYLIST_PAGE_SIZE or (total and total <= PLAYLIST_PAGE_SIZE):
+            return False
+        self.playlist_cursors.append({'url': url, 'stream': stream, 'next': PLAYLIST_PAGE_SIZE + 1, 'total': total})
+        self.load_more_if_needed()
+        return True
+
+    def load_more_if_needed(self):
+        if not self.playlist_cursors or len(self.queue) >= PLAYLIST_LOW_WATER:
+            return
+        if self.page_task is None or self.page_task.done():
+            self.page_task = self.spawn(self.load_next_page())
+
+    async def load_next_page(self):
+        cursor = self.playlist_cursors[0]
+        start = cursor['next']
+        try:
+            info = await extract_info(cursor['url'], fields=('entries', 'playlist_count'), guild=self.guild_id,
+                                      flat=True, playlist_items=playlist_page(start))
+        except Exception as e:
+            print(f"Error loading playlist page {start} of {cursor['url']}: {e}")
+            self.playlist_cursors.remove(cursor)
+            # The player may be waiting on this page
+            self.notify_queue_changed()
+            return
+        if self.stop_event.is_set() or cursor not in self.playlist_cursors:
             return
+        entries = info['entries'] or []
+        cursor['next'] = start + PLAYLIST_PAGE_SIZE
+        cursor['total'] = info['playlist_count'] or cursor['total']
+        if len(entries) < PLAYLIST_PAGE_SIZE or (cursor['total'] and cursor['next'] > cursor['total']):
+            self.playlist_cursors.remove(cursor)
+        await self.add_entries(entries, stream=cursor['stream'])
+        print(f"Loaded {len(entries)} more tracks from {cursor['url']}")
+        # A short page may still leave the queue below the low-water mark
+        self.page_task = None
+        self.load_more_if_needed()
+
+    def pending_playlist_tracks(self):
+        # Tracks still to be loaded from followed playlists, and whether that count is exact
+        remaining = 0
+        exact = True
+        for cursor in self.playlist_cursors:
+            if cursor['total']:
+                remaining += max(cursor['total'] - cursor['next'] + 1, 0)
+            else:
+                exact = False
+        return remaining, exact
+
+    async def add_entries(self, entries, play_next=False, stream=None):
+        # Enqueue flat playlist entries as they are, in one batch, without resolving each one
+        if self.stop_event.is_set():
+            return 0
 
         # Cancel inactivity timer if running
         if self.inactivity_task and not self.inactivity_task.done():
             self.inactivity_task.cancel()
             self.inactivity_task = None
-        
-        # Extract basic info without downloading
-        loop = asyncio.get_event_loop()
-        with yt_dlp.YoutubeDL({'format': 'bestaudio', 'noplaylist': False}) as ydl:
-            info = await loop.run_in_executor(None, lambda: ydl.extract_info(url, download=False))
-        
-            # Check after the potentially long operation
+
+        if stream is None:
+            stream = PLAYBACK_MODE == 'stream'
+
+        tracks = [Track(entry['url'], entry.get('title'), stream, entry.get('duration'))
+                  for entry in entries if entry and entry.get('url')]
+        self.queue.extend(tracks, front=play_next)
+        self.notify_queue_changed()
+
+        untitled = [track for track in tracks if not track.title]
+        if untitled:
+            self.spawn(self.fetch_missing_titles(untitled))
+        return len(tracks)
+
+    async def fetch_missing_titles(self, tracks):
+        # Some flat entries come without a title; resolve those in the background. The full
+        # result lands in the metadata cache, so the downloader reuses it later.
+        for track in tracks:
             if self.stop_event.is_set():
                 return
+            if track.title or track not in self.queue:
+                continue
+            try:
+                info = await extract_info(track.url, fields=('title',), guild=self.guild_id)
+            except Exception as e:
+                print(f"Error fetching title for {track.url}: {e}")
+                continue
+            if not track.title and track in self.queue:
+                track.title = info['title']
+                self.queue.touch()
 
-        if 'entries' in info:  # It's a playlist
-            entries = info['entries']
-        else:  # It's a single video
-            entries = [info]
-        
-        for entry in entries:
-            if self.stop_event.is_set():
-                break
+    def spawn(self, coro):
+        # Run a background task that stop() cancels along with the rest
+        def forget(task):
+            if task in self.tasks:
+                self.tasks.remove(task)
 
-            title = entry.get('title', 'Unknown Title')
-            if play_next:
-                self.upcoming_queue.appendleft((url, title))
-                await self.download_queue.put(url)
-            else:
-                self.upcoming_queue.append((url, title))
-                await self.download_queue.put(url)
+        task = asyncio.create_task(coro)
+        self.tasks.append(task)
+        task.add_done_callback(forget)
+        return task
 
     async def skip_to_position(self, position):
-        if position < 1 or position > len(self.upcoming_queue):
+        if position < 1 or position > len(self.queue):
             return "Invalid position. Please provide a valid queue position."
         
+        # Remove songs before the desired position
+        await self.release_tracks(self.queue.skip_to(position - 1))
+        self.load_more_if_needed()
+
         # Skip current song
         if self.current_voice_client and self.current_voice_client.is_playing():
+            self.skip_requested = True
             self.current_voice_client.stop()
         
-        # Remove songs before the desired position
-        for _ in range(position - 1):
-            self.upcoming_queue.popleft()
-            async with self.play_queue_lock:
-                if self.play_queue:
-                    self.play_queue.popleft()
-        
         return f"Skipped to position {position} in the queue."
 
-    async def get_queue(self):
-        if self.current_song:
-            now_playing = self.current_song
-            thumbnail_url = self.current_thumbnail
-        else:
-            now_playing = "No song is currently playing."
-            thumbnail_url = None
-        
-        upcoming_songs = [f"{idx + 1}. {title}" for idx, (_, title) in enumerate(self.upcoming_queue)]
-        
-        if not upcoming_songs:
-            upcoming_songs.append("The queue is empty.")
-        
-        return now_playing, upcoming_songs, thumbnail_url
+    async def remove_at_position(self, position):
+        if position < 1 or position > len(self.queue):
+            return "Invalid position. Please provide a valid queue position."
+        track = self.queue.remove_at(position - 1)
+        await self.release_tracks([track])
+        self.load_more_if_needed()
+        return f"Removed {track.title or track.url} from the queue."
+
+    async def move_position(self, from_position, to_position):
+        size = len(self.queue)
+        if not (1 <= from_position <= size and 1 <= to_position <= size):
+            return "Invalid position. Please provide a valid queue position."
+        track = self.queue.move(from_position - 1, to_position - 1)
+        # The track may have moved into (or out of) the download window
+        self.notify_queue_changed()
+        return f"Moved {track.title or track.url} to position {to_position}."
+
+    def queue_page(self, page):
+        # Only the requested page is formatted, and it is kept until the queue changes, so
+        # paging through a long queue costs the same per click whatever its length
+        pages = max(1, -(-len(self.queue) // QUEUE_PAGE_SIZE))
+        page = min(max(page, 0), pages - 1)
+        if self.queue_pages_version != self.queue.version:
+            self.queue_pages = {}
+            self.queue_pages_version = self.queue.version
+        text = self.queue_pages.get(page)
+        if text is None:
+            start = page * QUEUE_PAGE_SIZE
+            text = "\n".join(f"{start + offset + 1}. {shorten(track.title or 'Loading title...')}"
+                             for offset, track in enumerate(self.queue[start:start + QUEUE_PAGE_SIZE]))
+            text = text or "The queue is empty."
+            self.queue_pages[page] = text
+        return text, page, pages
+
+    def queue_footer(self):
+        queued = len(self.queue)
+        remaining, exact = self.pending_playlist_tracks()
+        if remaining and exact:
+            return f"{queued} queued, {queued + remaining} in total. Use /play to add more songs!"
+        if self.playlist_cursors:
+            # The playlist did not report its length; at least one more page is coming
+            return f"{queued} queued, at least {queued + remaining + 1} in total. Use /play to add more songs!"
+        return f"{queued} queued. Use /play to add more songs!"
+
 
     async def stop(self):
         self.stop_event.set()
@@ -357,11 +1437,33 @@ class MusicPlayer:
             task.cancel()
         self.tasks.clear()
 
+        # Cancel the downloader (and its in-flight downloads) and the player
+        # instead of waiting for them to notice stop_event
+        for task in (self.downloader_task, self.player_task):
+            if task and not task.done() and task is not asyncio.current_task():
+                task.cancel()
+        self.downloader_task = None
+        self.player_task = None
+
         # Cancel inactivity timer if running
         if self.inactivity_task and not self.inactivity_task.done():
             self.inactivity_task.cancel()
             self.inactivity_task = None
 
+        # Close the pre-opened next source
+        if self.preload_task:
+            self.preload_task.cancel()
+            self.preload_task = None
+        self.preload_due = False
+        self.discard_next_source()
+        self.play_requested_at = None
+
+        # The next session gets a fresh now-playing message and view
+        self.outbox.reset_now_playing()
+        if self.control_view is not None:
+            self.control_view.stop()
+            self.control_view = None
+
         # Disconnect from voice channel if connected
         if self.current_voice_client and self.current_voice_client.is_connected():
             self.current_voice_client.stop()
@@ -380,19 +1482,32 @@ class MusicPlayer:
         self.song_count = 0
 
         # Clear and reset queues
-        self.download_queue = asyncio.Queue()
-        async with self.play_queue_lock:
-            self.play_queue = deque()
-        self.upcoming_queue = deque()
+        await self.release_tracks(self.queue.clear())
+        if self.current_file:
+            await self.cleanup_file(self.current_file)
+            self.current_file = None
+        if self.current_track and self.current_track.partial:
+            self.current_track.partial.close()
+            self.current_track.partial = None
+        for track in self.held:
+            track.size = 0
+        self.held.clear()
+        download_budget.report(self.guild_id, 0)
+        self.current_track = None
+        self.position_started = None
+        self.playlist_cursors.clear()
 
         # Remove any remaining downloaded files, including partial files
-        for filename in os.listdir('downloads'):
-            file_path = os.path.join('downloads', filename)
-            try:
-                if os.path.isfile(file_path):
-                    os.remove(file_path)
-            except Exception as e:
-                print(f"Failed to delete {file_path}. Reason: {e}")
+        remove_unused_downloads(self.download_dir)
+
+    def is_idle(self):
+        if self.is_playing or self.is_paused:
+            return False
+        if self.current_voice_client and self.current_voice_client.is_connected():
+            return False
+        if any(not task.done() for task in self.tasks):
+            return False
+        return not self.queue
 
     async def cleanup(self):
         # Cancel inactivity timer if running
@@ -406,38 +1521,38 @@ class MusicPlayer:
         self.tasks.clear()
 
         await self.stop()
-        if self.text_channel:
-            await self.text_channel.send("Playback stopped and queue cleared.")
+        self.outbox.notify("Playback stopped and queue cleared.")
 
     async def pause(self):
         if self.current_voice_client and self.current_voice_client.is_playing():
             self.current_voice_client.pause()
             self.is_paused = True
+            self.position_offset = self.playback_position()
+            self.position_started = None
 
     async def resume(self):
         if self.current_voice_client and self.current_voice_client.is_paused():
             self.current_voice_client.resume()
             self.is_paused = False
+            self.position_started = time.monotonic()
 
     async def skip_current_song(self):
         if self.current_voice_client and (self.current_voice_client.is_playing() or self.is_paused):
+            self.skip_requested = True
             self.current_voice_client.stop()
             self.is_playing = False
             self.is_paused = False
             
-            async with self.play_queue_lock:
-                if not self.play_queue and self.download_queue.empty():
-                    return "Last track skipped. There are no more songs in the queue."
+            if not self.queue:
+                return "Last track skipped. There are no more songs in the queue."
             return "Track skipped."
         return "There's nothing playing to skip."
 
     async def clear_upcoming_queue(self):
-        # Clear the download queue
-        while not self.download_queue.empty():
-            self.download_queue.get_nowait()
-        # Clear the play queue
-        async with self.play_queue_lock:
-            self.play_queue.clear()
+        # Drop every upcoming track, cancelling its download or releasing its file
+        await self.release_tracks(self.queue.clear())
+        # Stop following playlists that still had pages to load
+        self.playlist_cursors.clear()
         # Reset total_songs count
         self.total_songs = 1  # Only the current song remains
 
@@ -496,15 +1611,8 @@ class MusicControlView(discord.ui.View):
     @discord.ui.button(label='View Queue', style=discord.ButtonStyle.secondary, emoji='📜')
     async def view_queue_button(self, interaction: discord.Interaction, button: discord.ui.Button):
         try:
-            now_playing, upcoming_songs, thumbnail_url = await self.music_player.get_queue()
-            embed = discord.Embed(title="🎵 Music Queue", color=discord.Color.blue())
-            embed.add_field(name="🎧 Now Playing", value=now_playing, inline=False)
-            if thumbnail_url:
-                embed.set_thumbnail(url=thumbnail_url)
-            if upcoming_songs:
-                embed.add_field(name="📜 Up Next", value="\n".join(upcoming_songs), inline=False)
-            embed.set_footer(text="Use /play to add more songs!")
-            await interaction.response.send_message(embed=embed, ephemeral=True)
+            view = QueueView(self.music_player)
+            await interaction.response.send_message(embed=view.render(), view=view, ephemeral=True)
         except Exception as e:
             print(f"Error in view_queue_button: {e}")
             if not interaction.response.is_done():
@@ -514,6 +1622,65 @@ class MusicControlView(discord.ui.View):
     async def skip_to_button(self, interaction: discord.Interaction, button: discord.ui.Button):
         await interaction.response.send_modal(SkipToModal(self.music_player))
 
+class QueueView(discord.ui.View):
+    """One page of the queue with buttons to move between pages."""
+
+    def __init__(self, music_player: MusicPlayer, page=0):
+        super().__init__(timeout=300)
+        self.music_player = music_player
+        self.page = page
+
+    def render(self):
+        text, self.page, pages = self.music_player.queue_page(self.page)
+        embed = discord.Embed(title="🎵 Music Queue", color=discord.Color.blue())
+        if self.music_player.current_song:
+            embed.add_field(name="🎧 Now Playing", value=self.music_player.current_song, inline=False)
+            if self.music_player.current_thumbnail:
+                embed.set_thumbnail(url=self.music_player.current_thumbnail)
+        else:
+            embed.add_field(name="🎧 Now Playing", value="No song is currently playing.", inline=False)
+        embed.add_field(name=f"📜 Up Next (page {self.page + 1}/{pages})", value=text, inline=False)
+        embed.set_footer(text=self.music_player.queue_footer())
+        self.previous_button.disabled = self.page == 0
+        self.next_button.disabled = self.page >= pages - 1
+        return embed
+
+    @discord.ui.button(label='Previous', style=discord.ButtonStyle.secondary, emoji='◀️')
+    async def previous_button(self, interaction: discord.Interaction, button: discord.ui.Button):
+        self.page -= 1
+        await interaction.response.edit_message(embed=self.render(), view=self)
+
+    @discord.ui.button(label='Next', style=discord.ButtonStyle.secondary, emoji='▶️')
+    async def next_button(self, interaction: discord.Interaction, button: discord.ui.Button):
+        self.page += 1
+        await interaction.response.edit_message(embed=self.render(), view=self)
+
+class SearchView(discord.ui.View):
+    """Search results with a menu that queues the picked track, as /play would."""
+
+    def __init__(self, query, results, source):
+        super().__init__(timeout=300)
+        self.query = query
+        self.results = results[:25]
+        self.source = source
+        self.pick.options = [
+            discord.SelectOption(label=shorten(title, 100), value=str(i),
+                                 description=format_duration(duration) if duration else None)
+            for i, (_, title, duration) in enumerate(self.results)]
+
+    def render(self):
+        lines = [f"{i}. [{shorten(title)}]({url})" + (f" ({format_duration(duration)})" if duration else "")
+                 for i, (url, title, duration) in enumerate(self.results, 1)]
+        embed = discord.Embed(title=f"🔎 {shorten(self.query, 200)}", description="\n".join(lines),
+                              color=discord.Color.blue())
+        embed.set_footer(text=self.source)
+        return embed
+
+    @discord.ui.select(placeholder='Pick a track to queue')
+    async def pick(self, interaction: discord.Interaction, select: discord.ui.Select):
+        url = self.results[int(select.values[0])][0]
+        await play.callback(interaction, url, None)
+
 class SkipToModal(discord.ui.Modal, title='Skip To Position'):
     position = discord.ui.TextInput(label='Queue Position', placeholder='Enter a number')
 
@@ -529,22 +1696,219 @@ class SkipToModal(discord.ui.Modal, title='Skip To Position'):
         except ValueError:
             await interaction.response.send_message("Please enter a valid number.", ephemeral=True)
 
-music_player = MusicPlayer()
-
-@bot.event
-async def on_ready():
-    print(f'Logged in as {bot.user}')
+class PlayerManager:
+    """Keeps one MusicPlayer per guild, created on first use and evicted once idle."""
+
+    def __init__(self, idle_timeout=IDLE_PLAYER_TIMEOUT):
+        self.players = {}
+        self.idle_timeout = idle_timeout
+        self.eviction_task = None
+        self.session_task = None
+
+    def get(self, guild_id):
+        player = self.players.get(guild_id)
+        if player is None:
+            player = MusicPlayer(guild_id)
+            self.players[guild_id] = player
+        player.last_active = time.monotonic()
+        return player
+
+    def __len__(self):
+        return len(self.players)
+
+    async def evict_idle(self):
+        now = time.monotonic()
+        evicted = 0
+        for guild_id, player in list(self.players.items()):
+            if now - player.last_active < self.idle_timeout or not player.is_idle():
+                continue
+            # Drop the player before awaiting so a concurrent get() builds a fresh one
+            del self.players[guild_id]
+            try:
+                await player.stop()
+                player.outbox.stop()
+                remove_unused_downloads(player.download_dir, remove_directory=True)
+            except Exception as e:
+                print(f"Error evicting player for guild {guild_id}: {e}")
+            metrics.forget(guild=guild_id)
+            download_budget.forget(guild_id)
+            evicted += 1
+        if evicted:
+            print(f"Evicted {evicted} idle player(s), {len(self.players)} remaining")
+
+    async def _eviction_loop(self):
+        while True:
+            await asyncio.sleep(60)
+            await self.evict_idle()
+
+    async def save_sessions(self):
+        # Rewrite a guild's session only when its queue changed; otherwise just the position
+        loop = asyncio.get_running_loop()
+        for guild_id, player in list(self.players.items()):
+            key = player.session_key()
+            try:
+                if key != player.saved_session:
+                    session = player.snapshot()
+                    if session is None:
+                        await loop.run_in_executor(None, session_store.delete, guild_id)
+                    else:
+                        await loop.run_in_executor(None, session_store.save, guild_id, session)
+                    player.saved_session = key
+                elif player.position_started is not None:
+                    await loop.run_in_executor(None, session_store.save_position, guild_id,
+                                               player.playback_position())
+            except Exception as e:
+                print(f"Error saving the session of guild {guild_id}: {e}")
+
+    async def _session_loop(self):
+        while True:
+            await asyncio.sleep(SESSION_SAVE_INTERVAL)
+            await self.save_sessions()
+
+    async def restore(self, sessions, get_channel):
+        # Resume every saved session at once; each mostly waits on its voice connection
+        gone = []
+
+        async def resume(guild_id, session):
+            voice_channel = get_channel(session['voice_channel']) if session['voice_channel'] else None
+            if voice_channel is None:
+                print(f"Not resuming guild {guild_id}: its voice channel is gone")
+                session_store.delete(guild_id)
+                gone.append(guild_id)
+                return False
+            text_channel = get_channel(session['text_channel']) if session['text_channel'] else None
+            player = self.get(guild_id)
+            try:
+                await player.resume_session(session, voice_channel, text_channel)
+                return True
+            except Exception as e:
+                print(f"Could not resume guild {guild_id}: {e}")
+                await player.stop()
+                return False
+
+        resumed = await asyncio.gather(*(resume(guild_id, session) for guild_id, session in sessions.items()))
+        # Only now that the resumed queues hold their files, some of which may be in these directories
+        for guild_id in gone:
+            remove_unused_downloads(os.path.join('downloads', str(guild_id)), remove_directory=True)
+        if resumed:
+            print(f"Resumed {sum(resumed)} of {len(resumed)} saved session(s)")
+
+    def start(self):
+        if self.eviction_task is None or self.eviction_task.done():
+            self.eviction_task = asyncio.create_task(self._eviction_loop())
+        if SESSION_SAVE_INTERVAL > 0 and (self.session_task is None or self.session_task.done()):
+            self.session_task = asyncio.create_task(self._session_loop())
+
+players = PlayerManager()
+
+
+def collect_queue_depth():
+    depth = {}
+    for guild_id, player in players.players.items():
+        counts = {PENDING: 0, DOWNLOADING: 0, READY: 0}
+        for track in player.queue:
+            counts[track.state] += 1
+        counts[PLAYING] = 1 if player.current_track else 0
+        for state, count in counts.items():
+            depth[(guild_id, state)] = count
+    return depth
+
+
+def collect_loop_lag():
+    lag = loop_lag.stats()
+    return {('0.5',): lag['p50'], ('0.99',): lag['p99'], ('1',): lag['max']}
+
+
+metrics.gauge('music_queue_tracks', 'Queued tracks per guild by stage', ('guild', 'state'), collect_queue_depth)
+metrics.gauge('music_voice_sessions', 'Connected voice sessions per guild', ('guild',), lambda: {
+    (guild_id,): 1 for guild_id, player in players.players.items()
+    if player.current_voice_client and player.current_voice_client.is_connected()})
+metrics.gauge('music_download_slots_busy', f'Download slots in use per guild, out of {DOWNLOAD_WORKERS}', ('guild',),
+              lambda: {(guild_id,): len(player.download_tasks) for guild_id, player in players.players.items()})
+metrics.counter('music_discord_api_calls_total', 'Messages sent and edited in text channels', ('guild', 'kind'),
+                lambda: {(guild_id, kind): count for guild_id, player in players.players.items()
+                         for kind, count in player.outbox.calls.items()})
+metrics.gauge('music_download_disk_bytes', 'Bytes of downloaded and downloading tracks on disk per guild',
+              ('guild',), lambda: {(guild_id,): used for guild_id, used in download_budget.usage.items()})
+metrics.gauge('music_download_budget_throttled', 'Whether downloads are held back by the global disk budget', (),
+              lambda: {(): int(download_budget.throttled)})
+metrics.gauge('music_extraction_workers_busy', 'Extraction worker processes running a job', (), lambda: {
+    (): extraction_pool.size - extraction_pool.idle.qsize()} if extraction_pool else {})
+metrics.gauge('music_media_workers', 'Media workers connected to the job broker', (), lambda: {
+    (): job_broker.stats()['workers']} if job_broker else {})
+metrics.gauge('music_media_jobs', 'Media jobs waiting for a worker or running on one', ('state',), lambda: {
+    ('queued',): job_broker.stats()['queued'], ('running',): job_broker.stats()['running']} if job_broker else {})
+metrics.gauge('music_default_executor_calls',
+              f"Calls running on the event loop's default executor, out of {default_executor.stats()['threads']} "
+              "threads, or waiting for one", ('state',),
+              lambda: {('busy',): default_executor.busy, ('queued',): default_executor.queued})
+metrics.gauge('music_event_loop_lag_seconds', 'Event loop wakeup lag over recent samples', ('quantile',),
+              collect_loop_lag)
+
+
+async def start_metrics():
+    global metrics_runner
+    if METRICS_PORT and metrics_runner is None:
+        try:
+            metrics_runner = await serve_metrics(metrics, METRICS_HOST, METRICS_PORT)
+        except OSError as e:
+            print(f"Could not serve metrics on port {METRICS_PORT}: {e}")
+
+def command_tree_hash():
+    commands = [command.to_dict(bot.tree) for command in bot.tree.get_commands()]
+    payload = json.dumps({'application': bot.application_id, 'commands': commands}, sort_keys=True)
+    return hashlib.sha256(payload.encode()).hexdigest()
+
+async def sync_commands():
+    # A global sync is rate limited and takes a while to reach every client, so it is only
+    # sent when the commands differ from the ones last synced
+    digest = command_tree_hash()
+    if session_store.get_setting('command_tree_hash') == digest:
+        print("Commands unchanged since the last sync")
+        return
     try:
         synced = await bot.tree.sync()
+        session_store.set_setting('command_tree_hash', digest)
         print(f"Synced {len(synced)} command(s)")
     except Exception as e:
         print(f"Error syncing commands: {e}")
 
+async def startup(get_channel):
+    # First connection only: sync commands and resume the sessions saved before the restart
+    await asyncio.gather(sync_commands(), players.restore(saved_sessions, get_channel))
+    saved_sessions.clear()
+    print(f"Ready {time.monotonic() - STARTED_AT:.2f}s after start")
+    loop = asyncio.get_running_loop()
+    loop.run_in_executor(None, warm_up)
+    loop.run_in_executor(None, title_index.load)
+
+started = False
+
+@bot.event
+async def on_ready():
+    global started
+    print(f'Logged in as {bot.user} ({bot.shard_count} shard(s), {len(bot.guilds)} guild(s))')
+    players.start()
+    loop_lag.start()
+    asyncio.get_running_loop().set_default_executor(default_executor)
+    await start_metrics()
+    if job_broker:
+        await job_broker.start()
+    # on_ready fires again after every reconnect, which needs none of this
+    if not started:
+        started = True
+        await startup(bot.get_channel)
+
 @bot.tree.command(name='play', description='Plays audio from a YouTube video or playlist')
-async def play(interaction: discord.Interaction, url: str):
+@app_commands.guild_only()
+@app_commands.describe(stream='Stream instead of downloading first (defaults to the server setting)')
+async def play(interaction: discord.Interaction, url: str, stream: bool = None):
+    music_player = players.get(interaction.guild_id)
     if music_player.stop_event.is_set():
         # Reset or restart the music player if needed
         music_player.stop_event.clear()
+    if not music_player.is_playing and music_player.play_requested_at is None:
+        music_player.play_requested_at = time.monotonic()
 
     try:
         await interaction.response.defer(ephemeral=True)
@@ -557,44 +1921,41 @@ async def play(interaction: discord.Interaction, url: str):
         await interaction.followup.send("Failed to connect to voice channel.", ephemeral=True)
         return
 
-    loop = asyncio.get_event_loop()
-
     async def process_playlist():
         try:
-            ydl_opts_flat = ydl_opts.copy()
-            ydl_opts_flat['extract_flat'] = True
-            with yt_dlp.YoutubeDL(ydl_opts_flat) as ydl:
-                info = await loop.run_in_executor(None, ydl.extract_info, url, False)
+            info = await extract_info(url, fields=('_type', 'entries', 'playlist_count'),
+                                      flat=True, playlist_items=playlist_page(1), guild=interaction.guild_id)
 
-                # Check if stop_event is set
-                if music_player.stop_event.is_set():
-                    return
+            # Check if stop_event is set
+            if music_player.stop_event.is_set():
+                return
 
-                if '_type' in info and info['_type'] == 'playlist':
-                    entries = info.get('entries', [])
-                    num_entries = len(entries)
-                    await interaction.followup.send(f"Adding {num_entries} tracks to the queue. This may take a moment for the queue to load.", ephemeral=True)
-                    if entries:
-                        # Start the player if not already started
-                        await music_player.start(interaction)
-                        # Add entries to the download queue asynchronously
-                        for entry in entries:
-                            if music_player.stop_event.is_set():
-                                break
-                            if entry:
-                                await music_player.add_to_queue(entry['url'])
+            if info['_type'] == 'playlist':
+                entries = info['entries'] or []
+                if entries:
+                    # Start the player first so the downloader picks up the first track right away
+                    await music_player.start(interaction)
+                    num_entries = await music_player.add_entries(entries, stream=stream)
+                    if music_player.follow_playlist(url, info, stream):
+                        total = info['playlist_count']
+                        more = f" of {total}" if total else ""
+                        await interaction.followup.send(
+                            f"Added the first {num_entries}{more} tracks to the queue. The rest will load as the queue plays.",
+                            ephemeral=True)
                     else:
-                        await interaction.followup.send("No entries found in playlist.", ephemeral=True)
+                        await interaction.followup.send(f"Added {num_entries} tracks to the queue.", ephemeral=True)
                 else:
-                    # Not a playlist, process as a single video
+                    await interaction.followup.send("No entries found in playlist.", ephemeral=True)
+            else:
+                # Not a playlist, process as a single video
 
-                    # Check if stop_event is set
-                    if music_player.stop_event.is_set():
-                        return
+                # Check if stop_event is set
+                if music_player.stop_event.is_set():
+                    return
 
-                    await music_player.add_to_queue(url)
-                    await interaction.followup.send("Added 1 track to the queue. This may take a moment.", ephemeral=True)
-                    await music_player.start(interaction)
+                await music_player.add_to_queue(url, stream=stream)
+                await interaction.followup.send("Added 1 track to the queue. This may take a moment.", ephemeral=True)
+                await music_player.start(interaction)
         except asyncio.CancelledError:
             print("process_playlist task was cancelled")
             return
@@ -614,8 +1975,46 @@ async def play(interaction: discord.Interaction, url: str):
     task.add_done_callback(task_done_callback)
     music_player.tasks.append(task)
 
+async def title_autocomplete(interaction: discord.Interaction, current: str):
+    # Answered from the in-memory title index only; Discord drops suggestions that arrive
+    # after 3 seconds. Choice values are limited to 100 characters.
+    if not current or current.startswith(('http://', 'https://')):
+        return []
+    return [app_commands.Choice(name=shorten(title + (f" ({format_duration(duration)})" if duration else ""), 100),
+                                value=url)
+            for url, title, duration in title_index.search(current, limit=25) if len(url) <= 100]
+
+play.autocomplete('url')(title_autocomplete)
+
+@bot.tree.command(name='search', description='Finds tracks by title among those played before, then on YouTube')
+@app_commands.guild_only()
+@app_commands.describe(query='Words from the title; typos are fine')
+async def search(interaction: discord.Interaction, query: str):
+    try:
+        await interaction.response.defer(ephemeral=True)
+    except discord.errors.NotFound:
+        print("Interaction timed out before we could defer it.")
+        return
+    results = title_index.search(query, limit=SEARCH_RESULTS, every_word=True)
+    source = "From tracks played before"
+    if not results:
+        source = "From YouTube"
+        try:
+            results = await search_remote(query, guild=interaction.guild_id)
+        except Exception as e:
+            print(f"Error searching for {query}: {e}")
+            await interaction.followup.send(f"An error occurred while searching: {e}", ephemeral=True)
+            return
+    if not results:
+        await interaction.followup.send(f"No tracks found for {shorten(query, 200)}.", ephemeral=True)
+        return
+    view = SearchView(query, results, source)
+    await interaction.followup.send(embed=view.render(), view=view, ephemeral=True)
+
 @bot.tree.command(name='stop', description='Stops playing audio and clears the queue')
+@app_commands.guild_only()
 async def stop(interaction: discord.Interaction):
+    music_player = players.get(interaction.guild_id)
     try:
         await interaction.response.defer()
         await music_player.stop()
@@ -626,7 +2025,9 @@ async def stop(interaction: discord.Interaction):
             await interaction.response.send_message(f"An error occurred: {e}", ephemeral=True)
 
 @bot.tree.command(name='skip', description='Skips the current track')
+@app_commands.guild_only()
 async def skip(interaction: discord.Interaction):
+    music_player = players.get(interaction.guild_id)
     try:
         result = await music_player.skip_current_song()
         await interaction.response.send_message(result)
@@ -636,7 +2037,9 @@ async def skip(interaction: discord.Interaction):
             await interaction.response.send_message(f"An error occurred: {e}", ephemeral=True)
 
 @bot.tree.command(name='leave', description='Disconnects the bot from the voice channel and clears the queue')
+@app_commands.guild_only()
 async def leave(interaction: discord.Interaction):
+    music_player = players.get(interaction.guild_id)
     try:
         await interaction.response.defer()
         await music_player.cleanup()
@@ -647,25 +2050,24 @@ async def leave(interaction: discord.Interaction):
             await interaction.response.send_message(f"An error occurred: {e}", ephemeral=True)
 
 @bot.tree.command(name='queue', description='Displays the current song queue')
-async def queue(interaction: discord.Interaction):
+@app_commands.guild_only()
+@app_commands.describe(page='Page of the queue to show')
+async def queue(interaction: discord.Interaction, page: int = 1):
+    music_player = players.get(interaction.guild_id)
     try:
         await interaction.response.defer()
-        now_playing, upcoming_songs, thumbnail_url = await music_player.get_queue()
-        embed = discord.Embed(title="🎵 Music Queue", color=discord.Color.blue())
-        embed.add_field(name="🎧 Now Playing", value=now_playing, inline=False)
-        if thumbnail_url:
-            embed.set_thumbnail(url=thumbnail_url)
-        if upcoming_songs:
-            embed.add_field(name="📜 Up Next", value="\n".join(upcoming_songs), inline=False)
-        embed.set_footer(text="Use /play to add more songs!")
-        await interaction.followup.send(embed=embed)
+        view = QueueView(music_player, page - 1)
+        await interaction.followup.send(embed=view.render(), view=view)
     except Exception as e:
         print(f"Error in queue command: {e}")
         if not interaction.response.is_done():
             await interaction.response.send_message(embed=discord.Embed(title="❌ Error", description=f"An error occurred: {e}", color=discord.Color.red()), ephemeral=True)
 
 @bot.tree.command(name='play_next', description='Adds a song to play immediately after the current song')
-async def play_next(interaction: discord.Interaction, url: str):
+@app_commands.guild_only()
+@app_commands.describe(stream='Stream instead of downloading first (defaults to the server setting)')
+async def play_next(interaction: discord.Interaction, url: str, stream: bool = None):
+    music_player = players.get(interaction.guild_id)
     try:
         await interaction.response.defer(ephemeral=True)
     except discord.errors.NotFound:
@@ -677,14 +2079,73 @@ async def play_next(interaction: discord.Interaction, url: str):
         await interaction.followup.send("Failed to connect to voice channel.", ephemeral=True)
         return
 
-    await music_player.add_to_queue(url, play_next=True)
+    await music_player.add_to_queue(url, play_next=True, stream=stream)
     await interaction.followup.send(embed=discord.Embed(title="🎵 Song Added", description="Your song will play next!", color=discord.Color.green()), ephemeral=True)
     
     if not music_player.is_playing:
         await music_player.start(interaction)
 
+play_next.autocomplete('url')(title_autocomplete)
+
+@bot.tree.command(name='cache_stats', description='Shows audio cache usage and hit rate')
+async def cache_stats(interaction: discord.Interaction):
+    if audio_cache is None:
+        await interaction.response.send_message("The audio cache is disabled.", ephemeral=True)
+        return
+    stats = audio_cache.stats()
+    lookups = stats['hits'] + stats['misses']
+    hit_rate = f"{stats['hits'] / lookups:.0%}" if lookups else "n/a"
+    embed = discord.Embed(title="💾 Audio Cache", color=discord.Color.blue())
+    embed.add_field(name="Hits", value=str(stats['hits']))
+    embed.add_field(name="Misses", value=str(stats['misses']))
+    embed.add_field(name="Hit Rate", value=hit_rate)
+    embed.add_field(name="Evictions", value=str(stats['evictions']))
+    embed.add_field(name="Files", value=str(stats['entries']))
+    embed.add_field(name="Size", value=f"{stats['bytes'] / 1e6:.1f} / {stats['max_bytes'] / 1e6:.0f} MB")
+    await interaction.response.send_message(embed=embed, ephemeral=True)
+
+@bot.tree.command(name='player_stats', description='Shows track gaps, Discord API calls, event loop lag and extraction workers')
+@app_commands.guild_only()
+async def player_stats(interaction: discord.Interaction):
+    music_player = players.get(interaction.guild_id)
+    embed = discord.Embed(title="📈 Player Stats", color=discord.Color.blue())
+    gaps = music_player.gap_stats()
+    if gaps:
+        embed.add_field(name="Track Gap", value=f"{gaps['p50'] * 1e3:.0f} ms median, {gaps['max'] * 1e3:.0f} ms max "
+                                                f"over {gaps['count']} transition(s)", inline=False)
+    else:
+        embed.add_field(name="Track Gap", value="No transitions yet", inline=False)
+    calls = music_player.outbox.calls
+    per_track = f", {sum(calls.values()) / music_player.tracks_played:.1f} per track" if music_player.tracks_played else ""
+    embed.add_field(name="Discord API Calls", value=f"{calls['send']} send(s), {calls['edit']} edit(s){per_track}",
+                    inline=False)
+    budget = download_budget.stats(interaction.guild_id)
+    guild_limit = f" of {budget['guild_max_bytes'] / 1e6:.0f}" if budget['guild_max_bytes'] else ""
+    total_limit = f" of {budget['max_bytes'] / 1e6:.0f}" if budget['max_bytes'] else ""
+    held_back = " Downloads are paused until usage drops." if budget['guild_throttled'] or budget['throttled'] else ""
+    embed.add_field(name="Downloads on Disk", value=f"{budget['guild_bytes'] / 1e6:.0f}{guild_limit} MB here, "
+                                                    f"{budget['bytes'] / 1e6:.0f}{total_limit} MB overall.{held_back}",
+                    inline=False)
+    lag = loop_lag.stats()
+    embed.add_field(name="Event Loop Lag", value=f"{lag['p50'] * 1e3:.1f} ms median, {lag['p99'] * 1e3:.1f} ms p99, "
+                                                 f"{lag['max'] * 1e3:.1f} ms max", inline=False)
+    if extraction_pool:
+        pool = extraction_pool.stats()
+        embed.add_field(name="Extraction Workers", value=f"{pool['workers']} worker(s), {pool['jobs']} job(s), "
+                                                         f"{pool['timeouts']} timeout(s), {pool['crashes']} crash(es)",
+                        inline=False)
+    if job_broker:
+        jobs = job_broker.stats()
+        embed.add_field(name="Media Workers", value=f"{jobs['workers']} worker(s) with {jobs['slots']} slot(s), "
+                                                    f"{jobs['running']} job(s) running, {jobs['queued']} queued, "
+                                                    f"{jobs['retries']} retried, {jobs['failures']} failed",
+                        inline=False)
+    await interaction.response.send_message(embed=embed, ephemeral=True)
+
 @bot.tree.command(name='clear_queue', description='Clears all upcoming songs in the queue')
+@app_commands.guild_only()
 async def clear_queue(interaction: discord.Interaction):
+    music_player = players.get(interaction.guild_id)
     try:
         await music_player.clear_upcoming_queue()
         await interaction.response.send_message("Upcoming queue cleared. Current song will continue playing.")
@@ -693,4 +2154,31 @@ async def clear_queue(interaction: discord.Interaction):
         if not interaction.response.is_done():
             await interaction.response.send_message(f"An error occurred: {e}", ephemeral=True)
 
-bot.run(DISCORD_BOT_TOKEN)
\ No newline at end of file
+@bot.tree.command(name='remove', description='Removes a song from the queue')
+@app_commands.guild_only()
+@app_commands.describe(position='Queue position of the song to remove')
+async def remove(interaction: discord.Interaction, position: int):
+    music_player = players.get(interaction.guild_id)
+    try:
+        result = await music_player.remove_at_position(position)
+        await interaction.response.send_message(result)
+    except Exception as e:
+        print(f"Error in remove command: {e}")
+        if not interaction.response.is_done():
+            await interaction.response.send_message(f"An error occurred: {e}", ephemeral=True)
+
+@bot.tree.command(name='move', description='Moves a song to another position in the queue')
+@app_commands.guild_only()
+@app_commands.describe(from_position='Current queue position of the song', to_position='Queue position to move it to')
+async def move(interaction: discord.Interaction, from_position: int, to_position: int):
+    music_player = players.get(interaction.guild_id)
+    try:
+        result = await music_player.move_position(from_position, to_position)
+        await interaction.response.send_message(result)
+    except Exception as e:
+        print(f"Error in move command: {e}")
+        if not interaction.response.is_done():
+            await interaction.response.send_message(f"An error occurred: {e}", ephemeral=True)
+
+if __name__ == '__main__':
+    bot.run(DISCORD_BOT_TOKEN)
@@ -0,0 +1,159 @@
+import json
+import os
+import re
+import shutil
+import threading
+import uuid
+from collections import OrderedDict
+
+TEMP_PREFIX = '.tmp-'
+
+
+class AudioCache:
+    """Finished audio files keyed by extractor and video id, evicted LRU-first once over budget.
+
+    Each entry is an audio file plus a JSON sidecar with the track's metadata. Both are
+    written under a temporary name and renamed into place, so a reader never sees a
+    half-written entry. Entries that are queued or playing are pinned and never evicted.
+    """
+
+    def __init__(self, directory, max_bytes):
+        self.directory = directory
+        self.max_bytes = max_bytes
+        self.entries = OrderedDict()  # key -> metadata dict, least recently used first
+        self.pins = {}  # key -> number of queued/playing users
+        self.path_keys = {}  # audio path -> key
+        self.total_bytes = 0
+        self.hits = 0
+        self.misses = 0
+        self.evictions = 0
+        self.lock = threading.Lock()
+        os.makedirs(directory, exist_ok=True)
+        self._load()
+
+    @staticmethod
+    def make_key(extractor, video_id):
+        return re.sub(r'[^A-Za-z0-9_-]', '_', f"{extractor}-{video_id}")
+
+    def _load(self):
+        found = []
+        for filename in os.listdir(self.directory):
+            path = os.path.join(self.directory, filename)
+            if filename.startswith(TEMP_PREFIX):
+                # Left over from a publish that never finished
+                os.remove(path)
+                continue
+            if not filename.endswith('.json'):
+                continue
+            try:
+                with open(path) as f:
+                    meta = json.load(f)
+                audio_path = os.path.join(self.directory, meta['file'])
+                found.append((os.path.getmtime(audio_path), filename[:-5], meta, audio_path))
+            except (OSError, ValueError, KeyError) as e:
+                print(f"Dropping unreadable cache entry {filename}: {e}")
+                os.remove(path)
+        for _, key, meta, audio_path in sorted(found, key=lambda item: item[0]):
+            meta['path'] = audio_path
+            meta['size'] = os.path.getsize(audio_path)
+            self.entries[key] = meta
+            self.path_keys[audio_path] = key
+            self.total_bytes += meta['size']
+        print(f"Audio cache: {len(self.entries)} file(s), {self.total_bytes / 1e6:.1f} MB")
+
+    def lookup(self, key):
+        """Return the metadata of a cached track and pin it, or None on a miss."""
+        with self.lock:
+            meta = self.entries.get(key)
+            if meta is None or not os.path.exists(meta['path']):
+                if meta is not None:
+                    self._drop(key)
+                self.misses += 1
+                return None
+            self.entries.move_to_end(key)
+            # Recency survives restarts through the file's mtime
+            os.utime(meta['path'])
+            self.pins[key] = self.pins.get(key, 0) + 1
+            self.hits += 1
+            return dict(meta)
+
+    def publish(self, key, source_path, metadata):
+        """Move a finished download into the cache, pin it and return its cached path."""
+        ext = os.path.splitext(source_path)[1]
+        audio_name = key + ext
+        audio_path = os.path.join(self.directory, audio_name)
+        temp_audio = os.path.join(self.directory, f"{TEMP_PREFIX}{uuid.uuid4().hex}{ext}")
+        temp_meta = os.path.join(self.directory, f"{TEMP_PREFIX}{uuid.uuid4().hex}.json")
+        # The download may live on another filesystem, so copy under a temporary name first
+        # and only rename once the whole file is there
+        shutil.move(source_path, temp_audio)
+        meta = dict(metadata, file=audio_name)
+        with open(temp_meta, 'w') as f:
+            json.dump(meta, f)
+        with self.lock:
+            os.replace(temp_audio, audio_path)
+            os.replace(temp_meta, os.path.join(self.directory, key + '.json'))
+            if key in self.entries:
+                self.total_bytes -= self.entries[key]['size']
+            meta['path'] = audio_path
+            meta['size'] = os.path.getsize(audio_path)
+            self.entries[key] = meta
+            self.entries.move_to_end(key)
+            self.path_keys[audio_path] = key
+            self.pins[key] = self.pins.get(key, 0) + 1
+            self.total_bytes += meta['size']
+            self._evict()
+        return audio_path
+
+    def owns(self, path):
+        return path in self.path_keys
+
+    def pin(self, path):
+        """Pin a cached file again, e.g. for a queue restored after a restart. False if it is gone."""
+        with self.lock:
+            key = self.path_keys.get(path)
+            if key is None or not os.path.exists(path):
+                return False
+            self.pins[key] = self.pins.get(key, 0) + 1
+            return True
+
+    def release(self, path):
+        """Unpin a cached file once the queue entry using it has played or been dropped."""
+        with self.lock:
+            key = self.path_keys.get(path)
+            if key is None or key not in self.pins:
+                return
+            self.pins[key] -= 1
+            if self.pins[key] <= 0:
+                del self.pins[key]
+            self._evict()
+
+    def _evict(self):
+        for key in list(self.entries):
+            if self.total_bytes <= self.max_bytes:
+                break
+            if key in self.pins:
+                continue
+            self._drop(key)
+            self.evictions += 1
+
+    def _drop(self, key):
+        meta = self.entries.pop(key)
+        self.path_keys.pop(meta['path'], None)
+        self.total_bytes -= meta['size']
+        for path in (meta['path'], os.path.join(self.directory, key + '.json')):
+            try:
+                os.remove(path)
+            except FileNotFoundError:
+                pass
+
+    def stats(self):
+        with self.lock:
+            return {
+                'hits': self.hits,
+                'misses': self.misses,
+                'evictions': self.evictions,
+                'entries': len(self.entries),
+                'bytes': self.total_bytes,
+                'max_bytes': self.max_bytes,
+            }
@@ -0,0 +1,98 @@
+"""CPU cost per voice stream of the old PCM pipeline and the Opus pipeline.
+
+Each pipeline is drained as fast as possible, and the CPU time spent (this process
+plus FFmpeg) is divided by the seconds of audio produced. Needs FFmpeg, and libopus
+for the PCM pipeline, which encodes in Python the way discord.py does for PCM sources.
+Run from the repository root:
+
+    python benchmarks/audio_pipeline.py [<audio file> ...]
+
+Without arguments a 60 second Opus and MP3 test tone are generated with FFmpeg.
+"""
+import os
+import resource
+import subprocess
+import sys
+import tempfile
+import time
+
+import discord
+
+FRAME_SECONDS = 0.02
+
+
+def generate_samples(directory):
+    samples = []
+    for codec, ext in (('libopus', 'opus'), ('libmp3lame', 'mp3')):
+        path = os.path.join(directory, f'tone.{ext}')
+        subprocess.run(
+            ['ffmpeg', '-loglevel', 'error', '-y', '-f', 'lavfi', '-i', 'sine=frequency=440:duration=60',
+             '-ac', '2', '-ar', '48000', '-c:a', codec, path],
+            check=True)
+        samples.append(path)
+    return samples
+
+
+def probe_codec(path):
+    result = subprocess.run(
+        ['ffprobe', '-v', 'error', '-select_streams', 'a:0', '-show_entries', 'stream=codec_name',
+         '-of', 'default=nokey=1:noprint_wrappers=1', path],
+        capture_output=True, text=True)
+    return result.stdout.strip() or None
+
+
+def cpu_seconds():
+    own = resource.getrusage(resource.RUSAGE_SELF)
+    children = resource.getrusage(resource.RUSAGE_CHILDREN)
+    return own.ru_utime + own.ru_stime + children.ru_utime + children.ru_stime
+
+
+def drain(audio_source, encoder=None):
+    frames = 0
+    while True:
+        data = audio_source.read()
+        if not data:
+            break
+        if encoder is not None:
+            encoder.encode(data, encoder.SAMPLES_PER_FRAME)
+        frames += 1
+    return frames
+
+
+def measure(name, make_source, encoder=None):
+    start_cpu = cpu_seconds()
+    start = time.perf_counter()
+    audio_source = make_source()
+    frames = drain(audio_source, encoder)
+    audio_source.cleanup()  # waits for FFmpeg so its CPU time is counted
+    wall = time.perf_counter() - start
+    cpu = cpu_seconds() - start_cpu
+    audio_seconds = frames * FRAME_SECONDS
+    # CPU seconds per second of audio is the fraction of one core a live stream needs
+    per_stream = cpu / audio_seconds if audio_seconds else float('nan')
+    print(f"{name:>16} {audio_seconds:>8.1f} {wall:>7.2f} {cpu:>7.2f} {per_stream * 100:>9.2f}% "
+          f"{1 / per_stream if per_stream else float('inf'):>10.0f}")
+
+
+def main(paths):
+    if not paths:
+        paths = generate_samples(tempfile.mkdtemp(prefix='bench-audio-'))
+    encoder = None
+    if discord.opus.is_loaded() or discord.opus._load_default():
+        encoder = discord.opus.Encoder()
+    else:
+        print("libopus not found, skipping the PCM pipeline")
+
+    print(f"{'pipeline':>16} {'audio s':>8} {'wall s':>7} {'cpu s':>7} {'cpu/strm':>10} {'strm/core':>10}")
+    for path in paths:
+        codec = probe_codec(path)
+        print(f"{os.path.basename(path)} ({codec})")
+        if encoder is not None:
+            measure('pcm+py-encode', lambda: discord.FFmpegPCMAudio(path), encoder)
+        measure('opus-transcode', lambda: discord.FFmpegOpusAudio(path))
+        if codec == 'opus':
+            measure('opus-copy', lambda: discord.FFmpegOpusAudio(path, codec='copy'))
+
+
+if __name__ == '__main__':
+    main(sys.argv[1:])
@@ -0,0 +1,131 @@
+"""How quickly clearing the queue releases a track's download slot, thread, files and FFmpeg.
+
+A fake extractor serves a slow download and a stand-in FFmpeg measures loudness or converts
+forever, so this runs offline; a conversion that fails must leave no files behind either.
+Exits non-zero if anything is still held after BOUND seconds. Run from the repository root:
+
+    python benchmarks/cancellation.py
+"""
+import asyncio
+import os
+import sys
+import time
+
+from fakes import FakeTextChannel, FakeYoutubeDL, prepare
+
+prepare('cancel', fake_ffmpeg=True, EXTRACT_WORKERS=0, AUDIO_CACHE_MAX_BYTES=0)
+
+import app  # noqa: E402
+
+BOUND = 1.0  # Seconds everything must be released within
+MEDIA_BYTES = 4 * 1024 * 1024
+
+
+def alive(pid):
+    try:
+        with open(f'/proc/{pid}/stat') as f:
+            return f.read().split(') ')[1][0] != 'Z'
+    except FileNotFoundError:
+        return False
+
+
+async def run(name, started, held):
+    player = app.MusicPlayer(guild_id=f'bench-cancel-{name}')
+    player.text_channel = FakeTextChannel()
+    await player.add_entries([{'url': f'https://fake.test/video/{name}', 'title': name}])
+    player.downloader_task = asyncio.create_task(player.downloader())
+    deadline = time.monotonic() + 30
+    while not started():
+        if time.monotonic() > deadline:
+            raise TimeoutError(f"{name}: the download never reached the point to cancel at")
+        await asyncio.sleep(0.005)
+
+    cleared = time.monotonic()
+    await player.clear_upcoming_queue()
+    released = {}
+    while time.monotonic() - cleared < BOUND and len(released) < len(held):
+        for what, check in held.items():
+            if what not in released and not check(player):
+                released[what] = time.monotonic() - cleared
+        await asyncio.sleep(0.001)
+    await player.stop()
+    return {what: released.get(what) for what in held}
+
+
+async def fail(name):
+    # A track whose conversion fails is dropped from the queue; its files must go with it
+    player = app.MusicPlayer(guild_id=f'bench-cancel-{name}')
+    player.text_channel = FakeTextChannel()
+    await player.add_entries([{'url': f'https://fake.test/video/{name}', 'title': name}])
+    player.downloader_task = asyncio.create_task(player.downloader())
+    deadline = time.monotonic() + 30
+    while len(player.queue):
+        if time.monotonic() > deadline:
+            raise TimeoutError(f"{name}: the conversion never failed")
+        await asyncio.sleep(0.005)
+    failed = time.monotonic()
+    while files_left(player) and time.monotonic() - failed < BOUND:
+        await asyncio.sleep(0.001)
+    released = None if files_left(player) else time.monotonic() - failed
+    await player.stop()
+    return {'files': released}
+
+
+def files_left(player):
+    return os.path.isdir(player.download_dir) and os.listdir(player.download_dir)
+
+
+def ffmpeg_running(job):
+    # When to cancel, and what must be released after, while the stand-in FFmpeg runs job
+    pid_file = os.path.abspath(f'ffmpeg-{job}.pid')
+    return lambda: os.path.exists(pid_file) and os.path.getsize(pid_file), {
+        'slot': lambda player: player.download_tasks,
+        'ffmpeg': lambda player: alive(int(open(pid_file).read())),
+        'files': files_left,
+    }
+
+
+async def main():
+    FakeYoutubeDL.media_path = os.path.abspath('media.bin')
+    with open(FakeYoutubeDL.media_path, 'wb') as f:
+        f.write(os.urandom(MEDIA_BYTES))
+    app.yt_dlp.YoutubeDL = FakeYoutubeDL
+
+    # Mid-transfer: ten seconds of download in small blocks, as yt-dlp's HTTP downloader reports them
+    FakeYoutubeDL.download_rate = MEDIA_BYTES / 10
+    FakeYoutubeDL.chunk_size = 16 * 1024
+    mid_download = await run('download', lambda: FakeYoutubeDL.active, {
+        'slot': lambda player: player.download_tasks,
+        'thread': lambda player: FakeYoutubeDL.active,
+        'files': files_left,
+    })
+
+    # Mid-measurement: a fast download whose loudness the stand-in FFmpeg never finishes measuring
+    FakeYoutubeDL.download_rate = 50e6
+    FakeYoutubeDL.chunk_size = 256 * 1024
+    os.environ['FAKE_FFMPEG_HANG'] = 'measure'
+    mid_measure = await run('measure', *ffmpeg_running('measure'))
+
+    # Mid-conversion: a fast download into a format the stand-in FFmpeg then never finishes
+    os.environ['FAKE_FFMPEG_HANG'] = 'convert'
+    FakeYoutubeDL.output_ext = 'webm'
+    mid_conversion = await run('conversion', *ffmpeg_running('convert'))
+
+    # A conversion that fails outright rather than being cancelled
+    del os.environ['FAKE_FFMPEG_HANG']
+    os.environ['FAKE_FFMPEG_FAIL'] = 'convert'
+    failed_conversion = await fail('failed')
+
+    failed = False
+    print(f"{'cancelled':>12} {'resource':>8} {'released after':>15}")
+    for name, released in (('mid-download', mid_download), ('mid-measure', mid_measure),
+                           ('mid-convert', mid_conversion), ('failed', failed_conversion)):
+        for what, after in released.items():
+            failed |= after is None
+            shown = f"{after * 1e3:12.1f} ms" if after is not None else f"  > {BOUND:g} s HELD"
+            print(f"{name:>12} {what:>8} {shown:>15}")
+    sys.exit(1 if failed else 0)
+
+
+if __name__ == '__main__':
+    asyncio.run(main())
@@ -0,0 +1,109 @@
+"""Cold start to ready: importing the bot, resuming saved sessions and deciding on a command sync.
+
+Saved sessions are seeded for GUILDS guilds, each with a track cut off mid-play and a queue
+whose first tracks were already downloaded. Voice, text channels and yt-dlp are faked, so
+this runs offline. Run from the repository root:
+
+    python benchmarks/cold_start.py
+"""
+import asyncio
+import os
+import sys
+import time
+
+from fakes import FakeAudioSource, FakeTextChannel, FakeVoiceChannel, FakeYoutubeDL, prepare
+
+prepare('cold-start', fake_ffmpeg=True, EXTRACT_WORKERS=0, METRICS_PORT=0, AUDIO_CACHE_MAX_BYTES=0)
+
+from session_store import SessionStore  # noqa: E402
+
+GUILDS = 20
+QUEUED = 50  # Upcoming tracks per guild
+DOWNLOADED = 3  # Of which already on disk
+POSITION = 42.0  # Seconds into the interrupted track
+
+
+def seed(path):
+    # What the previous process left behind: downloaded files and their saved sessions
+    os.makedirs(os.path.dirname(path), exist_ok=True)
+    store = SessionStore(path)
+    for guild_id in range(1, GUILDS + 1):
+        directory = os.path.join('downloads', str(guild_id))
+        os.makedirs(directory, exist_ok=True)
+        entries = []
+        for i in range(QUEUED + 1):
+            entry = {'url': f'https://fake.test/video/{guild_id}-{i}', 'title': f'Track {guild_id}-{i}',
+                     'duration': 180, 'stream': False}
+            if i <= DOWNLOADED:
+                entry.update(file=os.path.join(directory, f'{guild_id}-{i}.opus'), codec='opus', thumbnail=None)
+                with open(entry['file'], 'wb') as f:
+                    f.write(b'\0' * 4096)
+            entries.append(entry)
+        store.save(guild_id, {'voice_channel': guild_id, 'text_channel': -guild_id, 'current': entries[0],
+                              'position': POSITION, 'queue': entries[1:], 'cursors': []})
+    store.db.close()
+    # A leftover from the crash that no session refers to
+    with open(os.path.join('downloads', '1', 'stale.part'), 'wb') as f:
+        f.write(b'\0')
+
+
+async def resume(app):
+    channels = {}
+    for guild_id in range(1, GUILDS + 1):
+        channels[guild_id] = FakeVoiceChannel()
+        channels[-guild_id] = FakeTextChannel()
+    starts = []
+    app.MusicPlayer.create_audio_source = lambda self, source, is_stream, codec=None, start=0, gain=0: (
+        starts.append(start) or FakeAudioSource(source, 180))
+    syncs = []
+
+    async def sync():
+        syncs.append(time.monotonic())
+        return app.bot.tree.get_commands()
+    app.bot.tree.sync = sync
+
+    started = time.perf_counter()
+    await app.startup(channels.get)
+    while not all(channels[guild_id].voice_client and channels[guild_id].voice_client.plays
+                  for guild_id in range(1, GUILDS + 1)):
+        await asyncio.sleep(0.001)
+    to_audio = time.perf_counter() - started
+    # A second start with the same commands must not sync again
+    await app.sync_commands()
+    for player in app.players.players.values():
+        await player.stop()
+    return to_audio, starts, len(syncs)
+
+
+def main():
+    seed(os.path.join('cache', 'sessions.sqlite3'))
+    started = time.perf_counter()
+    import app
+    imported = time.perf_counter() - started
+    yt_dlp_loaded = 'yt_dlp.utils' in sys.modules
+    stale_removed = not os.path.exists(os.path.join('downloads', '1', 'stale.part'))
+    kept = sum(len(files) for _, _, files in os.walk('downloads'))
+
+    # What used to be paid at import: the first attribute access loads yt-dlp
+    started = time.perf_counter()
+    app.yt_dlp.utils
+    deferred = time.perf_counter() - started
+    app.yt_dlp.YoutubeDL = FakeYoutubeDL
+    started = time.perf_counter()
+    app.warm_up()
+    warm_up = time.perf_counter() - started
+
+    to_audio, starts, syncs = asyncio.run(resume(app))
+    print(f"{'import app':>32}: {imported * 1e3:7.0f} ms (yt-dlp loaded: {yt_dlp_loaded})")
+    print(f"{'yt-dlp import, deferred':>32}: {deferred * 1e3:7.0f} ms")
+    print(f"{'extractor warm-up, after ready':>32}: {warm_up * 1e3:7.0f} ms")
+    print(f"{'startup to first audio':>32}: {to_audio * 1e3:7.0f} ms for {GUILDS} resumed guilds")
+    print(f"{'downloaded files kept':>32}: {kept} of {GUILDS * (DOWNLOADED + 1)} (stale file removed: {stale_removed})")
+    resumed_at = sum(1 for start in starts if start == POSITION)
+    print(f"{'tracks resumed mid-way':>32}: {resumed_at} of {GUILDS}")
+    print(f"{'command syncs over two starts':>32}: {syncs}")
+    print(f"{'redownloads before first audio':>32}: {FakeYoutubeDL.downloads}")
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,97 @@
+"""Disk used by downloads while many guilds play long playlists, with and without the budget.
+
+Every synthetic guild queues a playlist that downloads faster than it plays, so without a
+budget each one fills its download lookahead. The files in downloads/ are measured directly
+while the guilds play, along with how long each player sat waiting for its next track. Runs
+offline; from the repository root:
+
+    python benchmarks/disk_budget.py [guilds]
+"""
+import asyncio
+import os
+import sys
+import time
+
+from fakes import FakeAudioSource, FakeTextChannel, FakeVoiceClient, FakeYoutubeDL, prepare
+
+prepare('budget', fake_ffmpeg=True, EXTRACT_WORKERS=0, METRICS_PORT=0, AUDIO_CACHE_MAX_BYTES=0,
+        SESSION_SAVE_INTERVAL=0, PROGRESSIVE_BUFFER_SECONDS=0)
+
+import app  # noqa: E402
+
+TRACK_BYTES = 1024 * 1024
+TRACK_TIME = 1.0  # Seconds each track plays
+TRACKS = 5  # Played per guild
+BUDGET = 60 * TRACK_BYTES
+GUILD_BUDGET = 4 * TRACK_BYTES
+
+
+def disk_bytes():
+    total = 0
+    for dirpath, _, filenames in os.walk('downloads'):
+        for filename in filenames:
+            try:
+                total += os.path.getsize(os.path.join(dirpath, filename))
+            except FileNotFoundError:
+                pass
+    return total
+
+
+async def run(guilds, budget, guild_budget):
+    app.download_budget = app.DownloadBudget(budget, guild_budget, app.DOWNLOAD_BUDGET_LOW_WATER)
+    players = []
+    for guild_id in range(guilds):
+        player = app.MusicPlayer(guild_id=f'budget-{budget}-{guild_id}')
+        player.current_voice_client = FakeVoiceClient()
+        player.text_channel = FakeTextChannel()
+        await player.add_entries([{'url': f'https://fake.test/video/{budget}-{guild_id}-{i}', 'title': f'Track {i}'}
+                                  for i in range(TRACKS * 3)])
+        await player.start()
+        players.append(player)
+
+    peak_disk = peak_counted = 0
+    started = time.monotonic()
+    while not all(len(player.current_voice_client.ends) >= TRACKS for player in players):
+        peak_disk = max(peak_disk, disk_bytes())
+        peak_counted = max(peak_counted, app.download_budget.total)
+        await asyncio.sleep(0.02)
+    elapsed = time.monotonic() - started
+    # Silence between tracks: the player waiting on a download held back by the budget
+    gaps = [start - end for player in players
+            for (start, _), end in zip(player.current_voice_client.plays[1:], player.current_voice_client.ends)]
+    pauses = app.download_budget.pauses
+    for player in players:
+        await player.stop()
+    return peak_disk, peak_counted, max(gaps), elapsed, pauses
+
+
+async def main(guilds):
+    FakeYoutubeDL.media_path = os.path.abspath('media.bin')
+    with open(FakeYoutubeDL.media_path, 'wb') as f:
+        f.write(os.urandom(TRACK_BYTES))
+    FakeYoutubeDL.download_rate = 20e6
+    FakeYoutubeDL.chunk_size = 64 * 1024
+    FakeYoutubeDL.track_duration = TRACK_TIME
+    app.yt_dlp.YoutubeDL = FakeYoutubeDL
+    app.MusicPlayer.create_audio_source = (
+        lambda self, source, is_stream, codec=None, start=0, gain=0: FakeAudioSource(source, TRACK_TIME))
+
+    print(f"{guilds} guilds, {TRACK_BYTES / 1e6:.1f} MB tracks, lookahead {app.DOWNLOAD_LOOKAHEAD}, "
+          f"{app.DOWNLOAD_WORKERS} download slots per guild")
+    print(f"{'budget':>22} {'peak on disk':>12} {'counted':>9} {'max gap':>9} {'pauses':>7} {'wall':>7}")
+    failed = False
+    for name, budget, guild_budget in (('none', 0, 0),
+                                       (f'{BUDGET / 1e6:.0f} MB, {GUILD_BUDGET / 1e6:.0f} MB/guild',
+                                        BUDGET, GUILD_BUDGET)):
+        peak_disk, peak_counted, max_gap, elapsed, pauses = await run(guilds, budget, guild_budget)
+        print(f"{name:>22} {peak_disk / 1e6:9.1f} MB {peak_counted / 1e6:6.1f} MB "
+              f"{max_gap * 1e3:6.0f} ms {pauses:7d} {elapsed:6.1f}s")
+        if budget:
+            # Every guild may still download its next track, and the slots already running
+            # finish their current block, so allow one track per guild over the budget
+            failed |= peak_disk > budget + guilds * TRACK_BYTES
+    sys.exit(1 if failed else 0)
+
+
+if __name__ == '__main__':
+    asyncio.run(main(int(sys.argv[1]) if len(sys.argv) > 1 else 20))
@@ -0,0 +1,84 @@
+"""Cold and warm /play resolution latency through the metadata cache.
+
+yt-dlp is replaced by a local fake extractor with a fixed latency, so this runs offline.
+Run from the repository root:
+
+    python benchmarks/extraction_cache.py
+"""
+import asyncio
+import time
+
+from fakes import prepare
+
+prepare('metadata', EXTRACT_WORKERS=0)
+
+import app  # noqa: E402
+from metadata_cache import MetadataCache  # noqa: E402
+
+EXTRACT_LATENCY = 0.4
+CONCURRENT_LOOKUPS = 20
+
+
+class FakeYoutubeDL:
+    calls = 0
+
+    def __init__(self, params=None):
+        self.params = params or {}
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc):
+        return False
+
+    def extract_info(self, url, download=False):
+        FakeYoutubeDL.calls += 1
+        time.sleep(EXTRACT_LATENCY)
+        video_id = url.rsplit('=', 1)[-1]
+        return {
+            'id': video_id, 'title': f'Track {video_id}', 'extractor_key': 'Youtube', 'duration': 200,
+            'thumbnail': f'https://i.ytimg.com/vi/{video_id}/hqdefault.jpg', 'webpage_url': url,
+            'url': f'https://media.example/{video_id}.webm', 'acodec': 'opus',
+            'formats': [{'format_id': str(i), 'url': f'https://media.example/{video_id}/{i}'} for i in range(30)],
+        }
+
+    @staticmethod
+    def sanitize_info(info):
+        return info
+
+
+async def resolve_play(url):
+    # The lookups one /play of a single video makes: process_playlist, add_to_queue, downloader
+    start = time.perf_counter()
+    await app.extract_info(url, fields=('_type', 'entries'), flat=True)
+    await app.extract_info(url, fields=('_type', 'title', 'entries'), flat=True)
+    await app.extract_info(url)
+    return time.perf_counter() - start
+
+
+async def main():
+    app.yt_dlp.YoutubeDL = FakeYoutubeDL
+    url = 'https://www.youtube.com/watch?v=bench0001'
+
+    print(f"{'scenario':>22} {'latency ms':>11} {'extractions':>12}")
+    for scenario in ('cold', 'warm (memory)', 'warm (sqlite)'):
+        if scenario == 'warm (sqlite)':
+            # A fresh process: empty memory tier, same database
+            app.metadata_cache = MetadataCache(
+                app.METADATA_CACHE_PATH, app.METADATA_MEMORY_ENTRIES, app.METADATA_TTL,
+                app.metadata_cache.field_ttls)
+        FakeYoutubeDL.calls = 0
+        latency = await resolve_play(url)
+        print(f"{scenario:>22} {latency * 1e3:>11.2f} {FakeYoutubeDL.calls:>12}")
+
+    FakeYoutubeDL.calls = 0
+    start = time.perf_counter()
+    await asyncio.gather(*(app.extract_info('https://www.youtube.com/watch?v=bench0002')
+                           for _ in range(CONCURRENT_LOOKUPS)))
+    latency = time.perf_counter() - start
+    print(f"{f'{CONCURRENT_LOOKUPS} concurrent, cold':>22} {latency * 1e3:>11.2f} {FakeYoutubeDL.calls:>12}")
+    print(app.metadata_cache.stats())
+
+
+if __name__ == '__main__':
+    asyncio.run(main())
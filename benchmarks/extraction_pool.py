@@ -0,0 +1,90 @@
+"""Event loop lag while extractions run on threads versus the extraction worker pool.
+
+Extraction is replaced by a CPU-bound stand-in, so this runs offline. Then the pages of a
+playlist are resolved as a worker resolves them, and must all be served by one warm
+YoutubeDL instance. Run from the repository root, exiting non-zero if that check fails:
+
+    python benchmarks/extraction_pool.py [jobs]
+"""
+import asyncio
+import sys
+import time
+
+from fakes import FakeYoutubeDL, parse_heavy, prepare
+
+prepare('extraction-pool')
+
+import extraction  # noqa: E402
+from extraction import ExtractionPool  # noqa: E402
+from loop_lag import LoopLagMonitor  # noqa: E402
+
+WORKERS = 4
+WORK = 0.2  # CPU seconds per extraction
+PAGES = 20  # Pages of a long playlist, more than a worker keeps instances warm
+PAGE_SIZE = 50
+
+
+async def measure(run_job, jobs):
+    monitor = LoopLagMonitor(interval=0.01, warn_after=0)
+    monitor.start()
+    await asyncio.sleep(0.2)
+    started = time.perf_counter()
+    await asyncio.gather(*(run_job(f'video{i}') for i in range(jobs)))
+    elapsed = time.perf_counter() - started
+    monitor.stop()
+    return elapsed, monitor.stats()
+
+
+async def main():
+    jobs = int(sys.argv[1]) if len(sys.argv) > 1 else 16
+    opts = {'work': WORK}
+    loop = asyncio.get_running_loop()
+    semaphore = asyncio.Semaphore(WORKERS)
+
+    async def on_threads(url):
+        async with semaphore:
+            return await loop.run_in_executor(None, parse_heavy, url, opts)
+
+    pool = ExtractionPool(WORKERS, timeout=30, job='benchmarks.fakes:parse_heavy')
+    # Start the workers first; a real bot pays this once at startup
+    await asyncio.gather(*(pool.run('warmup', {'work': 0}) for _ in range(WORKERS)))
+
+    print(f"{jobs} extractions of {WORK * 1e3:.0f} ms CPU each, {WORKERS} at a time")
+    print(f"{'mode':>14} {'total s':>8} {'lag p50 ms':>11} {'p99':>8} {'max':>8}")
+    for name, run_job in (('threads', on_threads), ('worker pool', lambda url: pool.run(url, opts))):
+        elapsed, lag = await measure(run_job, jobs)
+        print(f"{name:>14} {elapsed:>8.2f} {lag['p50'] * 1e3:>11.1f} {lag['p99'] * 1e3:>8.1f} {lag['max'] * 1e3:>8.1f}")
+    await pool.close()
+    sys.exit(0 if playlist_pages() else 1)
+
+
+class CountedYoutubeDL(FakeYoutubeDL):
+    created = 0
+    extract_latency = 0
+
+    def __init__(self, params=None):
+        super().__init__(params)
+        CountedYoutubeDL.created += 1
+
+    def close(self):
+        pass
+
+
+def playlist_pages():
+    # Each page differs only in playlist_items, which must not cost a YoutubeDL of its own
+    extraction.yt_dlp.YoutubeDL = CountedYoutubeDL
+    url = f'https://fake.test/playlist/long-{PAGES * PAGE_SIZE}'
+    pages = []
+    for page in range(PAGES):
+        items = f'{page * PAGE_SIZE + 1}-{(page + 1) * PAGE_SIZE}'
+        pages.append(extraction.extract(url, {'extract_flat': True, 'playlist_items': items})['entries'])
+    whole = extraction.extract(url, {'extract_flat': True})['entries']
+    ok = (CountedYoutubeDL.created == 1 and all(len(entries) == PAGE_SIZE for entries in pages)
+          and pages[-1][-1]['url'].endswith(f'-{PAGES * PAGE_SIZE}') and len(whole) == PAGES * PAGE_SIZE)
+    print(f"{PAGES} playlist pages and the whole playlist: {CountedYoutubeDL.created} YoutubeDL instance(s) created, "
+          f"each page {PAGE_SIZE} entries, the whole list {len(whole)}  {'ok' if ok else 'FAIL'}")
+    return ok
+
+
+if __name__ == '__main__':
+    asyncio.run(main())
@@ -0,0 +1,296 @@
+"""Local stand-ins for yt-dlp, FFmpeg and the Discord objects MusicPlayer talks to."""
+import os
+import shutil
+import stat
+import sys
+import tempfile
+import threading
+import time
+from types import SimpleNamespace
+
+REPO = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+
+# Measures every file at -14 LUFS, as a track already at the usual target, and converts by
+# copying. The job named by FAKE_FFMPEG_HANG ('measure' or 'convert') records its pid in
+# ffmpeg-<job>.pid in the directory it was written to and never finishes; the one named by
+# FAKE_FFMPEG_FAIL exits with an error.
+FAKE_FFMPEG = """#!/bin/sh
+case "$*" in *ebur128*) job=measure ;; *) job=convert ;; esac
+if [ "$FAKE_FFMPEG_FAIL" = "$job" ]; then
+    echo "$job failed" >&2
+    exit 1
+fi
+if [ "$FAKE_FFMPEG_HANG" = "$job" ]; then
+    echo $$ > "{directory}/ffmpeg-$job.pid"
+    exec sleep 600
+fi
+if [ $job = measure ]; then
+    printf 'Summary:\\n  I: -14.0 LUFS\\n  Peak: -3.0 dBFS\\n' >&2
+    exit 0
+fi
+previous=
+for arg; do
+    [ "$previous" = -i ] && input=$arg
+    previous=$arg
+done
+cp "$input" "$previous"
+"""
+
+
+def prepare(name, fake_ffmpeg=False, **env):
+    """Ready a benchmark to import app, which must come after this.
+
+    Puts the repository first on sys.path and moves into a scratch directory, as app.py
+    cleans downloads/ in the working directory on import. env gives defaults for settings,
+    e.g. EXTRACT_WORKERS='0' when the fake extractor is patched into this process. With
+    fake_ffmpeg, FFMPEG_BINARY is a stand-in (FAKE_FFMPEG) for media that is not real audio.
+    """
+    sys.path.insert(0, REPO)
+    os.chdir(tempfile.mkdtemp(prefix=f'bench-{name}-'))
+    for key, value in env.items():
+        os.environ.setdefault(key, str(value))
+    if fake_ffmpeg:
+        path = os.path.abspath('ffmpeg')
+        with open(path, 'w') as f:
+            f.write(FAKE_FFMPEG.format(directory=os.getcwd()))
+        os.chmod(path, os.stat(path).st_mode | stat.S_IXUSR)
+        os.environ['FFMPEG_BINARY'] = path
+
+
+class FakeAudioSource:
+    """A track of `duration` seconds whose first audio is ready `startup` seconds after opening,
+    like an FFmpeg process that has to start and fill its first buffer."""
+
+    def __init__(self, source, duration, startup=0):
+        self.source = source
+        self.duration = duration
+        self.ready_at = time.monotonic() + startup
+
+    def cleanup(self):
+        pass
+
+
+class FakeVoiceClient:
+    """Plays a FakeAudioSource by waiting out its duration on a thread, like discord.py's AudioPlayer."""
+
+    def __init__(self, channel=None):
+        self.channel = channel
+        self.plays = []  # (monotonic time the first audio went out, source)
+        self.ends = []  # monotonic time each track's after callback ran
+        self._playing = None
+        self._paused = False
+
+    def is_connected(self):
+        return True
+
+    def is_playing(self):
+        return self._playing is not None and not self._paused
+
+    def is_paused(self):
+        return self._paused
+
+    def play(self, audio_source, after=None):
+        if self._playing is not None:
+            raise RuntimeError('Already playing audio.')
+        done = threading.Event()
+        self._playing = done
+
+        def run():
+            done.wait(max(0, getattr(audio_source, 'ready_at', 0) - time.monotonic()))
+            self.plays.append((time.monotonic(), audio_source.source))
+            done.wait(audio_source.duration)
+            self._playing = None
+            self.ends.append(time.monotonic())
+            if after:
+                after(None)
+
+        threading.Thread(target=run, daemon=True).start()
+
+    def pause(self):
+        self._paused = True
+
+    def resume(self):
+        self._paused = False
+
+    def stop(self):
+        if self._playing is not None:
+            self._playing.set()
+
+    async def disconnect(self):
+        self.stop()
+
+
+class FakeVoiceChannel:
+    def __init__(self, name='General'):
+        self.name = name
+        self.voice_client = None
+
+    async def connect(self):
+        self.voice_client = FakeVoiceClient(self)
+        return self.voice_client
+
+
+class FakeMessage:
+    def __init__(self, channel, content, kwargs):
+        self.channel = channel
+        self.content = content
+        self.kwargs = kwargs
+
+    async def edit(self, **kwargs):
+        self.channel.edits.append(kwargs)
+        self.kwargs.update(kwargs)
+
+
+class FakeTextChannel:
+    def __init__(self):
+        self.messages = []
+        self.edits = []
+
+    async def send(self, content=None, **kwargs):
+        self.messages.append((content, kwargs))
+        return FakeMessage(self, content, kwargs)
+
+
+class FakeResponse:
+    def __init__(self):
+        self.messages = []
+        self.deferred = False
+
+    def is_done(self):
+        return self.deferred or bool(self.messages)
+
+    async def defer(self, **kwargs):
+        self.deferred = True
+
+    async def send_message(self, content=None, **kwargs):
+        self.messages.append((content, kwargs))
+
+
+class FakeInteraction:
+    """What a slash command callback reads from its interaction: guild, channel, the
+    invoking member's voice state, and the response/followup channels."""
+
+    def __init__(self, guild_id, voice_channel=None, channel=None):
+        self.guild_id = guild_id
+        self.channel = channel or FakeTextChannel()
+        self.user = SimpleNamespace(voice=SimpleNamespace(channel=voice_channel) if voice_channel else None)
+        self.response = FakeResponse()
+        self.followup = FakeTextChannel()
+
+
+class FakeYoutubeDL:
+    """Stand-in for yt_dlp.YoutubeDL serving made-up videos and playlists from a local file.
+
+    https://fake.test/video/<id> is a single track and https://fake.test/playlist/<name>-<count>
+    lists <count> tracks; ytsearch<count>:<query> finds <count> tracks titled after the query.
+    Every extraction sleeps extract_latency, after extract_work seconds of pure-Python work
+    that holds the GIL like parsing a big page; a download copies media_path
+    into the output template at download_rate bytes per second, calling the progress hooks
+    after each chunk like yt-dlp's HTTP downloader. Files come out as .<output_ext>; anything
+    but opus makes the bot run its FFmpeg conversion.
+    """
+    extract_latency = 0.05
+    extract_work = 0.0
+    broken = 'broken'  # Downloads of ids containing this fail, like a removed video
+    download_rate = 50e6
+    chunk_size = 256 * 1024
+    media_path = None
+    track_duration = 180
+    output_ext = 'opus'
+    extractions = 0
+    downloads = 0
+    active = 0  # Downloads whose thread is still copying
+
+    def __init__(self, params=None):
+        self.params = params or {}
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc):
+        return False
+
+    def close(self):
+        pass
+
+    @staticmethod
+    def sanitize_info(info):
+        return info
+
+    def _video(self, video_id):
+        return {
+            '_type': 'video', 'id': video_id, 'title': f'Track {video_id}', 'extractor_key': 'Fake',
+            'duration': self.track_duration, 'webpage_url': f'https://fake.test/video/{video_id}',
+            'url': f'file://{self.media_path}', 'acodec': 'opus', 'ext': 'webm',
+        }
+
+    def extract_info(self, url, download=False):
+        FakeYoutubeDL.extractions += 1
+        if self.extract_work:
+            parse_heavy(url, {'work': self.extract_work})
+        time.sleep(self.extract_latency)
+        if url.startswith('ytsearch'):
+            count, _, query = url[len('ytsearch'):].partition(':')
+            slug = '-'.join(query.split())
+            entries = [{'_type': 'url', 'url': f'https://fake.test/video/{slug}-{i}', 'title': f'{query.title()} ({i})',
+                        'duration': self.track_duration} for i in range(1, int(count or 1) + 1)]
+            return {'_type': 'playlist', 'id': query, 'title': query, 'entries': entries}
+        kind, ident = url.rstrip('/').split('/')[-2:]
+        if kind != 'playlist':
+            return self._video(ident)
+        count = int(ident.rsplit('-', 1)[1])
+        first, last = 1, count
+        if self.params.get('playlist_items'):
+            first, _, last = self.params['playlist_items'].partition('-')
+            first, last = int(first), min(int(last), count)
+        entries = [{'_type': 'url', 'url': f'https://fake.test/video/{ident}-{i}', 'title': f'Track {ident}-{i}',
+                    'duration': self.track_duration} for i in range(first, last + 1)]
+        return {'_type': 'playlist', 'id': ident, 'title': f'Playlist {ident}', 'entries': entries,
+                'playlist_count': count}
+
+    def prepare_filename(self, info):
+        return self.params.get('outtmpl', '%(id)s.%(ext)s') % {'id': info['id'], 'ext': self.output_ext}
+
+    def process_ie_result(self, info, download=True):
+        if self.broken in info['id']:
+            raise OSError(f"HTTP Error 403: Forbidden ({info['id']})")
+        path = self.prepare_filename(info)
+        os.makedirs(os.path.dirname(path) or '.', exist_ok=True)
+        total = os.path.getsize(self.media_path)
+        downloaded = 0
+        FakeYoutubeDL.active += 1
+        try:
+            with open(self.media_path, 'rb') as src, open(path + '.part', 'wb') as dst:
+                while chunk := src.read(self.chunk_size):
+                    time.sleep(len(chunk) / self.download_rate)
+                    dst.write(chunk)
+                    dst.flush()
+                    downloaded += len(chunk)
+                    for hook in self.params.get('progress_hooks', ()):
+                        hook({'status': 'downloading', 'filename': path, 'tmpfilename': path + '.part',
+                              'downloaded_bytes': downloaded, 'total_bytes': total, 'info_dict': info})
+        finally:
+            FakeYoutubeDL.active -= 1
+        shutil.move(path + '.part', path)
+        FakeYoutubeDL.downloads += 1
+        return dict(info, requested_downloads=[{'filepath': path}])
+
+
+def parse_heavy(url, opts):
+    """Stand-in for a yt-dlp extraction: pure-Python parsing that holds the GIL throughout."""
+    deadline = time.thread_time() + opts.get('work', 0.2)
+    entries = []
+    while time.thread_time() < deadline:
+        entries = [{'id': str(i), 'title': f'Track {i}'} for i in range(2000)]
+        entries.sort(key=lambda entry: entry['title'])
+    return {'id': url, 'title': f'Track {url}', 'entries': entries[:3]}
+
+
+def install():
+    """Patch FakeYoutubeDL into yt-dlp, configured from FAKE_* variables; for media workers' --setup."""
+    import yt_dlp
+    FakeYoutubeDL.media_path = os.environ['FAKE_MEDIA_PATH']
+    FakeYoutubeDL.download_rate = float(os.getenv('FAKE_DOWNLOAD_RATE', FakeYoutubeDL.download_rate))
+    FakeYoutubeDL.chunk_size = int(os.getenv('FAKE_CHUNK_SIZE', FakeYoutubeDL.chunk_size))
+    FakeYoutubeDL.extract_work = float(os.getenv('FAKE_EXTRACT_WORK', FakeYoutubeDL.extract_work))
+    yt_dlp.YoutubeDL = FakeYoutubeDL
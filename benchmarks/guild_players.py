@@ -0,0 +1,53 @@
+"""Per-guild player footprint and command latency as the guild count grows.
+
+Run from the repository root:
+
+    python benchmarks/guild_players.py
+"""
+import asyncio
+import time
+import tracemalloc
+
+from fakes import prepare
+
+prepare('guilds')
+
+import app  # noqa: E402
+
+GUILD_COUNTS = [1, 10, 100, 1000, 5000]
+LOOKUPS = 2000
+
+
+async def run(guild_count):
+    manager = app.PlayerManager()
+    tracemalloc.start()
+    before = tracemalloc.take_snapshot()
+    for guild_id in range(guild_count):
+        manager.get(guild_id)
+    after = tracemalloc.take_snapshot()
+    tracemalloc.stop()
+    allocated = sum(stat.size_diff for stat in after.compare_to(before, 'filename'))
+
+    # What every slash command does first: resolve the guild's player and read its queue
+    start = time.perf_counter()
+    for i in range(LOOKUPS):
+        player = manager.get(i % guild_count)
+        player.queue_page(0)
+    latency = (time.perf_counter() - start) / LOOKUPS
+
+    start = time.perf_counter()
+    manager.idle_timeout = 0
+    await manager.evict_idle()
+    evict_time = time.perf_counter() - start
+    return allocated / guild_count, latency, evict_time, len(manager)
+
+
+async def main():
+    print(f"{'guilds':>8} {'bytes/guild':>12} {'lookup us':>10} {'evict ms':>9} {'left':>5}")
+    for guild_count in GUILD_COUNTS:
+        per_guild, latency, evict_time, remaining = await run(guild_count)
+        print(f"{guild_count:>8} {per_guild:>12.0f} {latency * 1e6:>10.2f} {evict_time * 1e3:>9.2f} {remaining:>5}")
+
+
+if __name__ == '__main__':
+    asyncio.run(main())
@@ -0,0 +1,202 @@
+"""Offline benchmark suite for MusicPlayer and the slash commands.
+
+yt-dlp, the voice connection and interactions are replaced by the stand-ins in fakes.py, so
+no token or network is needed. Results are written as JSON so runs on different commits can
+be compared. Run from the repository root:
+
+    python benchmarks/harness.py [--output results.json] [--compare baseline.json]
+"""
+import argparse
+import asyncio
+import contextlib
+import json
+import os
+import platform
+import resource
+import statistics
+import subprocess
+import sys
+import time
+
+from fakes import REPO, FakeAudioSource, FakeInteraction, FakeTextChannel, FakeVoiceChannel, FakeYoutubeDL, prepare
+
+prepare('harness', fake_ffmpeg=True, EXTRACT_WORKERS=0, METRICS_PORT=0)
+
+import app  # noqa: E402
+
+TRACK_TIME = 0.3  # Seconds each fake track plays
+SOURCE_STARTUP = 0.05  # Seconds from opening a fake source to its first audio, like FFmpeg startup
+MEDIA_BYTES = 4 * 1024 * 1024
+BATCH_ENTRIES = 10000
+PAGED_PLAYLIST = 1000
+GAP_TRACKS = 8
+BROKEN_TRACKS = 20
+STREAM_GUILDS = 10
+STREAM_TRACKS = 6
+
+guild_ids = iter(range(1, 1 << 30))
+
+
+def setup(media_path=None):
+    if media_path is None:
+        media_path = os.path.abspath('media.bin')
+        with open(media_path, 'wb') as f:
+            f.write(os.urandom(MEDIA_BYTES))
+    FakeYoutubeDL.media_path = media_path
+    # Durations drive when the next track is pre-opened, so keep them true to the fake sources
+    FakeYoutubeDL.track_duration = TRACK_TIME
+    app.yt_dlp.YoutubeDL = FakeYoutubeDL
+    app.MusicPlayer.create_audio_source = (
+        lambda self, source, is_stream, codec=None, start=0, gain=0: FakeAudioSource(source, TRACK_TIME, SOURCE_STARTUP))
+
+
+async def play(url, text_channel=None):
+    # Invoke /play the way discord.py would, with a member sitting in a voice channel
+    guild_id = next(guild_ids)
+    channel = FakeVoiceChannel()
+    invoked = time.monotonic()
+    await app.play.callback(FakeInteraction(guild_id, channel, text_channel), url, None)
+    return app.players.get(guild_id), channel, invoked
+
+
+async def wait_for(predicate, timeout=60):
+    deadline = time.monotonic() + timeout
+    while not predicate():
+        if time.monotonic() > deadline:
+            raise TimeoutError("benchmark scenario did not finish")
+        await asyncio.sleep(0.002)
+
+
+async def bench_time_to_first_audio():
+    results = {}
+    for name, url in (('single', 'https://fake.test/video/ttfa'), ('playlist', 'https://fake.test/playlist/ttfa-200')):
+        player, channel, invoked = await play(url)
+        await wait_for(lambda: channel.voice_client and channel.voice_client.plays)
+        results[f'ttfa_{name}_s'] = channel.voice_client.plays[0][0] - invoked
+        await player.stop()
+    return results
+
+
+async def bench_enqueue():
+    player = app.players.get(next(guild_ids))
+    entries = [{'url': f'https://fake.test/video/batch-{i}', 'title': f'Track {i}'} for i in range(BATCH_ENTRIES)]
+    started = time.perf_counter()
+    await player.add_entries(entries)
+    batch_rate = BATCH_ENTRIES / (time.perf_counter() - started)
+    await player.stop()
+
+    # A whole playlist through the paging path, extraction latency included
+    player = app.players.get(next(guild_ids))
+    started = time.perf_counter()
+    await player.add_to_queue(f'https://fake.test/playlist/paged-{PAGED_PLAYLIST}')
+    while player.playlist_cursors:
+        await player.load_next_page()
+    paged_rate = len(player.queue) / (time.perf_counter() - started)
+    await player.stop()
+    return {'enqueue_batch_tracks_per_s': batch_rate, 'enqueue_paged_tracks_per_s': paged_rate}
+
+
+async def bench_gap():
+    text_channel = FakeTextChannel()
+    player, channel, _ = await play(f'https://fake.test/playlist/gap-{GAP_TRACKS}', text_channel)
+    await wait_for(lambda: channel.voice_client and len(channel.voice_client.ends) >= GAP_TRACKS)
+    voice = channel.voice_client
+    gaps = [start - end for (start, _), end in zip(voice.plays[1:], voice.ends)]
+    await player.stop()
+    await player.outbox.drain()
+    api_calls = len(text_channel.messages) + len(text_channel.edits)
+    return {'gap_mean_s': statistics.mean(gaps), 'gap_max_s': max(gaps), 'api_calls_per_track': api_calls / GAP_TRACKS}
+
+
+async def bench_broken_playlist():
+    # Every download fails; count what reaches the text channel
+    text_channel = FakeTextChannel()
+    player, _, _ = await play(f'https://fake.test/playlist/{FakeYoutubeDL.broken}-{BROKEN_TRACKS}', text_channel)
+    await wait_for(lambda: not player.tasks and not player.queue and not player.download_tasks)
+    await player.outbox.drain()
+    await player.stop()
+    return {'broken_playlist_messages': len(text_channel.messages)}
+
+
+async def bench_streams():
+    # Many guilds playing at once; bot-side CPU only, since the fake sources do no audio work
+    cpu_started = time.process_time()
+    started = time.perf_counter()
+    sessions = [await play(f'https://fake.test/playlist/streams{i}-{STREAM_TRACKS}') for i in range(STREAM_GUILDS)]
+    await wait_for(lambda: all(channel.voice_client and len(channel.voice_client.ends) >= STREAM_TRACKS
+                               for _, channel, _ in sessions))
+    cpu = time.process_time() - cpu_started
+    wall = time.perf_counter() - started
+    for player, _, _ in sessions:
+        await player.stop()
+    return {'cpu_per_stream_pct': 100 * cpu / wall / STREAM_GUILDS, 'streams': STREAM_GUILDS}
+
+
+async def run_suite():
+    results = {}
+    for bench in (bench_time_to_first_audio, bench_enqueue, bench_gap, bench_broken_playlist, bench_streams):
+        results.update(await bench())
+    # ru_maxrss is in kilobytes on Linux
+    results['peak_rss_mb'] = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss / 1024
+    results['extractions'] = FakeYoutubeDL.extractions
+    results['downloads'] = FakeYoutubeDL.downloads
+    return results
+
+
+def git_commit():
+    try:
+        return subprocess.run(['git', '-C', REPO, 'rev-parse', '--short', 'HEAD'],
+                              capture_output=True, text=True, check=True).stdout.strip()
+    except (OSError, subprocess.CalledProcessError):
+        return None
+
+
+def compare(baseline, report):
+    print(f"{'metric':>28} {'baseline':>12} {'current':>12} {'change':>8}", file=sys.stderr)
+    for name, value in report['results'].items():
+        old = baseline['results'].get(name)
+        change = f"{(value - old) / old:+.1%}" if old else '-'
+        old = f"{old:.4g}" if old is not None else '-'
+        print(f"{name:>28} {old:>12} {value:>12.4g} {change:>8}", file=sys.stderr)
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument('--output', help='write the JSON report here instead of stdout')
+    parser.add_argument('--compare', help='JSON report of an earlier run to compare against')
+    parser.add_argument('--media', help='local media file the fake extractor serves')
+    parser.add_argument('--extract-latency', type=float, default=FakeYoutubeDL.extract_latency)
+    parser.add_argument('--download-rate', type=float, default=FakeYoutubeDL.download_rate,
+                        help='bytes per second of fake downloads')
+    args = parser.parse_args()
+    FakeYoutubeDL.extract_latency = args.extract_latency
+    FakeYoutubeDL.download_rate = args.download_rate
+    setup(os.path.abspath(args.media) if args.media else None)
+
+    # The bot logs with print(); keep stdout for the report
+    with contextlib.redirect_stdout(sys.stderr):
+        results = asyncio.run(run_suite())
+    report = {
+        'commit': git_commit(),
+        'timestamp': time.time(),
+        'python': platform.python_version(),
+        'config': {
+            'extract_latency_s': args.extract_latency, 'download_rate_bps': args.download_rate,
+            'media_bytes': os.path.getsize(FakeYoutubeDL.media_path), 'track_time_s': TRACK_TIME,
+            'source_startup_s': SOURCE_STARTUP, 'download_workers': app.DOWNLOAD_WORKERS,
+        },
+        'results': results,
+    }
+    if args.compare:
+        with open(args.compare) as f:
+            compare(json.load(f), report)
+    output = json.dumps(report, indent=2)
+    if args.output:
+        with open(args.output, 'w') as f:
+            f.write(output + '\n')
+    else:
+        print(output)
+
+
+if __name__ == '__main__':
+    main()
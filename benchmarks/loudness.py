@@ -0,0 +1,195 @@
+"""Cost of loudness normalization: the one-off analysis per download and the gain at playback.
+
+Generates test tracks mastered at different loudness (or takes the files given), measures
+each once as a download is, and checks that playing it with the stored gain lands within
+1 LU of LOUDNESS_TARGET, unless it is too quiet to be raised that far. A track downloaded
+through the bot with the audio cache on must be measured on its first play only, be cached
+as downloaded, and follow a changed or disabled LOUDNESS_TARGET on later plays. Finally the
+CPU each voice stream needs is compared for Opus passthrough, the stored gain, and FFmpeg's
+loudnorm filter at play time, both dynamic and as a two-pass linear correction. Needs
+FFmpeg; run from the repository root, exiting non-zero if a check fails:
+
+    python benchmarks/loudness.py [<audio file> ...]
+"""
+import asyncio
+import json
+import os
+import subprocess
+import sys
+import time
+
+from fakes import FakeYoutubeDL, prepare
+
+prepare('loudness', EXTRACT_WORKERS=0, METRICS_PORT=0, AUDIO_CACHE_MAX_BYTES=0)
+
+import discord  # noqa: E402
+
+import app  # noqa: E402
+from audio_pipeline import FRAME_SECONDS, cpu_seconds, drain  # noqa: E402
+from transcode import measure_loudness  # noqa: E402
+
+# name -> the noise a track is made of, mastered louder and quieter than the usual target
+SAMPLES = {'loud': 'white:amplitude=0.6', 'moderate': 'pink:amplitude=0.35', 'quiet': 'pink:amplitude=0.07'}
+SAMPLE_SECONDS = 120
+
+failures = []
+
+
+def check(ok, what):
+    print(f"  {'ok  ' if ok else 'FAIL'} {what}")
+    if not ok:
+        failures.append(what)
+
+
+def generate_samples(directory):
+    paths = []
+    for name, noise in SAMPLES.items():
+        path = os.path.join(directory, f'{name}.opus')
+        subprocess.run(
+            [app.FFMPEG_BINARY, '-loglevel', 'error', '-y', '-f', 'lavfi', '-i',
+             f'anoisesrc=color={noise}:duration={SAMPLE_SECONDS}',
+             '-af', 'aformat=channel_layouts=stereo', '-ar', '48000', '-c:a', 'libopus', '-b:a', '128k', path],
+            check=True)
+        paths.append(path)
+    return paths
+
+
+def duration_of(path):
+    result = subprocess.run([app.FFMPEG_BINARY, '-hide_banner', '-i', path], capture_output=True, text=True)
+    hours, minutes, seconds = result.stderr.split('Duration: ')[1].split(',')[0].split(':')
+    return int(hours) * 3600 + int(minutes) * 60 + float(seconds)
+
+
+async def loudness_with_gain(path, gain):
+    # Measure what playback with the gain sends, as a file FFmpeg encodes the same way
+    played = os.path.join(os.path.dirname(path), f'played-{os.path.basename(path)}')
+    subprocess.run([app.FFMPEG_BINARY, '-loglevel', 'error', '-y', '-i', path, '-af', f'volume={gain}dB',
+                    '-c:a', 'libopus', '-b:a', '128k', played], check=True)
+    try:
+        return await measure_loudness(app.FFMPEG_BINARY, played)
+    finally:
+        os.remove(played)
+
+
+def loudnorm_first_pass(path):
+    # The analysis a two-pass loudnorm would run before every play
+    result = subprocess.run(
+        [app.FFMPEG_BINARY, '-hide_banner', '-nostats', '-i', path, '-af',
+         f'loudnorm=I={app.LOUDNESS_TARGET}:TP=-1:LRA=11:print_format=json', '-f', 'null', '-'],
+        capture_output=True, text=True, check=True)
+    return json.loads(result.stderr[result.stderr.rindex('{'):result.stderr.rindex('}') + 1])
+
+
+def stream_cpu(make_source):
+    start_cpu = cpu_seconds()
+    started = time.perf_counter()
+    audio_source = make_source()
+    frames = drain(audio_source)
+    audio_source.cleanup()  # Waits for FFmpeg so its CPU time is counted
+    cpu = cpu_seconds() - start_cpu
+    return cpu / (frames * FRAME_SECONDS), time.perf_counter() - started
+
+
+async def analysis(paths):
+    print(f"Analysis, once per download (target {app.LOUDNESS_TARGET:g} LUFS):")
+    print(f"{'track':>14} {'length':>7} {'LUFS':>7} {'peak':>7} {'took':>7} {'speed':>7} {'gain':>7} {'played':>7}")
+    measured = {}
+    for path in paths:
+        length = duration_of(path)
+        started = time.perf_counter()
+        loudness = await measure_loudness(app.FFMPEG_BINARY, path)
+        took = time.perf_counter() - started
+        gain = app.playback_gain(loudness)
+        played = (await loudness_with_gain(path, gain))[0] if gain else loudness[0]
+        measured[path] = loudness
+        print(f"{os.path.basename(path)[:14]:>14} {length:6.0f}s {loudness[0]:7.1f} {loudness[1]:7.1f} {took:6.2f}s "
+              f"{length / took:6.0f}x {gain:+6.1f}dB {played:7.1f}")
+        # A boost is capped, so a very quiet track may stay below the target
+        check(abs(played - (loudness[0] + gain)) <= 1 and (abs(played - app.LOUDNESS_TARGET) <= 1 or gain > 0),
+              f"{os.path.basename(path)} plays at {played:.1f} LUFS")
+    return measured
+
+
+async def repeated_plays(path):
+    app.audio_cache = app.AudioCache(os.path.abspath('cache'), 1 << 30)
+    FakeYoutubeDL.media_path = path
+    FakeYoutubeDL.extract_latency = 0
+    app.yt_dlp.YoutubeDL = FakeYoutubeDL
+    # yt-dlp's extractors do not know the fake site, so key its URLs the way FakeYoutubeDL reports them
+    app.cache_key_for_url = lambda url: app.AudioCache.make_key('Fake', url.rsplit('/', 1)[1])
+    measurements = []
+    real_measure = app.measure_loudness
+
+    async def counted(ffmpeg, filename):
+        measurements.append(filename)
+        return await real_measure(ffmpeg, filename)
+
+    app.measure_loudness = counted
+    player = app.MusicPlayer(guild_id='bench-loudness')
+    print("Repeated plays through the audio cache:")
+    results = []
+    for play in range(3):
+        started = time.perf_counter()
+        filename, _, _, _, loudness = await player.download_and_convert('https://fake.test/video/loudness')
+        results.append(loudness)
+        print(f"  play {play + 1}: {time.perf_counter() - started:.2f}s to ready, loudness {loudness}, "
+              f"{len(measurements)} analysis(es) so far")
+        await player.cleanup_file(filename)
+    app.measure_loudness = real_measure
+    check(len(measurements) == 1 and results[0] is not None and len(set(results)) == 1,
+          "measured on the first play only, the cache serving the same value after")
+    cached = app.audio_cache.lookup(app.cache_key_for_url('https://fake.test/video/loudness'))
+    kept = (await measure_loudness(app.FFMPEG_BINARY, cached['path']))[0]
+    original = (await measure_loudness(app.FFMPEG_BINARY, path))[0]
+    check(abs(kept - original) <= 0.5, f"cached as downloaded, at {kept:.1f} LUFS against {original:.1f}")
+    app.audio_cache.release(cached['path'])
+
+    # The gain comes from the stored loudness when a play starts, so a new target reaches cached tracks
+    target, loudness = app.LOUDNESS_TARGET, results[0]
+    gains = {}
+    for app.LOUDNESS_TARGET in (target, target - 6, None):
+        gains[app.LOUDNESS_TARGET] = app.playback_gain(loudness)
+    app.LOUDNESS_TARGET = target
+    print(f"  gain for the cached track: {gains[target]:+.1f} dB at {target:g} LUFS, "
+          f"{gains[target - 6]:+.1f} dB at {target - 6:g} LUFS, {gains[None]:+.1f} dB with the target off")
+    check(gains[target - 6] < gains[target] and gains[None] == 0,
+          "a changed or disabled target applies to the cached track")
+
+
+def playback(paths, measured):
+    print("Playback CPU per voice stream:")
+    print(f"{'track':>14} {'pipeline':>18} {'cpu/strm':>9} {'startup':>8}")
+    player = app.MusicPlayer(guild_id='bench-loudness-cpu')
+    for path in paths:
+        gain = app.playback_gain(measured[path]) or -3.0  # A gain even for a track already on target
+        started = time.perf_counter()
+        first = loudnorm_first_pass(path)
+        first_pass = time.perf_counter() - started
+        linear = (f"loudnorm=I={app.LOUDNESS_TARGET}:TP=-1:LRA=11:measured_I={first['input_i']}:"
+                  f"measured_TP={first['input_tp']}:measured_LRA={first['input_lra']}:"
+                  f"measured_thresh={first['input_thresh']}:offset={first['target_offset']}:linear=true")
+        pipelines = (
+            ('passthrough', lambda: player.create_audio_source(path, False, 'opus')),
+            ('stored gain', lambda: player.create_audio_source(path, False, 'opus', gain=gain)),
+            ('loudnorm dynamic',
+             lambda: discord.FFmpegOpusAudio(path, options=f'-af loudnorm=I={app.LOUDNESS_TARGET}:TP=-1:LRA=11')),
+            ('loudnorm two-pass', lambda: discord.FFmpegOpusAudio(path, options=f'-af {linear}')),
+        )
+        for name, make_source in pipelines:
+            per_stream, _ = stream_cpu(make_source)
+            startup = first_pass if name == 'loudnorm two-pass' else 0
+            print(f"{os.path.basename(path)[:14]:>14} {name:>18} {per_stream * 100:8.2f}% {startup:7.2f}s")
+
+
+async def main(paths):
+    if app.LOUDNESS_TARGET is None:
+        sys.exit("LOUDNESS_TARGET is off")
+    paths = [os.path.abspath(path) for path in paths] or generate_samples(os.getcwd())
+    measured = await analysis(paths)
+    await repeated_plays(paths[0])
+    playback(paths, measured)
+    sys.exit(1 if failures else 0)
+
+
+if __name__ == '__main__':
+    asyncio.run(main(sys.argv[1:]))
@@ -0,0 +1,260 @@
+"""Media work handed to media_worker.py processes over the job broker.
+
+Starts a JobBroker on a Unix socket and real worker processes running the fake extractor,
+then checks the broker's recovery: a worker killed mid-download, one that hangs mid-download
+and one that never acks its job must each have the job finished by another worker, and a
+cancelled job must leave no file behind. A worker with the wrong token must be turned away,
+jobs must name files by absolute path, and a download a worker says it put outside the
+guild's directory, or at a path relative to its own, must fail. Finally one
+guild plays a queue whose extractions hold the GIL, once with the media work in the bot,
+once through the in-process stand-in broker and once through the workers, comparing event
+loop lag. Runs offline; from the repository root, exiting non-zero if any check fails:
+
+    python benchmarks/media_workers.py [tracks]
+"""
+import asyncio
+import os
+import signal
+import sys
+import time
+
+from fakes import REPO, FakeAudioSource, FakeTextChannel, FakeVoiceClient, FakeYoutubeDL, prepare
+
+# The workers run in the same directory, as they would share the bot's downloads volume
+prepare('media-workers', fake_ffmpeg=True, EXTRACT_WORKERS=0, METRICS_PORT=0, AUDIO_CACHE_MAX_BYTES=0,
+        SESSION_SAVE_INTERVAL=0, PROGRESSIVE_BUFFER_SECONDS=0)
+
+import app  # noqa: E402
+import media_worker  # noqa: E402
+from job_broker import JobBroker, JobError, LocalBroker  # noqa: E402
+
+BENCHMARKS = os.path.dirname(os.path.abspath(__file__))  # For the workers to import fakes from
+TRACK_BYTES = 2 * 1024 * 1024
+DOWNLOAD_RATE = 2e6  # Workers take a second per download, long enough to interrupt one
+EXTRACT_WORK = 0.3
+ACK_TIMEOUT = 1
+HEALTH_TIMEOUT = 6  # Above the workers' 5 second heartbeat
+TOKEN = 'bench-token'
+
+failures = []
+workers = {}  # name -> process
+
+
+def check(ok, what):
+    print(f"  {'ok  ' if ok else 'FAIL'} {what}")
+    if not ok:
+        failures.append(what)
+
+
+async def start_worker(broker, address, name, token=TOKEN):
+    env = dict(os.environ, PYTHONPATH=BENCHMARKS, WORKER_TOKEN=token, FAKE_MEDIA_PATH=FakeYoutubeDL.media_path,
+               FAKE_DOWNLOAD_RATE=str(DOWNLOAD_RATE), FAKE_CHUNK_SIZE=str(FakeYoutubeDL.chunk_size),
+               FAKE_EXTRACT_WORK=str(EXTRACT_WORK))
+    workers[name] = await asyncio.create_subprocess_exec(
+        sys.executable, os.path.join(REPO, 'media_worker.py'), address, '--jobs', '2', '--name', name,
+        '--setup', 'fakes:install', env=env, stdout=asyncio.subprocess.DEVNULL)
+    started = time.monotonic()
+    while not any(worker.name == name for worker in broker.workers):
+        if time.monotonic() - started > 30:
+            raise RuntimeError(f"Worker {name} did not connect")
+        await asyncio.sleep(0.05)
+
+
+def download_job(video_id):
+    opts = app.extract_options(flat=False)
+    opts['outtmpl'] = os.path.join('downloads', 'bench', '%(id)s.%(ext)s')
+    return {'opts': opts, 'info': FakeYoutubeDL()._video(video_id)}
+
+
+def running_on(broker):
+    for worker in broker.workers:
+        if worker.jobs:
+            return worker.name
+    return None
+
+
+async def interrupted_worker(broker, address, label, how):
+    # Submit a download, then kill or freeze the worker running it once it is under way
+    progress = asyncio.Event()
+    retries, lost = broker.retries, broker.lost_workers
+    started = time.monotonic()
+    task = asyncio.ensure_future(broker.submit('download', download_job(label), lambda d: progress.set()))
+    await progress.wait()
+    name = running_on(broker)
+    workers[name].send_signal(how)
+    path = await asyncio.wait_for(task, 30)
+    elapsed = time.monotonic() - started
+    check(os.path.exists(path) and os.path.getsize(path) == TRACK_BYTES and broker.retries == retries + 1,
+          f"{label}: finished on another worker in {elapsed:.2f}s after {broker.retries - retries} retry, "
+          f"{broker.lost_workers - lost} worker(s) dropped")
+    if how != signal.SIGKILL:
+        workers[name].kill()
+    await workers.pop(name).wait()
+    await start_worker(broker, address, name)
+
+
+async def unacked_job(broker, address):
+    # A frozen worker cannot ack; its job must move on after ACK_TIMEOUT, not HEALTH_TIMEOUT
+    name = next(iter(workers))
+    workers[name].send_signal(signal.SIGSTOP)
+    retries = broker.retries
+    started = time.monotonic()
+    paths = await asyncio.wait_for(asyncio.gather(
+        *(broker.submit('download', download_job(f'unacked-{i}')) for i in range(2))), 30)
+    elapsed = time.monotonic() - started
+    check(all(os.path.exists(path) for path in paths) and broker.retries == retries + 1
+          and elapsed < HEALTH_TIMEOUT,
+          f"job sent to a frozen worker retried after the {ACK_TIMEOUT}s ack timeout, both done in {elapsed:.2f}s")
+    workers[name].kill()
+    await workers.pop(name).wait()
+    await start_worker(broker, address, name)
+
+
+async def cancelled_job(broker):
+    progress = asyncio.Event()
+    task = asyncio.ensure_future(broker.submit('download', download_job('cancelled'), lambda d: progress.set()))
+    await progress.wait()
+    task.cancel()
+    started = time.monotonic()
+    while time.monotonic() - started < 5:
+        leftovers = [filename for filename in os.listdir(os.path.join('downloads', 'bench'))
+                     if filename.startswith('cancelled')]
+        if not leftovers and not broker.stats()['running']:
+            break
+        await asyncio.sleep(0.05)
+    check(not leftovers and not broker.stats()['running'],
+          f"cancelled download removed by its worker within {(time.monotonic() - started) * 1e3:.0f} ms")
+
+
+async def wrong_token(address):
+    # Connects, sends its hello and is dropped without ever being given a job
+    reader, writer = await asyncio.open_unix_connection(address.partition(':')[2])
+    writer.write(b'{"type": "hello", "name": "intruder", "capacity": 4, "token": "guess"}\n')
+    closed = await asyncio.wait_for(reader.read(), 5) == b''
+    writer.close()
+    return closed
+
+
+async def worker_paths():
+    # Workers on other hosts have their own working directory, so only absolute paths mean the same there
+    paths = []
+
+    def recorded(job):
+        async def handler(payload, progress, stop):
+            if job != 'resolve':
+                paths.append(payload['opts']['outtmpl'] if job == 'download' else payload['filename'])
+            return await media_worker.HANDLERS[job](payload, progress, stop)
+        return handler
+
+    app.job_broker = LocalBroker({job: recorded(job) for job in media_worker.HANDLERS})
+    player = app.MusicPlayer(guild_id='absolute-paths')
+    filename = (await player.download_and_convert('https://fake.test/video/absolute'))[0]
+    await player.cleanup_file(filename)
+    check(len(paths) == 2 and all(os.path.isabs(path) for path in paths),
+          f"download and loudness jobs are given absolute paths: {paths}")
+
+    # A worker answering a download with a file outside the guild's directory, or relative to its own
+    player = app.MusicPlayer(guild_id='outside-path')
+    for returned in (os.path.abspath('media.bin'), os.path.join(player.download_dir, 'outside.opus')):
+        async def download(payload, progress, stop):
+            return returned
+
+        app.job_broker = LocalBroker(dict(media_worker.HANDLERS, download=download))
+        try:
+            await player.download_and_convert('https://fake.test/video/outside')
+            failed = False
+        except JobError:
+            failed = True
+        check(failed and os.path.exists(FakeYoutubeDL.media_path),
+              f"a download a worker says it put at {returned} is refused")
+    app.job_broker = None
+
+
+async def play_queue(label, broker, tracks):
+    app.job_broker = broker
+    player = app.MusicPlayer(guild_id=f'play-{label}')
+    player.current_voice_client = FakeVoiceClient()
+    player.text_channel = FakeTextChannel()
+    downloads = FakeYoutubeDL.downloads
+    lags = []
+
+    async def sample():
+        loop = asyncio.get_running_loop()
+        while True:
+            started = loop.time()
+            await asyncio.sleep(0.01)
+            lags.append(loop.time() - started - 0.01)
+
+    sampler = asyncio.ensure_future(sample())
+    started = time.monotonic()
+    await player.add_entries([{'url': f'https://fake.test/video/{label}-{i}', 'title': f'Track {i}'}
+                              for i in range(tracks)])
+    await player.start()
+    while len(player.current_voice_client.ends) < tracks and time.monotonic() - started < 60:
+        await asyncio.sleep(0.01)
+    elapsed = time.monotonic() - started
+    sampler.cancel()
+    errors = [content for content, _ in player.text_channel.messages if content and 'Error' in content]
+    in_bot = FakeYoutubeDL.downloads - downloads
+    played = len(player.current_voice_client.ends)
+    lags.sort()
+    print(f"{label:>12} {elapsed:7.2f}s {lags[len(lags) // 2] * 1e3:7.1f}ms {lags[int(len(lags) * 0.99)] * 1e3:7.1f}ms "
+          f"{lags[-1] * 1e3:7.1f}ms {in_bot:9d}")
+    await player.stop()
+    player.outbox.stop()
+    return played == tracks and not errors, in_bot, lags[-1]
+
+
+async def main(tracks):
+    FakeYoutubeDL.media_path = os.path.abspath('media.bin')
+    with open(FakeYoutubeDL.media_path, 'wb') as f:
+        f.write(os.urandom(TRACK_BYTES))
+    FakeYoutubeDL.chunk_size = 64 * 1024
+    FakeYoutubeDL.download_rate = 20e6
+    FakeYoutubeDL.extract_work = EXTRACT_WORK
+    app.yt_dlp.YoutubeDL = FakeYoutubeDL
+    media_worker.yt_dlp.YoutubeDL = FakeYoutubeDL
+    app.MusicPlayer.create_audio_source = (
+        lambda self, source, is_stream, codec=None, start=0, gain=0: FakeAudioSource(source, 0.2))
+
+    address = f"unix:{os.path.abspath('media.sock')}"
+    broker = JobBroker(address, ack_timeout=ACK_TIMEOUT, health_timeout=HEALTH_TIMEOUT, queue_timeout=30,
+                       token=TOKEN)
+    await broker.start()
+    try:
+        for name in ('worker-a', 'worker-b'):
+            await start_worker(broker, address, name)
+        print("Recovery:")
+        await interrupted_worker(broker, address, 'killed', signal.SIGKILL)
+        await interrupted_worker(broker, address, 'hung', signal.SIGSTOP)
+        await unacked_job(broker, address)
+        await cancelled_job(broker)
+        connected = len(broker.workers)
+        check(await wrong_token(address) and len(broker.workers) == connected,
+              "a worker with the wrong token is turned away")
+        await worker_paths()
+
+        print(f"A queue of {tracks} tracks, {EXTRACT_WORK * 1e3:.0f} ms of GIL-holding work per extraction:")
+        print(f"{'media work':>12} {'played':>8} {'lag p50':>9} {'p99':>9} {'max':>9} {'in bot':>9}")
+        played, in_bot, local_lag = await play_queue('in-bot', None, tracks)
+        check(played and in_bot == tracks, "in the bot: every track played")
+        played, in_bot, _ = await play_queue('stand-in', LocalBroker(media_worker.HANDLERS), tracks)
+        check(played and in_bot == tracks, "through the stand-in broker: every track played")
+        completed = broker.completed
+        played, in_bot, worker_lag = await play_queue('workers', broker, tracks)
+        # Each track is resolved, downloaded and measured
+        check(played and in_bot == 0 and broker.completed - completed == 3 * tracks,
+              f"through the workers: every track played, {broker.completed - completed} jobs, none in the bot")
+        check(worker_lag < local_lag, f"worst loop lag {local_lag * 1e3:.0f} ms in the bot, "
+                                      f"{worker_lag * 1e3:.0f} ms with workers")
+        print(f"Broker: {broker.stats()}")
+    finally:
+        await broker.close()
+        for process in workers.values():
+            process.kill()
+            await process.wait()
+    sys.exit(1 if failures else 0)
+
+
+if __name__ == '__main__':
+    asyncio.run(main(int(sys.argv[1]) if len(sys.argv) > 1 else 6))
@@ -0,0 +1,90 @@
+"""How long a /play_next track waits behind a playlist that is already downloading.
+
+Downloads are simulated and honour the pause signal the way the yt-dlp progress hook does,
+so this runs offline. Exits non-zero if the promoted track takes longer than one download
+time (plus a little scheduling slack) to become ready, or if removing a paused track from
+the queue leaves its partial file behind. Run from the repository root:
+
+    python benchmarks/play_next.py
+"""
+import asyncio
+import os
+import sys
+import time
+
+from fakes import FakeTextChannel, prepare
+
+prepare('play-next')
+
+import app  # noqa: E402
+
+PLAYLIST = 25
+DOWNLOAD_TIME = 0.5
+# How often the fake download checks for a pause, like a progress hook between chunks
+CHUNK_TIME = 0.02
+SLACK = 0.1
+
+
+async def run(preempt):
+    player = app.MusicPlayer(guild_id='bench-play-next')
+    player.text_channel = FakeTextChannel()
+    if not preempt:
+        player.preempt_downloads = lambda window, waiting: None
+    paused = []
+
+    async def fetch_audio(url, stream=False, interrupt=None, on_progress=None):
+        # Writes a .part file as yt-dlp does, kept when the download is paused
+        part = os.path.join('downloads', f'{url}.part')
+        os.makedirs('downloads', exist_ok=True)
+        for chunk in range(round(DOWNLOAD_TIME / CHUNK_TIME)):
+            if interrupt is not None and interrupt.is_set():
+                paused.append(url)
+                raise RuntimeError("Download paused")
+            with open(part, 'ab') as f:
+                f.write(b'\0' * 1024)
+            on_progress({'downloaded_bytes': (chunk + 1) * 1024, 'tmpfilename': part, 'filename': url})
+            await asyncio.sleep(CHUNK_TIME)
+        os.replace(part, url)
+        return url, f'Track {url}', None, False, 'opus', None
+
+    player.fetch_audio = fetch_audio
+    await player.add_entries([{'url': f'track{i}', 'title': f'Track {i}'} for i in range(PLAYLIST)])
+    player.downloader_task = asyncio.create_task(player.downloader())
+    # Let the playlist's first downloads get halfway before promoting a new track
+    await asyncio.sleep(DOWNLOAD_TIME / 2)
+
+    started = time.monotonic()
+    await player.add_entries([{'url': 'next', 'title': 'Next'}], play_next=True)
+    track = player.queue.head()
+    removed = []
+    while track.state != app.READY:
+        # A track removed while paused must not leave its partial file behind
+        for position, queued in enumerate(player.queue, 1):
+            if queued.url in paused and queued.state == app.PENDING:
+                removed.append(queued.url)
+                await player.remove_at_position(position)
+                break
+        await asyncio.sleep(0.005)
+    latency = time.monotonic() - started
+    leftovers = [url for url in removed if os.path.exists(os.path.join('downloads', f'{url}.part'))]
+    await player.stop()
+    return latency, paused, leftovers
+
+
+async def main():
+    print(f"{PLAYLIST} tracks queued, {app.DOWNLOAD_WORKERS} download workers, "
+          f"{DOWNLOAD_TIME * 1e3:.0f} ms per download")
+    for name, preempt in (('queue order only', False), ('with pre-emption', True)):
+        latency, paused, leftovers = await run(preempt)
+        print(f"{name:>18}: play_next ready after {latency * 1e3:6.0f} ms, paused {paused or 'nothing'}")
+    if leftovers:
+        print(f"FAIL: removing paused tracks left their partial files: {leftovers}")
+        sys.exit(1)
+    if latency > DOWNLOAD_TIME + SLACK:
+        print(f"FAIL: play_next track took longer than one download ({DOWNLOAD_TIME * 1e3:.0f} ms)")
+        sys.exit(1)
+    print("OK: play_next track was ready within one download time")
+
+
+if __name__ == '__main__':
+    asyncio.run(main())
@@ -0,0 +1,60 @@
+"""Time-to-first-audio and disk I/O of the download and stream playback modes.
+
+Needs network access and FFmpeg. Run from the repository root:
+
+    python benchmarks/playback_modes.py <video url> [<video url> ...]
+"""
+import asyncio
+import os
+import sys
+import time
+
+from fakes import prepare
+
+prepare('modes')
+
+import app  # noqa: E402
+
+
+def directory_size(path):
+    total = 0
+    for root, _, files in os.walk(path):
+        for name in files:
+            total += os.path.getsize(os.path.join(root, name))
+    return total
+
+
+def first_frame(audio_source):
+    # FFmpeg is already running; block until it produces the first 20ms frame
+    while not audio_source.read():
+        pass
+
+
+async def measure(url, stream):
+    player = app.MusicPlayer(guild_id=f"bench-{'stream' if stream else 'download'}")
+    start = time.perf_counter()
+    source, title, _, is_stream, codec, _ = await player.fetch_audio(url, stream)
+    prepared = time.perf_counter() - start
+    written = directory_size(player.download_dir)
+
+    audio_source = player.create_audio_source(source, is_stream, codec)
+    await asyncio.get_event_loop().run_in_executor(None, first_frame, audio_source)
+    first_audio = time.perf_counter() - start
+    audio_source.cleanup()
+    await player.stop()
+    return title, is_stream, prepared, first_audio, written
+
+
+async def main(urls):
+    print(f"{'mode':>8} {'prepare s':>10} {'first audio s':>14} {'disk MB':>8}  title")
+    for url in urls:
+        for stream in (False, True):
+            title, is_stream, prepared, first_audio, written = await measure(url, stream)
+            mode = 'stream' if is_stream else 'download'
+            print(f"{mode:>8} {prepared:>10.2f} {first_audio:>14.2f} {written / 1e6:>8.1f}  {title}")
+
+
+if __name__ == '__main__':
+    if len(sys.argv) < 2:
+        sys.exit(__doc__)
+    asyncio.run(main(sys.argv[1:]))
@@ -0,0 +1,99 @@
+"""Time-to-first-audio of an hour-long mix, waiting for the whole download versus playing it
+while it downloads.
+
+A fake extractor serves the mix at a fixed rate and a fake FFmpeg reads the piped source
+faster than it arrives, so playback keeps catching up with the download. The audio it read
+must match the file byte for byte. Runs offline; from the repository root:
+
+    python benchmarks/progressive.py [--download-rate BYTES_PER_S]
+"""
+import argparse
+import asyncio
+import hashlib
+import os
+import sys
+import threading
+import time
+
+from fakes import FakeAudioSource, FakeInteraction, FakeVoiceChannel, FakeYoutubeDL, prepare
+
+prepare('progressive', fake_ffmpeg=True, EXTRACT_WORKERS=0, METRICS_PORT=0, AUDIO_CACHE_MAX_BYTES=0)
+
+import app  # noqa: E402
+
+MIX_SECONDS = 3600
+MIX_BYTES = 16 * 1024 * 1024  # Scaled down from the ~58 MB an hour of 128 kbit/s Opus takes
+
+
+class PipedSource(FakeAudioSource):
+    """Reads a piped source to its end as FFmpeg would, then ends the track."""
+
+    def __init__(self, source, end_track):
+        super().__init__(source, duration=MIX_SECONDS)
+        self.digest = hashlib.sha256()
+        self.size = 0
+        self.eof_at = None
+        threading.Thread(target=self._drain, args=(end_track,), daemon=True).start()
+
+    def _drain(self, end_track):
+        while data := self.source.read(8192):
+            self.digest.update(data)
+            self.size += len(data)
+        self.eof_at = time.monotonic()
+        end_track()
+
+
+async def run(buffer_seconds):
+    app.PROGRESSIVE_BUFFER_SECONDS = buffer_seconds
+    channel = FakeVoiceChannel()
+    sources = []
+
+    def create_audio_source(player, source, is_stream, codec=None, start=0, gain=0):
+        if isinstance(source, str):
+            sources.append(FakeAudioSource(source, 0.1))
+        else:
+            sources.append(PipedSource(source, lambda: channel.voice_client.stop()))
+        return sources[-1]
+    app.MusicPlayer.create_audio_source = create_audio_source
+
+    guild_id = f'bench-progressive-{buffer_seconds:g}'
+    invoked = time.monotonic()
+    await app.play.callback(FakeInteraction(guild_id, channel), f'https://fake.test/video/mix-{buffer_seconds:g}', None)
+    player = app.players.get(guild_id)
+    while not (channel.voice_client and channel.voice_client.ends):
+        await asyncio.sleep(0.005)
+    first_audio = channel.voice_client.plays[0][0] - invoked
+    source = sources[0]
+    await player.stop()
+    return first_audio, source
+
+
+async def main(download_rate):
+    FakeYoutubeDL.media_path = os.path.abspath('mix.bin')
+    with open(FakeYoutubeDL.media_path, 'wb') as f:
+        f.write(os.urandom(MIX_BYTES))
+    with open(FakeYoutubeDL.media_path, 'rb') as f:
+        expected = hashlib.sha256(f.read()).hexdigest()
+    FakeYoutubeDL.download_rate = download_rate
+    FakeYoutubeDL.chunk_size = 64 * 1024
+    FakeYoutubeDL.track_duration = MIX_SECONDS
+    app.yt_dlp.YoutubeDL = FakeYoutubeDL
+
+    print(f"{MIX_SECONDS // 60} minute mix, {MIX_BYTES / 1e6:.0f} MB at {download_rate / 1e6:.1f} MB/s")
+    failed = False
+    for name, buffer_seconds in (('whole download', 0), ('progressive, 10 s buffer', 10)):
+        first_audio, source = await run(buffer_seconds)
+        line = f"{name:>25}: first audio after {first_audio:6.2f} s"
+        if isinstance(source, PipedSource):
+            intact = source.digest.hexdigest() == expected
+            failed |= not intact
+            line += (f", caught up with the download {source.source.waits} time(s), "
+                     f"read {source.size / 1e6:.1f} MB {'intact' if intact else 'CORRUPTED'}")
+        print(line)
+    sys.exit(1 if failed else 0)
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument('--download-rate', type=float, default=4e6, help='bytes per second of the fake download')
+    asyncio.run(main(parser.parse_args().download_rate))
@@ -0,0 +1,48 @@
+"""Cost of rendering a page of the queue view as the queue grows.
+
+Run from the repository root:
+
+    python benchmarks/queue_view.py
+"""
+import timeit
+
+from fakes import prepare
+
+prepare('queue-view')
+
+import app  # noqa: E402
+from tracks import Track  # noqa: E402
+
+SIZES = (100, 10_000, 100_000)
+
+
+def per_call(func, number):
+    return min(timeit.repeat(func, repeat=5, number=number)) / number
+
+
+def main():
+    print(f"{'tracks':>8} {'old full list us':>17} {'first page us':>14} {'last page us':>13} {'cached us':>10} {'chars':>6}")
+    for size in SIZES:
+        player = app.MusicPlayer(guild_id='bench-queue-view')
+        player.queue.extend([Track(f'url{i}', f'Track {i} - ' + 'x' * (i % 120)) for i in range(size)])
+        last = size // app.QUEUE_PAGE_SIZE
+
+        # What get_queue used to build on every click: every entry formatted and joined
+        def old():
+            return "\n".join(f"{idx + 1}. {track.title}" for idx, track in enumerate(player.queue))
+
+        def cold(page):
+            player.queue.touch()
+            return player.queue_page(page)
+
+        old_time = per_call(old, 3)
+        first = per_call(lambda: cold(0), 200)
+        last_page = per_call(lambda: cold(last), 200)
+        cached = per_call(lambda: player.queue_page(last), 2000)
+        chars = max(len(player.queue_page(page)[0]) for page in (0, last))
+        print(f"{size:>8} {old_time * 1e6:>17.1f} {first * 1e6:>14.1f} {last_page * 1e6:>13.1f} "
+              f"{cached * 1e6:>10.2f} {chars:>6}")
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,163 @@
+"""Downloads and files shared by tracks that want the same video at the same time.
+
+Many guilds request one video at once, with and without the audio cache: exactly one
+download must serve them all, and its file must stay on disk until the last track using it
+lets go. Cancelling all but one requester must not stop the shared download, cancelling
+every one must, and a requester paused while another still wants the download must give
+it up at once. Finally one guild queues the same video twice and plays both. Runs offline;
+from the repository root, exiting non-zero if any check fails:
+
+    python benchmarks/shared_downloads.py [requesters]
+"""
+import asyncio
+import os
+import sys
+import time
+
+from fakes import FakeAudioSource, FakeTextChannel, FakeVoiceClient, FakeYoutubeDL, prepare
+
+prepare('single-flight', fake_ffmpeg=True, EXTRACT_WORKERS=0, METRICS_PORT=0, AUDIO_CACHE_MAX_BYTES=0,
+        SESSION_SAVE_INTERVAL=0, PROGRESSIVE_BUFFER_SECONDS=0)
+
+import app  # noqa: E402
+from single_flight import Left  # noqa: E402
+
+TRACK_BYTES = 2 * 1024 * 1024
+
+failures = []
+
+
+def check(ok, what):
+    print(f"  {'ok  ' if ok else 'FAIL'} {what}")
+    if not ok:
+        failures.append(what)
+
+
+async def shared_requests(requesters, label):
+    url = f'https://fake.test/video/shared-{label}'
+    players = [app.MusicPlayer(guild_id=f'flight-{label}-{i}') for i in range(requesters)]
+    downloads = FakeYoutubeDL.downloads
+    started = time.monotonic()
+    results = await asyncio.gather(*(player.download_and_convert(url) for player in players))
+    elapsed = time.monotonic() - started
+    paths = {result[0] for result in results}
+    path = next(iter(paths))
+    check(FakeYoutubeDL.downloads - downloads == 1,
+          f"{requesters} concurrent requests, {FakeYoutubeDL.downloads - downloads} download(s) in {elapsed:.2f}s")
+    check(len(paths) == 1, "every requester got the same file")
+    survived = True
+    for player in players[:-1]:
+        await player.cleanup_file(path)
+        survived &= os.path.exists(path)
+    check(survived, f"file kept while any of the {requesters} tracks used it")
+    await players[-1].cleanup_file(path)
+    if app.audio_cache:
+        check(not app.audio_cache.pins, "no cache pins left once every track let go")
+    else:
+        check(not os.path.exists(path) and not app.file_refs, "file deleted after the last track let go")
+
+
+async def cancelled_requests(requesters, label):
+    url = f'https://fake.test/video/cancelled-{label}'
+    players = [app.MusicPlayer(guild_id=f'cancel-{label}-{i}') for i in range(requesters)]
+    interrupts = [asyncio.Event() for _ in players]  # Stand-ins for the tracks' threading.Events
+    downloads = FakeYoutubeDL.downloads
+    tasks = [asyncio.ensure_future(player.download_and_convert(url, interrupt))
+             for player, interrupt in zip(players, interrupts)]
+    while not FakeYoutubeDL.active:
+        await asyncio.sleep(0.005)
+    for task, interrupt in zip(tasks[:-1], interrupts[:-1]):
+        interrupt.set()
+        task.cancel()
+    path, *_ = await tasks[-1]
+    check(FakeYoutubeDL.downloads - downloads == 1 and os.path.exists(path),
+          f"download finished for the one requester left of {requesters}")
+    await players[-1].cleanup_file(path)
+
+    url = f'https://fake.test/video/abandoned-{label}'
+    interrupts = [asyncio.Event() for _ in players]  # Each download a track starts gets a new one
+    tasks = [asyncio.ensure_future(player.download_and_convert(url, interrupt))
+             for player, interrupt in zip(players, interrupts)]
+    while not FakeYoutubeDL.active:
+        await asyncio.sleep(0.005)
+    for task in tasks:
+        task.cancel()
+    started = time.monotonic()
+    while FakeYoutubeDL.active and time.monotonic() - started < 5:
+        await asyncio.sleep(0.005)
+    await asyncio.sleep(0.05)  # Let the discard callback run
+    leftovers = [os.path.join(dirpath, filename) for dirpath, _, filenames in os.walk('downloads')
+                 for filename in filenames if 'abandoned' in filename]
+    check(not FakeYoutubeDL.active and not leftovers and not app.shared_downloads.flights,
+          f"download stopped {(time.monotonic() - started) * 1e3:.0f} ms after all {requesters} requesters "
+          f"cancelled, {len(leftovers)} file(s) left")
+
+
+async def paused_request(label):
+    # Pausing frees the paused track's download slot, so it must not wait for a download others keep going
+    url = f'https://fake.test/video/paused-{label}'
+    players = [app.MusicPlayer(guild_id=f'pause-{label}-{i}') for i in range(2)]
+    interrupts = [asyncio.Event() for _ in players]
+    downloads = FakeYoutubeDL.downloads
+    tasks = [asyncio.ensure_future(player.download_and_convert(url, interrupt))
+             for player, interrupt in zip(players, interrupts)]
+    while not FakeYoutubeDL.active:
+        await asyncio.sleep(0.005)
+    paused = time.monotonic()
+    interrupts[0].set()
+    app.shared_downloads.leave(interrupts[0])
+    try:
+        await tasks[0]
+        left = False
+    except Left:
+        left = True
+    waited = time.monotonic() - paused
+    running = FakeYoutubeDL.active
+    path, *_ = await tasks[1]
+    check(left and running and FakeYoutubeDL.downloads - downloads == 1 and os.path.exists(path),
+          f"paused requester left after {waited * 1e3:.1f} ms, the download going on for the other")
+    await players[1].cleanup_file(path)
+
+
+async def queued_twice():
+    player = app.MusicPlayer(guild_id='twice')
+    player.current_voice_client = FakeVoiceClient()
+    player.text_channel = FakeTextChannel()
+    downloads = FakeYoutubeDL.downloads
+    await player.add_entries([{'url': 'https://fake.test/video/twice', 'title': 'Twice'}] * 2)
+    await player.start()
+    started = time.monotonic()
+    while len(player.current_voice_client.ends) < 2 and time.monotonic() - started < 10:
+        await asyncio.sleep(0.01)
+    errors = [content for content, _ in player.text_channel.messages if content and 'Error' in content]
+    check(len(player.current_voice_client.ends) == 2 and not errors and FakeYoutubeDL.downloads - downloads == 1,
+          f"same video queued twice in one guild: {len(player.current_voice_client.ends)} played, "
+          f"{FakeYoutubeDL.downloads - downloads} download(s), {len(errors)} error(s)")
+    await player.stop()
+
+
+async def main(requesters):
+    FakeYoutubeDL.media_path = os.path.abspath('media.bin')
+    with open(FakeYoutubeDL.media_path, 'wb') as f:
+        f.write(os.urandom(TRACK_BYTES))
+    FakeYoutubeDL.download_rate = 20e6
+    FakeYoutubeDL.chunk_size = 64 * 1024
+    app.yt_dlp.YoutubeDL = FakeYoutubeDL
+    app.warm_up()  # As startup does, so the cache lookups do not compile every extractor's pattern
+    app.MusicPlayer.create_audio_source = (
+        lambda self, source, is_stream, codec=None, start=0, gain=0: FakeAudioSource(source, 0.2))
+
+    for label, cache in (('no-cache', None), ('cache', app.AudioCache(os.path.abspath('cache'), 1 << 30))):
+        print(f"Audio cache {'on' if cache else 'off'}:")
+        app.audio_cache = cache
+        await shared_requests(requesters, label)
+        await cancelled_requests(requesters, label)
+        await paused_request(label)
+    app.audio_cache = None
+    await queued_twice()
+    print(f"Shared downloads: {app.shared_downloads.stats()}")
+    sys.exit(1 if failures else 0)
+
+
+if __name__ == '__main__':
+    asyncio.run(main(int(sys.argv[1]) if len(sys.argv) > 1 else 16))
@@ -0,0 +1,125 @@
+"""Autocomplete latency and match rate of the title index, and /search's remote fallback.
+
+Indexes synthetic titles, reloads them from SQLite as a restart would, and checks that an
+index a tenth their size keeps only the titles seen most recently, in memory and on disk.
+It then times /play
+autocomplete for queries typed the way users do: a few words, the last one unfinished, and
+some with a typo. A query counts as a hit when the title it was taken from is among the 25
+suggestions. Finally /search is run for words nothing indexed matches: the first call goes
+to the (fake) remote search, whose results are indexed, so repeating it is answered locally.
+Runs offline; from the repository root, exiting non-zero if a lookup misses Discord's 3
+second deadline, fewer than 90% of queries hit or the smaller index outgrows its limit:
+
+    python benchmarks/title_search.py [titles]
+"""
+import asyncio
+import os
+import random
+import statistics
+import sys
+import time
+
+from fakes import FakeInteraction, FakeYoutubeDL, prepare
+
+prepare('title-search', EXTRACT_WORKERS=0, METRICS_PORT=0, AUDIO_CACHE_MAX_BYTES=0)
+
+import app  # noqa: E402
+from title_index import TitleIndex  # noqa: E402
+
+QUERIES = 1000
+TYPO_SHARE = 0.3
+DEADLINE = 3.0
+
+rng = random.Random(0)
+
+
+def made_up_word():
+    return ''.join(rng.choice('bcdfghjklmnprstvwz') + rng.choice('aeiou') for _ in range(rng.randint(2, 4)))
+
+
+def make_titles(count):
+    vocabulary = [made_up_word() for _ in range(20000)]
+    artists = [' '.join(rng.sample(vocabulary, rng.randint(1, 2))).title() for _ in range(count // 20 + 1)]
+    return [(f'https://fake.test/video/t{i}', f"{rng.choice(artists)} - "
+             f"{' '.join(rng.sample(vocabulary, rng.randint(2, 5))).title()} (Official Audio)", rng.randint(90, 600))
+            for i in range(count)]
+
+
+def typed_query(title):
+    # What someone might have typed so far: two or three of the title's words, the last one cut short
+    words = [word for word in title.lower().replace('-', ' ').split() if word.isalpha() and word not in ('official', 'audio')]
+    start = rng.randrange(max(1, len(words) - 1))
+    words = words[start:start + rng.randint(2, 3)]
+    if len(words[-1]) > 3:
+        words[-1] = words[-1][:rng.randint(3, len(words[-1]))]
+    typo = rng.random() < TYPO_SHARE and len(words[0]) > 4
+    if typo:
+        # Swap two neighbouring letters of the first word
+        i = rng.randrange(1, len(words[0]) - 2)
+        words[0] = words[0][:i] + words[0][i + 1] + words[0][i] + words[0][i + 2:]
+    return ' '.join(words), typo
+
+
+async def main(count):
+    titles = make_titles(count)
+    path = os.path.abspath('titles.sqlite3')
+    index = TitleIndex(path, count)
+    started = time.perf_counter()
+    for i in range(0, count, 100):
+        index.add(titles[i:i + 100])  # As extractions index a playlist page at a time
+    added = time.perf_counter() - started
+    index.db.close()
+
+    # A restart: the index is read back from SQLite
+    app.title_index = TitleIndex(path, count)
+    started = time.perf_counter()
+    loaded = app.title_index.load()
+    load_time = time.perf_counter() - started
+    stats = app.title_index.stats()
+    print(f"{count} titles: indexed in {added:.2f}s, {loaded} reloaded in {load_time:.2f}s, "
+          f"{stats['words']} distinct words")
+
+    limit = count // 10
+    small = TitleIndex(os.path.abspath('small.sqlite3'), limit)
+    for i in range(0, count, 100):
+        small.add(titles[i:i + 100])
+    rows = small.db.execute('SELECT COUNT(*) FROM titles').fetchone()[0]
+    bounded = len(small.titles) == rows == limit and set(small.titles) == {url for url, _, _ in titles[-limit:]}
+    print(f"{count} titles into an index of {limit}: {len(small.titles)} kept in memory, {rows} on disk, "
+          f"{small.stats()['words']} distinct words{'' if bounded else ' (FAIL)'}")
+    small.db.close()
+
+    latencies = {False: [], True: []}
+    hits = {False: 0, True: 0}
+    for url, title, _ in rng.sample(titles, QUERIES):
+        query, typo = typed_query(title)
+        started = time.perf_counter()
+        choices = await app.title_autocomplete(None, query)
+        latencies[typo].append(time.perf_counter() - started)
+        hits[typo] += any(choice.value == url for choice in choices)
+    print(f"{'queries':>16} {'count':>6} {'hit rate':>9} {'p50':>8} {'p99':>8} {'max':>8}")
+    for typo, name in ((False, 'as typed'), (True, 'with a typo')):
+        times = sorted(latencies[typo])
+        print(f"{name:>16} {len(times):6d} {hits[typo] / len(times):9.1%} {statistics.median(times) * 1e3:6.1f}ms "
+              f"{times[int(len(times) * 0.99)] * 1e3:6.1f}ms {times[-1] * 1e3:6.1f}ms")
+    slowest = max(max(latencies[False]), max(latencies[True]))
+    hit_rate = (hits[False] + hits[True]) / QUERIES
+
+    FakeYoutubeDL.extract_latency = 0.3
+    app.yt_dlp.YoutubeDL = FakeYoutubeDL
+    print("/search for words nothing indexed matches:")
+    for attempt in range(3):
+        interaction = FakeInteraction('bench-search')
+        extractions = FakeYoutubeDL.extractions
+        started = time.perf_counter()
+        await app.search.callback(interaction, 'zzyzx quux')
+        elapsed = time.perf_counter() - started
+        _, kwargs = interaction.followup.messages[-1]
+        embed = kwargs['embed']
+        print(f"  attempt {attempt + 1}: {len(embed.description.splitlines())} results in {elapsed * 1e3:6.1f} ms, "
+              f"{embed.footer.text.lower()}, {FakeYoutubeDL.extractions - extractions} remote search(es)")
+    sys.exit(1 if slowest > DEADLINE or hit_rate < 0.9 or not bounded else 0)
+
+
+if __name__ == '__main__':
+    asyncio.run(main(int(sys.argv[1]) if len(sys.argv) > 1 else 100000))
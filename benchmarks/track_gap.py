@@ -0,0 +1,95 @@
+"""Inter-track gap and ready-to-play latency of the player loop with a fake voice client.
+
+Downloads, playback and FFmpeg startup are simulated, so this runs offline. With track
+durations known, the next track must not be opened before GAPLESS_PRELOAD_SECONDS from the
+end of the one playing, nor after it when that one was resumed halfway through; exits
+non-zero if one is. Run from the repository root:
+
+    python benchmarks/track_gap.py
+"""
+import asyncio
+import statistics
+import sys
+import time
+
+from fakes import FakeAudioSource, FakeTextChannel, FakeVoiceClient, prepare
+
+# One download at a time, so the download-bound scenario really makes the player wait
+prepare('gap', DOWNLOAD_WORKERS=1)
+
+import app  # noqa: E402
+
+TRACKS = 8
+PRELOAD_SECONDS = 0.1  # Before the end of a track of known duration
+
+
+async def run(download_time, track_time, startup=0, preload=True, timed=False, resumed=False):
+    # Without a duration every track is opened as soon as the one before it starts
+    app.GAPLESS_PRELOAD_SECONDS = (PRELOAD_SECONDS if timed else 10) if preload else 0
+    player = app.MusicPlayer(guild_id='bench-gap')
+    player.current_voice_client = FakeVoiceClient()
+    player.text_channel = FakeTextChannel()
+    ready_at = {}
+    opened_at = {}
+
+    async def fetch_audio(url, stream=False, interrupt=None, on_progress=None):
+        await asyncio.sleep(download_time)
+        ready_at[url] = time.monotonic()
+        return url, f'Track {url}', None, False, 'opus', None
+
+    player.fetch_audio = fetch_audio
+    player.create_audio_source = (
+        lambda source, is_stream, codec=None, start=0, gain=0: opened_at.setdefault(source, time.monotonic())
+        and FakeAudioSource(source, track_time - start, startup))
+    await player.add_entries([{'url': f'track{i}', 'title': f'Track {i}', 'duration': track_time if timed else None}
+                              for i in range(TRACKS)])
+    if resumed:
+        # Like the track a restart interrupted, which plays on from where it was
+        player.queue.head().start_at = track_time / 2
+    player.downloader_task = asyncio.create_task(player.downloader())
+    player.player_task = asyncio.create_task(player.player())
+    await asyncio.wait_for(player.player_task, TRACKS * (download_time + track_time) + 30)
+
+    voice = player.current_voice_client
+    gaps = [start - end for (start, _), end in zip(voice.plays[1:], voice.ends)]
+    # How long a finished download sat before the player noticed it (only when the player was waiting)
+    waits = [start - ready_at[url] for (start, url), end in zip(voice.plays[1:], voice.ends)
+             if ready_at[url] > end]
+    # Tracks opened before the one ahead of them was within PRELOAD_SECONDS of its end; the
+    # first track was not pre-opened, so it ends up to its startup later than its duration says
+    early = [url for end, (_, url) in zip(voice.ends, voice.plays[1:])
+             if opened_at[url] < end - PRELOAD_SECONDS - startup - 0.02]
+    await player.stop()
+    return gaps, waits, early
+
+
+def summary(values):
+    if not values:
+        return f"{'-':>9} {'-':>9}"
+    return f"{statistics.mean(values) * 1e3:>9.1f} {max(values) * 1e3:>9.1f}"
+
+
+async def main():
+    print(f"{'scenario':>30} {'gap avg ms':>9} {'max':>9} {'wait avg ms':>9} {'max':>9}")
+    failed = False
+    for name, download_time, track_time, startup, preload, timed, resumed in (
+            ('downloads ahead', 0.01, 0.3, 0, True, False, False),
+            ('download-bound', 0.4, 0.1, 0, True, False, False),
+            ('80 ms startup, opened at end', 0.01, 0.3, 0.08, False, False, False),
+            ('80 ms startup, pre-opened', 0.01, 0.3, 0.08, True, False, False),
+            ('80 ms startup, timed preload', 0.01, 0.3, 0.08, True, True, False),
+            ('80 ms startup, timed, resumed', 0.01, 0.3, 0.08, True, True, True)):
+        gaps, waits, early = await run(download_time, track_time, startup, preload, timed, resumed)
+        print(f"{name:>30} {summary(gaps)} {summary(waits)}")
+        if timed and early:
+            print(f"FAIL: {', '.join(early)} opened before the track ahead was "
+                  f"{PRELOAD_SECONDS * 1e3:.0f} ms from its end")
+            failed = True
+        if resumed and gaps[0] > startup / 2:
+            print(f"FAIL: the track after the resumed one waited {gaps[0] * 1e3:.0f} ms to start")
+            failed = True
+    sys.exit(1 if failed else 0)
+
+
+if __name__ == '__main__':
+    asyncio.run(main())
@@ -0,0 +1,69 @@
+"""Micro-benchmark of TrackQueue operations at 10k tracks.
+
+Run from the repository root:
+
+    python benchmarks/track_queue.py [track count]
+"""
+import random
+import sys
+import timeit
+from collections import deque
+
+from fakes import prepare
+
+prepare('track-queue')
+
+from tracks import Track, TrackQueue  # noqa: E402
+
+REPEAT = 200
+
+
+def build(count):
+    queue = TrackQueue()
+    queue.extend([Track(f'https://www.youtube.com/watch?v={i:011d}', f'Track {i}') for i in range(count)])
+    return queue
+
+
+def per_call(statement, setup=None, number=REPEAT):
+    timer = timeit.Timer(statement, setup=setup or (lambda: None))
+    return min(timer.repeat(repeat=5, number=number)) / number
+
+
+def main(count):
+    queue = build(count)
+    ids = [track.id for track in queue]
+    rng = random.Random(1)
+
+    results = {
+        'build': per_call(lambda: build(count), number=5),
+        'get by id': per_call(lambda: queue.get(rng.choice(ids))),
+        'index of id': per_call(lambda: queue.index_of(queue[rng.randrange(count)].id)),
+        'move (random)': per_call(lambda: queue.move(rng.randrange(count), rng.randrange(count))),
+        'remove_at + re-add': per_call(lambda: queue.extend([queue.remove_at(rng.randrange(len(queue)))])),
+        'popleft + re-add': per_call(lambda: queue.extend([queue.popleft()])),
+        'play next (insert front)': per_call(lambda: queue.extend([queue.remove_at(len(queue) - 1)], front=True)),
+        'window(5)': per_call(lambda: queue.window(5)),
+    }
+
+    skip_queues = [build(count) for _ in range(5)]
+    results['skip_to(half)'] = min(timeit.timeit(lambda q=q: q.skip_to(count // 2), number=1) for q in skip_queues)
+
+    # What skip_to_position cost with the old pair of deques, popping one item at a time
+    def old_skip():
+        upcoming = deque((f'url{i}', f'Track {i}') for i in range(count))
+        play = deque((f'file{i}', f'Track {i}', None) for i in range(count))
+        start = timeit.default_timer()
+        for _ in range(count // 2):
+            upcoming.popleft()
+            if play:
+                play.popleft()
+        return timeit.default_timer() - start
+    results['old skip_to(half), deques'] = min(old_skip() for _ in range(5))
+
+    print(f"{count} tracks")
+    for name, seconds in results.items():
+        print(f"{name:>28} {seconds * 1e6:>12.2f} us")
+
+
+if __name__ == '__main__':
+    main(int(sys.argv[1]) if len(sys.argv) > 1 else 10_000)
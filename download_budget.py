@@ -0,0 +1,65 @@
+class DownloadBudget:
+    """Bytes that downloaded and downloading tracks take up on disk, per guild and in total.
+
+    Each limit has a high-water mark, at which a guild stops downloading, and a low-water
+    mark (low_water times the limit) below which it starts again, so downloads do not flap
+    around the limit. A limit of 0 means no limit.
+    """
+
+    def __init__(self, max_bytes, guild_max_bytes, low_water=0.75):
+        self.max_bytes = max_bytes
+        self.guild_max_bytes = guild_max_bytes
+        self.low_water = low_water
+        self.usage = {}  # guild -> bytes
+        self.total = 0
+        self.throttled = False  # Reached the global high-water mark and not yet back under the low one
+        self.throttled_guilds = set()
+        self.waiting = {}  # guild -> callback run once the global limit lifts
+        self.pauses = 0  # Times a guild had to stop downloading
+
+    def report(self, guild, used):
+        self.total += used - self.usage.get(guild, 0)
+        if used:
+            self.usage[guild] = used
+        else:
+            self.usage.pop(guild, None)
+        if guild in self.throttled_guilds and used <= self.guild_max_bytes * self.low_water:
+            self.throttled_guilds.discard(guild)
+        if self.throttled and self.total <= self.max_bytes * self.low_water:
+            self.throttled = False
+            waiting, self.waiting = self.waiting, {}
+            for wake in waiting.values():
+                wake()
+
+    def over(self, guild):
+        """Whether guild has to hold off downloading, because of its own limit or the global one."""
+        if self.max_bytes and not self.throttled and self.total >= self.max_bytes:
+            self.throttled = True
+            self.pauses += 1
+        if (self.guild_max_bytes and guild not in self.throttled_guilds
+                and self.usage.get(guild, 0) >= self.guild_max_bytes):
+            self.throttled_guilds.add(guild)
+            self.pauses += 1
+        return self.throttled or guild in self.throttled_guilds
+
+    def wait(self, guild, wake):
+        # wake() runs once the global limit lifts; a guild's own limit lifts on its own report()
+        self.waiting[guild] = wake
+
+    def forget(self, guild):
+        self.report(guild, 0)
+        self.throttled_guilds.discard(guild)
+        self.waiting.pop(guild, None)
+
+    def stats(self, guild=None):
+        stats = {
+            'bytes': self.total,
+            'max_bytes': self.max_bytes,
+            'throttled': self.throttled,
+            'throttled_guilds': len(self.throttled_guilds),
+            'pauses': self.pauses,
+        }
+        if guild is not None:
+            stats.update(guild_bytes=self.usage.get(guild, 0), guild_max_bytes=self.guild_max_bytes,
+                         guild_throttled=guild in self.throttled_guilds)
+        return stats
@@ -0,0 +1,150 @@
+import asyncio
+import importlib
+import json
+import os
+import sys
+
+from lazy_import import lazy_import
+
+# Only workers run extractions; the bot process needs yt-dlp just for its DownloadError
+yt_dlp = lazy_import('yt_dlp')
+
+# YoutubeDL instances a worker keeps warm, one per distinct set of options
+WARM_INSTANCES = 8
+# Options that change from one job to the next, like the page of a playlist, are set on a warm
+# instance for a single job rather than each keeping an instance of its own
+PER_JOB_OPTIONS = ('playlist_items',)
+# Replies carry whole info dicts, which run to megabytes for long playlists
+REPLY_LIMIT = 64 * 1024 * 1024
+
+_ydls = {}  # Worker side: options -> YoutubeDL, least recently used first
+
+
+def extract(url, opts):
+    """Worker side: resolve url with a YoutubeDL that is reused across jobs."""
+    opts = dict(opts)
+    per_job = {name: opts.pop(name) for name in PER_JOB_OPTIONS if name in opts}
+    key = json.dumps(opts, sort_keys=True)
+    ydl = _ydls.pop(key, None) or yt_dlp.YoutubeDL(opts)
+    _ydls[key] = ydl
+    while len(_ydls) > WARM_INSTANCES:
+        _ydls.pop(next(iter(_ydls))).close()
+    ydl.params.update(per_job)
+    try:
+        return ydl.sanitize_info(ydl.extract_info(url, download=False))
+    finally:
+        for name in per_job:
+            ydl.params.pop(name, None)
+
+
+def serve(job):
+    # yt-dlp writes its own output to stdout, so replies go over a private copy of it
+    replies = os.fdopen(os.dup(1), 'w')
+    os.dup2(2, 1)
+    for line in sys.stdin:
+        request = json.loads(line)
+        try:
+            reply = {'info': job(request['url'], request['opts'])}
+        except Exception as e:
+            reply = {'error': str(e)}
+        replies.write(json.dumps(reply) + '\n')
+        replies.flush()
+
+
+class ExtractionPool:
+    """yt-dlp extractions in long-lived worker processes.
+
+    Each worker handles one job at a time and keeps its YoutubeDL instances between jobs,
+    so extractor setup is paid once per process and parsing stays off the bot's GIL. At
+    most `size` jobs run at once; the rest wait for a free worker. A worker that times out
+    is killed, and one that crashes is replaced and the job retried once.
+    """
+
+    def __init__(self, size, timeout, job=None):
+        self.size = size
+        self.timeout = timeout
+        self.job = job  # 'module:function' run instead of extract(), for benchmarks
+        # Idle workers; None is a slot whose process has not been started (or was killed)
+        self.idle = asyncio.Queue()
+        for _ in range(size):
+            self.idle.put_nowait(None)
+        self.jobs = 0
+        self.timeouts = 0
+        self.crashes = 0
+
+    async def _spawn(self):
+        command = [sys.executable, os.path.abspath(__file__)]
+        if self.job:
+            command += ['--job', self.job]
+        return await asyncio.create_subprocess_exec(
+            *command, stdin=asyncio.subprocess.PIPE, stdout=asyncio.subprocess.PIPE, limit=REPLY_LIMIT)
+
+    @staticmethod
+    def _kill(process):
+        if process is not None and process.returncode is None:
+            process.kill()
+
+    async def _call(self, process, url, opts):
+        process.stdin.write(json.dumps({'url': url, 'opts': opts}).encode() + b'\n')
+        await process.stdin.drain()
+        line = await process.stdout.readline()
+        if not line:
+            raise ConnectionError("extraction worker exited")
+        reply = json.loads(line)
+        if 'error' in reply:
+            raise yt_dlp.utils.DownloadError(reply['error'])
+        return reply['info']
+
+    async def run(self, url, opts):
+        process = await self.idle.get()
+        try:
+            for attempt in range(2):
+                if process is None or process.returncode is not None:
+                    process = await self._spawn()
+                try:
+                    self.jobs += 1
+                    return await asyncio.wait_for(self._call(process, url, opts), self.timeout)
+                except ConnectionError:
+                    self.crashes += 1
+                    self._kill(process)
+                    process = None
+                    if attempt:
+                        raise
+                    print(f"Extraction worker crashed on {url}, retrying")
+        except yt_dlp.utils.DownloadError:
+            raise
+        except asyncio.TimeoutError:
+            self.timeouts += 1
+            self._kill(process)
+            process = None
+            raise TimeoutError(f"Extraction of {url} timed out after {self.timeout:g}s")
+        except BaseException:
+            # Cancelled mid-job: the worker's late reply would be read by the next job
+            self._kill(process)
+            process = None
+            raise
+        finally:
+            self.idle.put_nowait(process)
+
+    async def close(self):
+        while not self.idle.empty():
+            process = self.idle.get_nowait()
+            if process is not None and process.returncode is None:
+                process.stdin.close()
+                await process.wait()
+
+    def stats(self):
+        return {
+            'workers': self.size,
+            'jobs': self.jobs,
+            'timeouts': self.timeouts,
+            'crashes': self.crashes,
+        }
+
+
+if __name__ == '__main__':
+    job = extract
+    if len(sys.argv) == 3 and sys.argv[1] == '--job':
+        module, _, name = sys.argv[2].partition(':')
+        job = getattr(importlib.import_module(module), name)
+    serve(job)
@@ -0,0 +1,48 @@
+import threading
+import time
+
+
+class GrowingFile:
+    """Reads, from the start, a file that a download is still writing.
+
+    A read that catches up with the download waits for more data instead of returning EOF,
+    until finish() says the download is over. If nothing new arrives for stall_timeout
+    seconds the read ends as if the file were complete. Handed to FFmpeg as a pipe source.
+    """
+
+    def __init__(self, path, poll=0.05, stall_timeout=30):
+        self.file = open(path, 'rb')
+        self.lock = threading.Lock()
+        self.finished = threading.Event()
+        self.complete = False  # Whether the download finished successfully
+        self.poll = poll
+        self.stall_timeout = stall_timeout
+        self.waits = 0  # Times playback caught up with the download
+
+    def read(self, size=-1):
+        stalled_since = None
+        while True:
+            # Checked before reading, so data written just before finish() is not lost
+            done = self.finished.is_set()
+            with self.lock:
+                if self.file.closed:
+                    return b''
+                data = self.file.read(size)
+            if data or done:
+                return data
+            if stalled_since is None:
+                stalled_since = time.monotonic()
+                self.waits += 1
+            elif time.monotonic() - stalled_since > self.stall_timeout:
+                print(f"Download of {self.file.name} stalled, ending playback early")
+                return b''
+            self.finished.wait(self.poll)
+
+    def finish(self, complete=True):
+        self.complete = complete
+        self.finished.set()
+
+    def close(self):
+        with self.lock:
+            self.file.close()
+        self.finished.set()
@@ -0,0 +1,312 @@
+import asyncio
+import hmac
+import itertools
+import json
+import os
+import threading
+import time
+from collections import deque
+
+# Largest message either side sends; resolve results carry whole info dicts
+MESSAGE_LIMIT = 64 * 1024 * 1024
+# Seconds between a worker's heartbeats
+HEARTBEAT_INTERVAL = 5
+
+
+class JobError(Exception):
+    """A job failed on its worker, was interrupted, or no worker could run it."""
+
+
+def parse_address(address):
+    """'unix:/path/to.sock', 'tcp:host:port' or 'host:port' -> ('unix', path) or ('tcp', host, port)."""
+    kind, _, rest = address.partition(':')
+    if kind == 'unix':
+        return 'unix', rest
+    if kind != 'tcp':
+        rest = address
+    host, _, port = rest.rpartition(':')
+    return 'tcp', host or '127.0.0.1', int(port)
+
+
+def encode(message):
+    return json.dumps(message).encode() + b'\n'
+
+
+class Job:
+    def __init__(self, job_id, kind, payload, on_progress, interrupted, future):
+        self.id = job_id
+        self.kind = kind
+        self.payload = payload
+        self.on_progress = on_progress
+        self.interrupted = interrupted
+        self.future = future
+        self.attempts = 0
+        self.worker = None
+        self.tried = set()  # Workers it was given to before
+        self.acked = False
+        self.sent_at = None
+        self.queued_at = time.monotonic()
+
+
+class WorkerLink:
+    """The broker's end of a connected worker."""
+
+    def __init__(self, name, capacity, writer):
+        self.name = name
+        self.capacity = capacity
+        self.writer = writer
+        self.jobs = {}  # id -> Job it is running
+        self.last_seen = time.monotonic()
+
+    def send(self, message):
+        # A worker that stops reading is caught by the health check, not here
+        if not self.writer.is_closing():
+            self.writer.write(encode(message))
+
+
+class JobBroker:
+    """Hands resolve, download and transcode jobs to media workers over a Unix or TCP socket.
+
+    Workers (media_worker.py) connect, say how many jobs they run at once and are given
+    jobs from one queue, least busy worker first, and retries to a different worker. A worker acks a job as it starts it,
+    reports progress and the result over the same connection, and sends a heartbeat every
+    few seconds. A job that is not acked within ack_timeout, or whose worker disconnects or
+    goes health_timeout without a word, goes back to the front of the queue for another
+    worker, up to max_attempts times. Errors raised by the job itself, like an unavailable
+    video, are not retried. Jobs no worker takes up within queue_timeout fail.
+
+    A worker's hello must carry the broker's token, if it has one; one listening on TCP must.
+    """
+
+    def __init__(self, address, ack_timeout=10, health_timeout=15, max_attempts=3, queue_timeout=60, token=''):
+        if parse_address(address)[0] == 'tcp' and not token:
+            raise ValueError(f"A job broker on {address} needs a token for its workers")
+        self.address = address
+        self.token = token
+        self.ack_timeout = ack_timeout
+        self.health_timeout = health_timeout
+        self.max_attempts = max_attempts
+        self.queue_timeout = queue_timeout
+        self.queue = deque()
+        self.workers = set()
+        self.ids = itertools.count(1)
+        self.server = None
+        self.monitor_task = None
+        self.completed = 0
+        self.retries = 0
+        self.failures = 0
+        self.lost_workers = 0
+
+    async def start(self):
+        if self.server is not None:
+            return
+        kind, *where = parse_address(self.address)
+        if kind == 'unix':
+            if os.path.exists(where[0]):
+                os.remove(where[0])  # Left over from a previous run
+            self.server = await asyncio.start_unix_server(self._serve, where[0], limit=MESSAGE_LIMIT)
+        else:
+            self.server = await asyncio.start_server(self._serve, *where, limit=MESSAGE_LIMIT)
+        self.monitor_task = asyncio.create_task(self._monitor())
+        print(f"Waiting for media workers on {self.address}")
+
+    async def close(self):
+        if self.monitor_task:
+            self.monitor_task.cancel()
+        if self.server:
+            self.server.close()
+        for worker in list(self.workers):
+            worker.writer.close()
+        while self.queue:
+            job = self.queue.popleft()
+            if not job.future.done():
+                job.future.set_exception(JobError("The job broker was closed"))
+
+    async def submit(self, kind, payload, on_progress=None, interrupted=None):
+        """Run a job on a worker and return its result.
+
+        on_progress(update) gets the worker's progress reports. Once interrupted() returns
+        true on a report, the job is stopped, keeping what it wrote, and JobError raised. If
+        the caller is cancelled instead, the worker stops and removes what it wrote.
+        """
+        job = Job(next(self.ids), kind, payload, on_progress, interrupted, asyncio.get_running_loop().create_future())
+        self.queue.append(job)
+        self._dispatch()
+        try:
+            return await job.future
+        except asyncio.CancelledError:
+            self._abandon(job, discard=True)
+            raise
+
+    def _abandon(self, job, discard):
+        if job in self.queue:
+            self.queue.remove(job)
+        elif job.worker is not None:
+            worker = job.worker
+            del worker.jobs[job.id]
+            job.worker = None
+            worker.send({'type': 'cancel', 'id': job.id, 'discard': discard})
+            self._dispatch()
+
+    def _dispatch(self):
+        while self.queue:
+            free = [worker for worker in self.workers if len(worker.jobs) < worker.capacity]
+            if not free:
+                return
+            job = self.queue.popleft()
+            # A retried job goes to a worker it has not failed on yet, if one has room
+            free = [worker for worker in free if worker not in job.tried] or free
+            worker = min(free, key=lambda worker: len(worker.jobs) / worker.capacity)
+            job.tried.add(worker)
+            job.attempts += 1
+            job.worker = worker
+            job.acked = False
+            job.sent_at = time.monotonic()
+            worker.jobs[job.id] = job
+            worker.send({'type': 'job', 'id': job.id, 'kind': job.kind, 'payload': job.payload})
+
+    def _retry(self, job, reason):
+        # The job's worker went away or never took it up; hand it to another one
+        job.worker = None
+        if job.future.done():
+            return
+        if job.attempts >= self.max_attempts:
+            self.failures += 1
+            job.future.set_exception(JobError(f"{job.kind} job failed after {job.attempts} attempt(s): {reason}"))
+            return
+        self.retries += 1
+        print(f"Retrying {job.kind} job {job.id}: {reason}")
+        job.queued_at = time.monotonic()
+        self.queue.appendleft(job)
+
+    async def _serve(self, reader, writer):
+        worker = None
+        try:
+            hello = json.loads(await reader.readline() or 'null')
+            if not isinstance(hello, dict) or hello.get('type') != 'hello':
+                return
+            if self.token and not hmac.compare_digest(str(hello.get('token') or '').encode(), self.token.encode()):
+                print(f"Rejecting a media worker from {writer.get_extra_info('peername') or 'the socket'}: wrong token")
+                return
+            worker = WorkerLink(str(hello.get('name') or writer.get_extra_info('peername')),
+                                max(1, int(hello.get('capacity', 1))), writer)
+            self.workers.add(worker)
+            print(f"Media worker {worker.name} connected with {worker.capacity} job slot(s)")
+            self._dispatch()
+            while line := await reader.readline():
+                worker.last_seen = time.monotonic()
+                self._handle(worker, json.loads(line))
+        except (ConnectionError, ValueError) as e:
+            print(f"Dropping media worker {worker.name if worker else 'connection'}: {e}")
+        finally:
+            writer.close()
+            if worker is not None:
+                self.workers.discard(worker)
+                jobs = list(worker.jobs.values())
+                worker.jobs.clear()
+                self.lost_workers += 1
+                print(f"Media worker {worker.name} disconnected with {len(jobs)} job(s) running")
+                for job in jobs:
+                    self._retry(job, f"worker {worker.name} disconnected")
+                self._dispatch()
+
+    def _handle(self, worker, message):
+        kind = message.get('type')
+        job = worker.jobs.get(message.get('id'))
+        if job is None:
+            # A heartbeat, or news of a job that was cancelled or given to another worker
+            return
+        if kind == 'ack':
+            job.acked = True
+        elif kind == 'progress':
+            if job.interrupted is not None and job.interrupted():
+                self._abandon(job, discard=False)
+                job.future.set_exception(JobError(f"{job.kind} job interrupted"))
+            elif job.on_progress is not None:
+                job.on_progress(message['update'])
+        elif kind in ('result', 'error'):
+            del worker.jobs[job.id]
+            job.worker = None
+            if kind == 'result':
+                self.completed += 1
+                job.future.set_result(message['result'])
+            else:
+                self.failures += 1
+                job.future.set_exception(JobError(message['error']))
+            self._dispatch()
+
+    async def _monitor(self):
+        while True:
+            await asyncio.sleep(1)
+            now = time.monotonic()
+            for worker in list(self.workers):
+                if now - worker.last_seen > self.health_timeout:
+                    # Its connection handler hands its jobs to other workers as it closes
+                    print(f"Media worker {worker.name} missed its heartbeats, dropping it")
+                    self.workers.discard(worker)
+                    worker.writer.close()
+                    continue
+                for job in list(worker.jobs.values()):
+                    if not job.acked and now - job.sent_at > self.ack_timeout:
+                        del worker.jobs[job.id]
+                        worker.send({'type': 'cancel', 'id': job.id, 'discard': True})
+                        self._retry(job, f"worker {worker.name} did not ack it within {self.ack_timeout:g}s")
+            for job in list(self.queue):
+                if now - job.queued_at > self.queue_timeout:
+                    self.queue.remove(job)
+                    self.failures += 1
+                    job.future.set_exception(
+                        JobError(f"No media worker took the {job.kind} job within {self.queue_timeout:g}s"))
+            self._dispatch()
+
+    def stats(self):
+        return {
+            'workers': len(self.workers),
+            'slots': sum(worker.capacity for worker in self.workers),
+            'queued': len(self.queue),
+            'running': sum(len(worker.jobs) for worker in self.workers),
+            'completed': self.completed,
+            'retries': self.retries,
+            'failures': self.failures,
+            'lost_workers': self.lost_workers,
+        }
+
+
+class LocalBroker:
+    """Stand-in for JobBroker that runs the job handlers in this process.
+
+    Takes the same submissions, so worker mode can be exercised on one machine without
+    sockets or worker processes. Progress reports may come from the handlers' threads.
+    """
+
+    def __init__(self, handlers):
+        self.handlers = handlers
+        self.completed = 0
+        self.failures = 0
+
+    async def start(self):
+        pass
+
+    async def close(self):
+        pass
+
+    async def submit(self, kind, payload, on_progress=None, interrupted=None):
+        stop = threading.Event()
+
+        def progress(update):
+            if interrupted is not None and interrupted():
+                stop.set()
+            elif on_progress is not None:
+                on_progress(update)
+
+        try:
+            result = await self.handlers[kind](payload, progress, stop)
+        except Exception as e:
+            self.failures += 1
+            raise JobError(str(e) or type(e).__name__) from e
+        self.completed += 1
+        return result
+
+    def stats(self):
+        return {'workers': 0, 'slots': 0, 'queued': 0, 'running': 0, 'completed': self.completed,
+                'retries': 0, 'failures': self.failures, 'lost_workers': 0}
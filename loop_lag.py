@@ -0,0 +1,88 @@
+import asyncio
+import statistics
+import threading
+from collections import deque
+from concurrent.futures import ThreadPoolExecutor
+
+
+class LoopLagMonitor:
+    """Measures how late the event loop wakes up from a fixed sleep.
+
+    Lag is time the loop spent busy (or waiting for the GIL) instead of handling gateway
+    heartbeats and interactions. Spikes above warn_after are logged.
+    """
+
+    def __init__(self, interval=0.5, warn_after=0.25, samples=1200):
+        self.interval = interval
+        self.warn_after = warn_after
+        self.samples = deque(maxlen=samples)
+        self.task = None
+
+    def start(self):
+        if self.task is None or self.task.done():
+            self.task = asyncio.create_task(self.run())
+
+    def stop(self):
+        if self.task is not None:
+            self.task.cancel()
+
+    async def run(self):
+        loop = asyncio.get_running_loop()
+        while True:
+            started = loop.time()
+            await asyncio.sleep(self.interval)
+            lag = loop.time() - started - self.interval
+            self.samples.append(lag)
+            if self.warn_after and lag > self.warn_after:
+                print(f"Event loop lagged {lag * 1e3:.0f} ms")
+
+    def stats(self):
+        if not self.samples:
+            return {'samples': 0, 'p50': 0.0, 'p99': 0.0, 'max': 0.0}
+        ordered = sorted(self.samples)
+        return {
+            'samples': len(ordered),
+            'p50': statistics.median(ordered),
+            'p99': ordered[min(len(ordered) - 1, int(len(ordered) * 0.99))],
+            'max': ordered[-1],
+        }
+
+
+class CountingExecutor(ThreadPoolExecutor):
+    """A thread pool for the loop's default executor that counts the calls waiting for a
+    thread and those running on one, so a saturated pool shows up before the loop stalls."""
+
+    def __init__(self, max_workers=None):
+        super().__init__(max_workers, thread_name_prefix='asyncio')
+        self.lock = threading.Lock()
+        self.queued = 0
+        self.busy = 0
+
+    def submit(self, fn, /, *args, **kwargs):
+        def run():
+            with self.lock:
+                self.queued -= 1
+                self.busy += 1
+            try:
+                return fn(*args, **kwargs)
+            finally:
+                with self.lock:
+                    self.busy -= 1
+
+        with self.lock:
+            self.queued += 1
+        try:
+            future = super().submit(run)
+        except RuntimeError:
+            self._dequeue()  # Shut down
+            raise
+        # Only a call that never started can be cancelled
+        future.add_done_callback(lambda future: future.cancelled() and self._dequeue())
+        return future
+
+    def _dequeue(self):
+        with self.lock:
+            self.queued -= 1
+
+    def stats(self):
+        return {'threads': self._max_workers, 'busy': self.busy, 'queued': self.queued}
@@ -0,0 +1,201 @@
+import argparse
+import asyncio
+import copy
+import importlib
+import json
+import os
+import socket
+import threading
+import time
+
+from dotenv import load_dotenv
+
+from job_broker import HEARTBEAT_INTERVAL, MESSAGE_LIMIT, encode, parse_address
+from lazy_import import lazy_import
+from transcode import convert_to_opus, measure_loudness
+
+yt_dlp = lazy_import('yt_dlp')
+
+load_dotenv()
+FFMPEG_BINARY = os.getenv('FFMPEG_BINARY', 'ffmpeg')
+# Seconds between progress reports of a download
+PROGRESS_INTERVAL = 0.25
+# Fields of yt-dlp's progress updates the bot reads
+PROGRESS_FIELDS = ('status', 'filename', 'tmpfilename', 'downloaded_bytes', 'total_bytes', 'total_bytes_estimate')
+
+
+async def resolve(payload, progress, stop):
+    """Extract the info dict of a URL with the bot's options."""
+    def extract():
+        with yt_dlp.YoutubeDL(payload['opts']) as ydl:
+            return ydl.sanitize_info(ydl.extract_info(payload['url'], download=False))
+    return await asyncio.get_running_loop().run_in_executor(None, extract)
+
+
+async def download(payload, progress, stop):
+    """Download a resolved video with the bot's options and return the path it was written to.
+
+    Setting stop ends the download at its next block and keeps the partial file, so it can
+    be resumed; cancelling the job also removes what it wrote.
+    """
+    written = set()
+    reported_at = 0.0
+
+    def hook(d):
+        nonlocal reported_at
+        if d['status'] != 'downloading':
+            return
+        written.update(path for path in (d.get('tmpfilename'), d.get('filename')) if path)
+        if stop.is_set():
+            raise yt_dlp.utils.DownloadError("Download interrupted")
+        now = time.monotonic()
+        if now - reported_at >= PROGRESS_INTERVAL or d.get('downloaded_bytes') == d.get('total_bytes'):
+            reported_at = now
+            info = d.get('info_dict') or {}
+            progress(dict({field: d.get(field) for field in PROGRESS_FIELDS},
+                          info_dict={'duration': info.get('duration'), 'acodec': info.get('acodec')}))
+
+    def run():
+        with yt_dlp.YoutubeDL(dict(payload['opts'], progress_hooks=[hook])) as ydl:
+            info = ydl.process_ie_result(copy.deepcopy(payload['info']), download=True)
+            if info.get('requested_downloads'):
+                return info['requested_downloads'][0]['filepath']
+            return ydl.prepare_filename(info)
+
+    future = asyncio.get_running_loop().run_in_executor(None, run)
+    try:
+        return await asyncio.shield(future)
+    except asyncio.CancelledError:
+        # The thread stops at its next progress hook; remove what it wrote once it has
+        stop.set()
+        await asyncio.wait({future})
+        future.exception()  # The DownloadError it stopped with
+        for path in written:
+            if os.path.exists(path):
+                os.remove(path)
+        raise
+
+
+async def transcode(payload, progress, stop):
+    """Convert a download to Opus, returning the new path."""
+    return await convert_to_opus(FFMPEG_BINARY, payload['filename'], payload['acodec'])
+
+
+async def loudness(payload, progress, stop):
+    """Measure a download's integrated loudness and true peak."""
+    return await measure_loudness(FFMPEG_BINARY, payload['filename'])
+
+
+HANDLERS = {'resolve': resolve, 'download': download, 'transcode': transcode, 'loudness': loudness}
+
+
+class MediaWorker:
+    """Runs the jobs a JobBroker hands out, up to `capacity` at a time.
+
+    Each job is acked as it starts and its progress and result are reported over the same
+    connection, with a heartbeat every few seconds in between. If the connection drops, the
+    jobs in progress are abandoned, since the broker gives them to other workers, and the
+    worker reconnects.
+    """
+
+    def __init__(self, address, capacity, name, handlers=HANDLERS, token=''):
+        self.address = address
+        self.capacity = capacity
+        self.name = name
+        self.handlers = handlers
+        self.token = token
+        self.jobs = 0
+
+    async def run(self):
+        backoff = 1
+        while True:
+            kind, *where = parse_address(self.address)
+            try:
+                if kind == 'unix':
+                    reader, writer = await asyncio.open_unix_connection(where[0], limit=MESSAGE_LIMIT)
+                else:
+                    reader, writer = await asyncio.open_connection(*where, limit=MESSAGE_LIMIT)
+            except OSError as e:
+                print(f"Could not reach the broker at {self.address} ({e}), retrying in {backoff}s")
+                await asyncio.sleep(backoff)
+                backoff = min(backoff * 2, 30)
+                continue
+            backoff = 1
+            print(f"Connected to the broker at {self.address} as {self.name}")
+            try:
+                await self._session(reader, writer)
+            except (ConnectionError, ValueError) as e:
+                print(f"Lost the broker: {e}")
+            else:
+                print("The broker closed the connection")
+
+    async def _session(self, reader, writer):
+        running = {}  # Job id -> (task, stop event)
+
+        def send(message):
+            if not writer.is_closing():
+                writer.write(encode(message))
+
+        async def heartbeat():
+            while True:
+                send({'type': 'heartbeat'})
+                await asyncio.sleep(HEARTBEAT_INTERVAL)
+
+        send({'type': 'hello', 'name': self.name, 'capacity': self.capacity, 'token': self.token})
+        heartbeat_task = asyncio.create_task(heartbeat())
+        try:
+            while line := await reader.readline():
+                message = json.loads(line)
+                if message['type'] == 'job':
+                    stop = threading.Event()
+                    task = asyncio.create_task(self._run_job(message, send, stop))
+                    running[message['id']] = (task, stop)
+                    task.add_done_callback(lambda task, job_id=message['id']: running.pop(job_id, None))
+                elif message['type'] == 'cancel' and message['id'] in running:
+                    task, stop = running[message['id']]
+                    stop.set()
+                    if message.get('discard', True):
+                        task.cancel()
+        finally:
+            heartbeat_task.cancel()
+            for task, stop in list(running.values()):
+                stop.set()
+                task.cancel()
+            writer.close()
+
+    async def _run_job(self, message, send, stop):
+        loop = asyncio.get_running_loop()
+        job_id = message['id']
+
+        def progress(update):
+            # Called from the handlers' threads
+            loop.call_soon_threadsafe(send, {'type': 'progress', 'id': job_id, 'update': update})
+
+        send({'type': 'ack', 'id': job_id})
+        self.jobs += 1
+        try:
+            result = await self.handlers[message['kind']](message['payload'], progress, stop)
+        except asyncio.CancelledError:
+            return
+        except Exception as e:
+            send({'type': 'error', 'id': job_id, 'error': str(e) or type(e).__name__})
+            return
+        send({'type': 'result', 'id': job_id, 'result': result})
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description='Runs the resolve, download, transcode and loudness jobs of the bot.')
+    parser.add_argument('address', nargs='?', default=os.getenv('WORKER_BROKER'),
+                        help="the bot's WORKER_BROKER, e.g. unix:/tmp/media.sock or tcp:bot-host:9200")
+    parser.add_argument('--jobs', type=int, default=int(os.getenv('WORKER_JOBS', '4')),
+                        help='jobs run at once')
+    parser.add_argument('--name', default=f"{socket.gethostname()}-{os.getpid()}")
+    parser.add_argument('--token', default=os.getenv('WORKER_TOKEN', ''), help="the bot's WORKER_TOKEN")
+    parser.add_argument('--setup', help="'module:function' called before connecting, for benchmarks")
+    args = parser.parse_args()
+    if not args.address or args.address == 'local':
+        parser.error('a broker address is required')
+    if args.setup:
+        module, _, name = args.setup.partition(':')
+        getattr(importlib.import_module(module), name)()
+    asyncio.run(MediaWorker(args.address, args.jobs, args.name, token=args.token).run())
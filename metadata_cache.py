@@ -0,0 +1,154 @@
+import asyncio
+import json
+import sqlite3
+import threading
+import time
+from collections import OrderedDict
+
+# Fields kept from every extraction result. 'info' is the whole result minus playlist
+# entries and is what downloads and streams are started from.
+CACHED_FIELDS = ('title', 'thumbnail', 'duration', 'id', 'extractor_key', 'webpage_url',
+                 '_type', 'playlist_count', 'entries', 'info')
+
+
+class MetadataCache:
+    """yt-dlp extraction results in an in-memory LRU in front of a SQLite table.
+
+    Every field expires on its own schedule: titles and thumbnails live for days, while
+    the full 'info' result carries signed media URLs that stop working after a while.
+    Concurrent lookups for the same key share a single extraction. Returned values are
+    shared with the cache and must not be mutated by callers.
+    """
+
+    def __init__(self, path, memory_entries, default_ttl, field_ttls=None):
+        self.memory_entries = memory_entries
+        self.default_ttl = default_ttl
+        self.field_ttls = field_ttls or {}
+        self.memory = OrderedDict()  # key -> {field: (value, expires_at)}
+        self.inflight = {}  # key -> asyncio.Future of the extraction in progress
+        self.hits = 0
+        self.disk_hits = 0
+        self.misses = 0
+        self.lock = threading.Lock()  # Guards the in-memory tier; lookups take it on the event loop
+        self.db_lock = threading.Lock()
+        self.db = sqlite3.connect(path, check_same_thread=False)
+        with self.db_lock, self.db:
+            self.db.execute(
+                'CREATE TABLE IF NOT EXISTS metadata ('
+                'key TEXT NOT NULL, field TEXT NOT NULL, value TEXT NOT NULL, expires REAL NOT NULL, '
+                'PRIMARY KEY (key, field))')
+            self.db.execute('DELETE FROM metadata WHERE expires < ?', (time.time(),))
+
+    def _from_memory(self, key, fields):
+        now = time.time()
+        with self.lock:
+            cached = self.memory.get(key)
+            if cached is None:
+                return None
+            if any(field not in cached or cached[field][1] < now for field in fields):
+                return None
+            self.memory.move_to_end(key)
+            return {field: cached[field][0] for field in fields}
+
+    def _from_disk(self, key, fields):
+        now = time.time()
+        placeholders = ','.join('?' * len(fields))
+        with self.db_lock:
+            rows = self.db.execute(
+                f'SELECT field, value, expires FROM metadata WHERE key = ? AND field IN ({placeholders})',
+                (key, *fields)).fetchall()
+        found = {field: (json.loads(value), expires) for field, value, expires in rows if expires >= now}
+        if len(found) < len(fields):
+            return None
+        self._remember(key, found)
+        return {field: value for field, (value, _) in found.items()}
+
+    def _remember(self, key, fields):
+        with self.lock:
+            cached = self.memory.setdefault(key, {})
+            cached.update(fields)
+            self.memory.move_to_end(key)
+            while len(self.memory) > self.memory_entries:
+                self.memory.popitem(last=False)
+
+    def store(self, key, info):
+        """Split an extraction result into fields and write them to both tiers. Thread-safe."""
+        now = time.time()
+        fields = {field: info.get(field) for field in CACHED_FIELDS if field not in ('entries', 'info')}
+        fields['entries'] = info.get('entries')
+        fields['info'] = {k: v for k, v in info.items() if k != 'entries'}
+        expiring = {field: (value, now + self.field_ttls.get(field, self.default_ttl))
+                    for field, value in fields.items()}
+        self._remember(key, expiring)
+        with self.db_lock, self.db:
+            self.db.executemany(
+                'INSERT OR REPLACE INTO metadata (key, field, value, expires) VALUES (?, ?, ?, ?)',
+                [(key, field, json.dumps(value), expires) for field, (value, expires) in expiring.items()])
+        return fields
+
+    def invalidate(self, key, fields=None):
+        """Drop the given fields of key, or all of them, from both tiers. Thread-safe."""
+        with self.lock:
+            if fields is None:
+                self.memory.pop(key, None)
+            else:
+                cached = self.memory.get(key, {})
+                for field in fields:
+                    cached.pop(field, None)
+        with self.db_lock, self.db:
+            if fields is None:
+                self.db.execute('DELETE FROM metadata WHERE key = ?', (key,))
+            else:
+                self.db.executemany('DELETE FROM metadata WHERE key = ? AND field = ?',
+                                    [(key, field) for field in fields])
+
+    async def get(self, key, fields, fetch):
+        """Return the requested fields for key, awaiting fetch() only on a miss.
+
+        fetch is a coroutine function returning a yt-dlp info dict.
+        """
+        cached = self._from_memory(key, fields)
+        if cached is not None:
+            self.hits += 1
+            return cached
+        flight = self.inflight.get(key)
+        if flight is not None:
+            # Someone is already resolving this key; wait for them and read their result
+            await asyncio.wait({flight})
+            if not flight.cancelled() and flight.exception() is not None:
+                raise flight.exception()
+            return await self.get(key, fields, fetch)
+
+        loop = asyncio.get_running_loop()
+        flight = loop.create_future()
+        self.inflight[key] = flight
+        try:
+            cached = await loop.run_in_executor(None, self._from_disk, key, fields)
+            if cached is not None:
+                self.disk_hits += 1
+                result = cached
+            else:
+                self.misses += 1
+                info = await fetch()
+                stored = await loop.run_in_executor(None, self.store, key, info)
+                result = {field: stored.get(field) for field in fields}
+            flight.set_result(None)
+            return result
+        except asyncio.CancelledError:
+            # Waiters retry the lookup themselves
+            flight.cancel()
+            raise
+        except Exception as e:
+            flight.set_exception(e)
+            flight.exception()  # Waiters re-raise it; don't log it as never retrieved
+            raise
+        finally:
+            del self.inflight[key]
+
+    def stats(self):
+        return {
+            'hits': self.hits,
+            'disk_hits': self.disk_hits,
+            'misses': self.misses,
+            'memory_entries': len(self.memory),
+        }
@@ -0,0 +1,135 @@
+import bisect
+import math
+import threading
+
+from aiohttp import web
+
+CONTENT_TYPE = 'text/plain; version=0.0.4; charset=utf-8'
+# Latency buckets in seconds, from a fast cache hit up to a slow download
+DEFAULT_BUCKETS = (0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1, 2.5, 5, 10, 30, 60)
+
+
+def _format_labels(names, values):
+    if not names:
+        return ''
+    pairs = ','.join(f'{name}="{_escape(value)}"' for name, value in zip(names, values))
+    return '{' + pairs + '}'
+
+
+def _escape(value):
+    return str(value).replace('\\', r'\\').replace('"', r'\"').replace('\n', r'\n')
+
+
+def _format_value(value):
+    if value == math.inf:
+        return '+Inf'
+    return repr(float(value))
+
+
+class Histogram:
+    def __init__(self, name, help, labels=(), buckets=DEFAULT_BUCKETS):
+        self.name = name
+        self.help = help
+        self.labels = tuple(labels)
+        self.buckets = tuple(buckets) + (math.inf,)
+        self.series = {}  # label values -> [bucket counts..., sum]
+        self.lock = threading.Lock()
+
+    def observe(self, value, **labels):
+        key = tuple(str(labels.get(name, '')) for name in self.labels)
+        with self.lock:
+            series = self.series.get(key)
+            if series is None:
+                series = self.series[key] = [0] * len(self.buckets) + [0.0]
+            series[bisect.bisect_left(self.buckets, value)] += 1
+            series[-1] += value
+
+    def forget(self, **labels):
+        # Drop every series matching the given labels, e.g. all of an evicted guild's
+        match = [(self.labels.index(name), str(value)) for name, value in labels.items() if name in self.labels]
+        if not match:
+            return
+        with self.lock:
+            for key in [key for key in self.series if all(key[i] == value for i, value in match)]:
+                del self.series[key]
+
+    def render(self):
+        lines = [f'# HELP {self.name} {self.help}', f'# TYPE {self.name} histogram']
+        with self.lock:
+            series = {key: list(values) for key, values in self.series.items()}
+        for key, values in series.items():
+            cumulative = 0
+            for bound, count in zip(self.buckets, values):
+                cumulative += count
+                labels = _format_labels(self.labels + ('le',), key + (_format_value(bound),))
+                lines.append(f'{self.name}_bucket{labels} {cumulative}')
+            labels = _format_labels(self.labels, key)
+            lines.append(f'{self.name}_sum{labels} {_format_value(values[-1])}')
+            lines.append(f'{self.name}_count{labels} {cumulative}')
+        return lines
+
+
+class Gauge:
+    """A gauge (or counter) whose samples are read at scrape time from collect(), which
+    returns {label values tuple: value}."""
+
+    def __init__(self, name, help, labels, collect, type='gauge'):
+        self.name = name
+        self.help = help
+        self.labels = tuple(labels)
+        self.collect = collect
+        self.type = type
+
+    def render(self):
+        lines = [f'# HELP {self.name} {self.help}', f'# TYPE {self.name} {self.type}']
+        for key, value in self.collect().items():
+            lines.append(f'{self.name}{_format_labels(self.labels, key)} {_format_value(value)}')
+        return lines
+
+
+class Registry:
+    def __init__(self):
+        self.metrics = []
+
+    def histogram(self, name, help, labels=(), buckets=DEFAULT_BUCKETS):
+        metric = Histogram(name, help, labels, buckets)
+        self.metrics.append(metric)
+        return metric
+
+    def gauge(self, name, help, labels, collect):
+        metric = Gauge(name, help, labels, collect)
+        self.metrics.append(metric)
+        return metric
+
+    def counter(self, name, help, labels, collect):
+        metric = Gauge(name, help, labels, collect, type='counter')
+        self.metrics.append(metric)
+        return metric
+
+    def forget(self, **labels):
+        for metric in self.metrics:
+            if isinstance(metric, Histogram):
+                metric.forget(**labels)
+
+    def render(self):
+        lines = []
+        for metric in self.metrics:
+            try:
+                lines.extend(metric.render())
+            except Exception as e:
+                print(f"Error collecting {metric.name}: {e}")
+        return '\n'.join(lines) + '\n'
+
+
+async def serve_metrics(registry, host, port):
+    """Serve registry in the Prometheus text format at http://host:port/metrics."""
+    async def handle(request):
+        return web.Response(body=registry.render().encode(), headers={'Content-Type': CONTENT_TYPE})
+
+    app = web.Application()
+    app.router.add_get('/metrics', handle)
+    runner = web.AppRunner(app, access_log=None)
+    await runner.setup()
+    await web.TCPSite(runner, host, port).start()
+    print(f"Serving metrics on http://{host}:{port}/metrics")
+    return runner
@@ -0,0 +1,117 @@
+import asyncio
+from collections import Counter
+
+import discord
+
+MESSAGE_LIMIT = 2000
+
+
+def coalesce(lines):
+    """Join queued notices into one message, folding repeats into a count."""
+    counts = Counter(lines)
+    folded = []
+    for line in dict.fromkeys(lines):
+        folded.append(f"{line} (×{counts[line]})" if counts[line] > 1 else line)
+    text = ''
+    for index, line in enumerate(folded):
+        more = f"\n… and {len(folded) - index} more"
+        if len(text) + len(line) + 1 + len(more) > MESSAGE_LIMIT:
+            return text + more
+        text = f"{text}\n{line}" if text else line
+    return text
+
+
+class Outbox:
+    """Everything a player posts to its text channel, sent by a single task.
+
+    Notices queued while a send is in flight or within `interval` of the last one go out
+    together as one message. The now-playing message is sent once and then edited in place,
+    and only the latest state is shown if tracks change faster than it can be edited. A 429
+    is retried after the Retry-After the API returned.
+    """
+
+    def __init__(self, get_channel, interval=1.0):
+        self.get_channel = get_channel
+        self.interval = interval
+        self.notices = []
+        self.now_playing = None  # (embed, view) waiting to be shown
+        self.message = None  # The now-playing message being edited in place
+        self.wakeup = asyncio.Event()
+        self.task = None
+        self.calls = Counter()  # Discord API calls made, by kind
+
+    def notify(self, text):
+        self.notices.append(text)
+        self._kick()
+
+    def show_now_playing(self, embed, view):
+        self.now_playing = (embed, view)
+        self._kick()
+
+    def reset_now_playing(self):
+        # The next now-playing update starts a fresh message
+        self.now_playing = None
+        self.message = None
+
+    def _kick(self):
+        self.wakeup.set()
+        if self.task is None or self.task.done():
+            self.task = asyncio.create_task(self.run())
+
+    async def run(self):
+        while True:
+            await self.wakeup.wait()
+            self.wakeup.clear()
+            try:
+                await self.flush()
+            except Exception as e:
+                print(f"Error sending to the text channel: {e}")
+            # Pace the channel; anything queued meanwhile goes out in the next batch
+            await asyncio.sleep(self.interval)
+
+    async def flush(self):
+        channel = self.get_channel()
+        if channel is None:
+            self.notices.clear()
+            self.now_playing = None
+            return
+        if self.notices:
+            text = coalesce(self.notices)
+            self.notices.clear()
+            await self._call('send', channel.send, text)
+        if self.now_playing:
+            embed, view = self.now_playing
+            self.now_playing = None
+            if self.message is not None:
+                try:
+                    await self._call('edit', self.message.edit, embed=embed)
+                    return
+                except discord.NotFound:
+                    self.message = None  # Deleted by someone; post a new one
+            self.message = await self._call('send', channel.send, embed=embed, view=view)
+
+    async def _call(self, kind, method, *args, **kwargs):
+        for attempt in range(3):
+            self.calls[kind] += 1
+            try:
+                return await method(*args, **kwargs)
+            except discord.HTTPException as e:
+                if e.status != 429 or attempt == 2:
+                    raise
+                headers = e.response.headers if e.response is not None else {}
+                retry_after = float(headers.get('Retry-After', 1))
+                print(f"Rate limited on {kind}, retrying in {retry_after:.1f}s")
+                await asyncio.sleep(retry_after)
+
+    async def drain(self):
+        # Send whatever is still queued, e.g. before the player goes away
+        if self.task is not None:
+            self.task.cancel()
+            self.task = None
+        if self.notices or self.now_playing:
+            await self.flush()
+
+    def stop(self):
+        if self.task is not None:
+            self.task.cancel()
+            self.task = None
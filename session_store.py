@@ -0,0 +1,65 @@
+import json
+import sqlite3
+import threading
+import time
+
+
+class SessionStore:
+    """Per-guild playback sessions in SQLite, so a restarted bot can pick up where it left off.
+
+    A session is the voice and text channel, the track that was playing and how far in, the
+    upcoming queue and any playlists still being paged in. The queue is only rewritten when
+    it changed; while a track plays just its position is updated.
+    """
+
+    def __init__(self, path):
+        self.lock = threading.Lock()
+        self.db = sqlite3.connect(path, check_same_thread=False)
+        with self.lock, self.db:
+            self.db.execute(
+                'CREATE TABLE IF NOT EXISTS sessions ('
+                'guild INTEGER PRIMARY KEY, voice_channel INTEGER, text_channel INTEGER, '
+                'current TEXT, position REAL NOT NULL, queue TEXT NOT NULL, cursors TEXT NOT NULL, '
+                'updated REAL NOT NULL)')
+            self.db.execute('CREATE TABLE IF NOT EXISTS settings (key TEXT PRIMARY KEY, value TEXT NOT NULL)')
+
+    def save(self, guild_id, session):
+        with self.lock, self.db:
+            self.db.execute(
+                'INSERT OR REPLACE INTO sessions VALUES (?, ?, ?, ?, ?, ?, ?, ?)',
+                (guild_id, session['voice_channel'], session['text_channel'], json.dumps(session['current']),
+                 session['position'], json.dumps(session['queue']), json.dumps(session['cursors']), time.time()))
+
+    def save_position(self, guild_id, position):
+        with self.lock, self.db:
+            self.db.execute('UPDATE sessions SET position = ?, updated = ? WHERE guild = ?',
+                            (position, time.time(), guild_id))
+
+    def delete(self, guild_id):
+        with self.lock, self.db:
+            self.db.execute('DELETE FROM sessions WHERE guild = ?', (guild_id,))
+
+    def load(self):
+        """Return {guild id: session} for every saved session."""
+        with self.lock:
+            rows = self.db.execute(
+                'SELECT guild, voice_channel, text_channel, current, position, queue, cursors FROM sessions').fetchall()
+        sessions = {}
+        for guild_id, voice_channel, text_channel, current, position, queue, cursors in rows:
+            try:
+                sessions[guild_id] = {
+                    'voice_channel': voice_channel, 'text_channel': text_channel, 'current': json.loads(current),
+                    'position': position, 'queue': json.loads(queue), 'cursors': json.loads(cursors)}
+            except ValueError as e:
+                print(f"Dropping unreadable session for guild {guild_id}: {e}")
+                self.delete(guild_id)
+        return sessions
+
+    def get_setting(self, key):
+        with self.lock:
+            row = self.db.execute('SELECT value FROM settings WHERE key = ?', (key,)).fetchone()
+        return row[0] if row else None
+
+    def set_setting(self, key, value):
+        with self.lock, self.db:
+            self.db.execute('INSERT OR REPLACE INTO settings VALUES (?, ?)', (key, value))
@@ -0,0 +1,124 @@
+import asyncio
+
+
+class Left(Exception):
+    """Raised to a caller that left a run other callers still wait on."""
+
+
+class Flight:
+    """One run of the work for a key, and the callers waiting on it.
+
+    Each member is an (interrupt, on_progress) pair, as download_and_convert takes them. The
+    work is interrupted only once every member has asked for it.
+    """
+
+    def __init__(self):
+        self.task = None
+        self.callers = []  # (member, future set when the caller leaves early) per waiting caller
+        self.claimed = False  # Whether a member took over the reference the result came with
+        self.files = set()  # Paths the work is writing
+
+    @property
+    def members(self):
+        return [member for member, _ in self.callers]
+
+    def interrupted(self):
+        return all(interrupt is not None and interrupt.is_set() for interrupt, _ in self.members)
+
+    def progress(self, update):
+        for _, on_progress in list(self.members):
+            if on_progress is not None:
+                on_progress(update)
+
+
+class SingleFlight:
+    """Concurrent calls for the same key share one run of the work.
+
+    The work starts with the first call and is cancelled only once every caller waiting on
+    it has been cancelled. A caller interrupted while others still want the work can leave
+    it early (see leave()). Its result comes with one reference to what it produced (a file,
+    say): the first caller to get the result takes that one over and every other caller
+    takes its own with acquire(result). If no caller is left to take it, release(result)
+    drops it.
+    """
+
+    def __init__(self, acquire, release):
+        self.acquire = acquire
+        self.release = release
+        self.flights = {}  # key -> Flight in progress
+        self.runs = 0
+        self.joins = 0  # Calls that shared a run already in progress
+
+    async def run(self, key, work, member):
+        """Return work(flight)'s result for key, sharing the run with concurrent callers.
+
+        Raises Left if the caller leaves the run through leave() before it finishes.
+        """
+        flight = self.flights.get(key)
+        while flight is not None and flight.interrupted():
+            # Every caller on it has given up and the work is stopping; start afresh once it
+            # has let go of its files rather than join it
+            await asyncio.wait([flight.task])
+            flight = self.flights.get(key)
+        if flight is None:
+            flight = self.flights[key] = Flight()
+            flight.task = asyncio.ensure_future(work(flight))
+            flight.task.add_done_callback(lambda task: self._land(key, flight))
+            self.runs += 1
+        else:
+            self.joins += 1
+        caller = (member, asyncio.get_running_loop().create_future())
+        flight.callers.append(caller)
+        try:
+            # Neither the work nor the leaving is cancelled with this caller
+            await asyncio.wait([flight.task, caller[1]], return_when=asyncio.FIRST_COMPLETED)
+        except asyncio.CancelledError:
+            self._drop(flight, caller)
+            raise
+        if not flight.task.done():
+            self._drop(flight, caller)
+            raise Left(f"Left the run for {key}")
+        flight.callers.remove(caller)
+        result = flight.task.result()
+        if flight.claimed:
+            self.acquire(result)
+        flight.claimed = True
+        return result
+
+    def leave(self, interrupt):
+        """Let the callers whose member has this interrupt stop waiting, once it is set.
+
+        Only callers of a run that others still wait on leave; the last one waits for the work
+        to stop, so whatever it wrote is settled before the caller comes back for it.
+        """
+        for flight in self.flights.values():
+            staying = [caller for caller in flight.callers if not caller[1].done()]
+            leaving = [caller for caller in staying if caller[0][0] is interrupt]
+            if leaving and len(leaving) < len(staying):
+                for _, left in leaving:
+                    left.set_result(None)
+
+    def _drop(self, flight, caller):
+        # A caller gone before the work finished; the work stops with the last one
+        flight.callers.remove(caller)
+        if not flight.callers:
+            if not flight.task.done():
+                flight.task.cancel()
+            else:
+                self._unclaimed(flight)
+
+    def _land(self, key, flight):
+        if self.flights.get(key) is flight:
+            del self.flights[key]
+        if not flight.callers:
+            self._unclaimed(flight)
+
+    def _unclaimed(self, flight):
+        # Finished after every caller had gone
+        task = flight.task
+        if not flight.claimed and not task.cancelled() and task.exception() is None:
+            flight.claimed = True
+            self.release(task.result())
+
+    def stats(self):
+        return {'runs': self.runs, 'joins': self.joins, 'in_flight': len(self.flights)}
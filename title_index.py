@@ -0,0 +1,183 @@
+import bisect
+import difflib
+import heapq
+import re
+import sqlite3
+import threading
+import time
+import unicodedata
+from collections import Counter, OrderedDict
+
+WORD = re.compile(r'\w+')
+# How alike (difflib's ratio) a query word and a title word must be to count as a typo
+FUZZY_SIMILARITY = 0.75
+
+
+def words(text):
+    # Case- and accent-insensitive, so 'Beyonce' finds 'Beyoncé'
+    text = unicodedata.normalize('NFKD', text.casefold())
+    return WORD.findall(''.join(c for c in text if not unicodedata.combining(c)))
+
+
+def trigrams(word):
+    padded = f' {word} '
+    return {padded[i:i + 3] for i in range(len(padded) - 2)}
+
+
+class TitleIndex:
+    """Titles of the tracks the bot has resolved, searchable by word prefixes and with typos.
+
+    The index is held in memory so a lookup answers well within Discord's autocomplete
+    deadline, and kept in SQLite across restarts; past max_entries the titles seen longest ago
+    are dropped from both. A query word matches the title words it
+    is a prefix of or, when there are none, words spelt almost the same. Titles that
+    match more of the query rank first, then closer matches, then shorter titles.
+    """
+
+    def __init__(self, path, max_entries):
+        self.max_entries = max_entries
+        self.lock = threading.Lock()  # Guards the in-memory index; searches take it on the event loop
+        self.db_lock = threading.Lock()
+        self.titles = OrderedDict()  # url -> (title, duration), the most recently seen last
+        self.postings = {}  # word -> urls of the titles containing it
+        self.vocabulary = []  # Sorted keys of postings, for prefix lookups
+        self.grams = {}  # trigram -> words containing it, for typo-tolerant lookups
+        self.searches = 0
+        self.db = sqlite3.connect(path, check_same_thread=False)
+        with self.db_lock, self.db:
+            self.db.execute(
+                'CREATE TABLE IF NOT EXISTS titles ('
+                'url TEXT PRIMARY KEY, title TEXT NOT NULL, duration REAL, seen REAL NOT NULL)')
+
+    def load(self):
+        """Read the saved titles into memory, keeping the max_entries seen most recently. Thread-safe."""
+        with self.db_lock, self.db:
+            rows = self.db.execute('SELECT url, title, duration FROM titles ORDER BY seen DESC LIMIT ?',
+                                   (self.max_entries,)).fetchall()
+            self.db.execute('DELETE FROM titles WHERE url NOT IN '
+                            '(SELECT url FROM titles ORDER BY seen DESC LIMIT ?)', (self.max_entries,))
+        # In batches, so a search never waits long for the lock while a big index loads
+        evicted = []
+        for start in range(0, len(rows), 1000):
+            with self.lock:
+                for url, title, duration in rows[start:start + 1000]:
+                    # Titles indexed since startup are newer than the saved ones, and each
+                    # saved one older than the one before
+                    if url not in self.titles:
+                        self._insert(url, title, duration)
+                        self.titles.move_to_end(url, last=False)
+                evicted += self._evict()
+        if evicted:
+            with self.db_lock, self.db:
+                self.db.executemany('DELETE FROM titles WHERE url = ?', [(url,) for url in evicted])
+        return len(rows)
+
+    def _insert(self, url, title, duration):
+        old = self.titles.get(url)
+        self.titles[url] = (title, duration)
+        self.titles.move_to_end(url)
+        if old is not None:
+            if old[0] == title:
+                return
+            self._unlink(url, old[0])
+        for word in set(words(title)):
+            urls = self.postings.get(word)
+            if urls is None:
+                urls = self.postings[word] = set()
+                bisect.insort(self.vocabulary, word)
+                for gram in trigrams(word):
+                    self.grams.setdefault(gram, set()).add(word)
+            urls.add(url)
+
+    def _unlink(self, url, title):
+        # Take url out of its title words' postings, dropping words no title has any more
+        for word in set(words(title)):
+            urls = self.postings[word]
+            urls.discard(url)
+            if urls:
+                continue
+            del self.postings[word]
+            del self.vocabulary[bisect.bisect_left(self.vocabulary, word)]
+            for gram in trigrams(word):
+                self.grams[gram].discard(word)
+                if not self.grams[gram]:
+                    del self.grams[gram]
+
+    def _evict(self):
+        # Drop the titles seen longest ago past max_entries, returning their URLs
+        evicted = []
+        while len(self.titles) > self.max_entries:
+            url, (title, _) = self.titles.popitem(last=False)
+            self._unlink(url, title)
+            evicted.append(url)
+        return evicted
+
+    def add(self, tracks):
+        """Index and save (url, title, duration) tuples; ones without a URL or title are skipped. Thread-safe."""
+        tracks = [(url, title, duration) for url, title, duration in tracks if url and title]
+        if not tracks:
+            return
+        now = time.time()
+        with self.lock:
+            for url, title, duration in tracks:
+                self._insert(url, title, duration)
+            evicted = self._evict()
+        with self.db_lock, self.db:
+            self.db.executemany(
+                'INSERT OR REPLACE INTO titles (url, title, duration, seen) VALUES (?, ?, ?, ?)',
+                [(url, title, duration, now) for url, title, duration in tracks if url not in evicted])
+            self.db.executemany('DELETE FROM titles WHERE url = ?', [(url,) for url in evicted])
+
+    def _matches(self, word):
+        # Title words the query word may stand for -> how closely
+        matches = {}
+        i = bisect.bisect_left(self.vocabulary, word)
+        while i < len(self.vocabulary) and self.vocabulary[i].startswith(word):
+            candidate = self.vocabulary[i]
+            matches[candidate] = 1.0 if candidate == word else 0.9
+            i += 1
+        if matches or len(word) < 3:
+            return matches
+        # Nothing starts with it: most likely a typo. Only words sharing a third of its
+        # trigrams are compared, each in full and as far as the query word goes.
+        grams = trigrams(word)
+        shared = Counter(candidate for gram in grams for candidate in self.grams.get(gram, ()))
+        matcher = difflib.SequenceMatcher(b=word)
+        for candidate, count in shared.items():
+            if count < len(grams) // 3:
+                continue
+            similarity = 0
+            for text in (candidate, candidate[:len(word)]):
+                matcher.set_seq1(text)
+                similarity = max(similarity, matcher.ratio())
+            if similarity >= FUZZY_SIMILARITY:
+                matches[candidate] = 0.8 * similarity
+        return matches
+
+    def search(self, query, limit=25, every_word=False):
+        """Return up to limit (url, title, duration) tuples for query, best match first.
+
+        With every_word, only titles matching every word of the query are returned.
+        """
+        self.searches += 1
+        query = list(dict.fromkeys(words(query)))
+        scores = {}  # url -> [query words matched, closeness]
+        with self.lock:
+            for word in query:
+                best = {}
+                for candidate, closeness in self._matches(word).items():
+                    for url in self.postings[candidate]:
+                        if closeness > best.get(url, 0):
+                            best[url] = closeness
+                for url, closeness in best.items():
+                    score = scores.setdefault(url, [0, 0.0])
+                    score[0] += 1
+                    score[1] += closeness
+            if every_word:
+                scores = {url: score for url, score in scores.items() if score[0] == len(query)}
+            ranked = heapq.nsmallest(limit, scores, key=lambda url: (-scores[url][0], -scores[url][1],
+                                                                      len(self.titles[url][0])))
+            return [(url, *self.titles[url]) for url in ranked]
+
+    def stats(self):
+        return {'titles': len(self.titles), 'words': len(self.vocabulary), 'searches': self.searches}
@@ -0,0 +1,173 @@
+import itertools
+import threading
+
+# Lifecycle of a queued track
+PENDING = 'pending'          # waiting for a download slot
+DOWNLOADING = 'downloading'  # being downloaded or resolved to a stream
+READY = 'ready'              # playable; source holds the file path or stream URL
+PLAYING = 'playing'          # taken off the queue by the player
+
+_track_ids = itertools.count(1)
+
+
+class Track:
+    __slots__ = ('id', 'url', 'title', 'thumbnail', 'stream', 'state', 'source', 'codec', 'loudness', 'duration', 'task',
+                 'interrupt', 'interrupt_reason', 'start_at', 'partial', 'size', 'paused_files')
+
+    def __init__(self, url, title=None, stream=False, duration=None):
+        self.id = next(_track_ids)
+        self.url = url
+        self.title = title
+        self.thumbnail = None
+        self.stream = stream  # Requested mode until the track is ready, then the mode actually used
+        self.state = PENDING
+        self.source = None
+        self.codec = None
+        self.loudness = None  # (integrated LUFS, true peak dBTP) of the downloaded file, once measured
+        self.duration = duration  # Seconds, when the extractor reported it
+        self.task = None  # Download task while the track is downloading
+        # threading.Event checked by the download's progress hook between chunks; once set the
+        # transfer stops. interrupt_reason says whether to resume later ('pause') or not ('cancel').
+        self.interrupt = None
+        self.interrupt_reason = None
+        self.start_at = 0  # Seconds into the track playback starts from, for a resumed session
+        self.partial = None  # GrowingFile of the download in progress, once playback may start on it
+        self.size = 0  # Bytes of the track's file on disk, including a download in progress
+        self.paused_files = ()  # Paths a paused download left on disk to resume from
+
+    def to_dict(self):
+        """What a saved session keeps of the track; a downloaded file is kept for reuse."""
+        data = {'url': self.url, 'title': self.title, 'duration': self.duration, 'stream': self.stream}
+        if self.state in (READY, PLAYING) and not self.stream:
+            data.update(file=self.source, codec=self.codec, loudness=self.loudness, thumbnail=self.thumbnail)
+        return data
+
+    @classmethod
+    def from_dict(cls, data):
+        track = cls(data['url'], data.get('title'), data.get('stream', False), data.get('duration'))
+        if data.get('file'):
+            track.source = data['file']
+            track.codec = data.get('codec')
+            track.loudness = tuple(data['loudness']) if data.get('loudness') else None
+            track.thumbnail = data.get('thumbnail')
+            track.state = READY
+        return track
+
+    def start_download(self):
+        self.state = DOWNLOADING
+        self.interrupt = threading.Event()
+        self.interrupt_reason = None
+        self.paused_files = ()
+
+    def _interrupt(self, reason):
+        if self.interrupt is not None and not self.interrupt.is_set():
+            self.interrupt_reason = reason
+            self.interrupt.set()
+
+    def pause_download(self):
+        # The partial file stays on disk for resuming
+        self._interrupt('pause')
+
+    def cancel_download(self):
+        self._interrupt('cancel')
+
+    @property
+    def pausing(self):
+        return self.interrupt_reason == 'pause' and self.interrupt.is_set()
+
+    def __repr__(self):
+        return f"<Track {self.id} {self.state} {self.title or self.url!r}>"
+
+
+class TrackQueue:
+    """Upcoming tracks in play order, indexed by position and by track id.
+
+    Positions live in one contiguous list, so slicing, insertion and removal are single
+    C-level memmoves even for tens of thousands of tracks. Ids map straight to their
+    Track. Every mutation bumps version so callers can tell whether the queue changed.
+    """
+
+    def __init__(self):
+        self.tracks = []
+        self.by_id = {}
+        self.version = 0
+
+    def __len__(self):
+        return len(self.tracks)
+
+    def __iter__(self):
+        return iter(self.tracks)
+
+    def __getitem__(self, index):
+        return self.tracks[index]
+
+    def _changed(self):
+        self.version += 1
+
+    def touch(self):
+        """Record an in-place change to a queued track, such as its title arriving."""
+        self._changed()
+
+    def extend(self, tracks, front=False):
+        if front:
+            self.tracks[0:0] = tracks
+        else:
+            self.tracks.extend(tracks)
+        for track in tracks:
+            self.by_id[track.id] = track
+        self._changed()
+
+    def head(self):
+        return self.tracks[0] if self.tracks else None
+
+    def popleft(self):
+        track = self.tracks.pop(0)
+        del self.by_id[track.id]
+        self._changed()
+        return track
+
+    def get(self, track_id):
+        return self.by_id.get(track_id)
+
+    def __contains__(self, track):
+        return self.by_id.get(track.id) is track
+
+    def index_of(self, track_id):
+        track = self.by_id.get(track_id)
+        if track is None:
+            raise KeyError(track_id)
+        return self.tracks.index(track)
+
+    def remove_at(self, index):
+        track = self.tracks.pop(index)
+        del self.by_id[track.id]
+        self._changed()
+        return track
+
+    def remove(self, track_id):
+        return self.remove_at(self.index_of(track_id))
+
+    def move(self, from_index, to_index):
+        track = self.tracks.pop(from_index)
+        self.tracks.insert(to_index, track)
+        self._changed()
+        return track
+
+    def skip_to(self, index):
+        """Drop every track before index and return them."""
+        removed = self.tracks[:index]
+        del self.tracks[:index]
+        for track in removed:
+            del self.by_id[track.id]
+        self._changed()
+        return removed
+
+    def clear(self):
+        removed = self.tracks
+        self.tracks = []
+        self.by_id = {}
+        self._changed()
+        return removed
+
+    def window(self, size):
+        return self.tracks[:size]
@@ -0,0 +1,65 @@
+import asyncio
+import os
+import re
+
+# The integrated loudness and true peak lines of the summary FFmpeg's ebur128 filter prints
+LOUDNESS_SUMMARY = re.compile(r'I:\s+(-?[\d.]+) LUFS.*?Peak:\s+(-?(?:[\d.]+|inf)) dBFS', re.S)
+
+
+def opus_paths(filename):
+    """The Opus file convert_to_opus leaves in filename's place, and the file it writes first."""
+    target = os.path.splitext(filename)[0] + '.opus'
+    return target, target + '.tmp'
+
+
+async def convert_to_opus(ffmpeg, filename, acodec):
+    """Turn a download into an Opus file next to it, delete the original and return the new path.
+
+    Opus sources are only remuxed (codec copy) and Opus files left as they are; anything else
+    is transcoded once to Opus. FFmpeg runs as our own subprocess so a cancelled conversion can
+    kill it; its input and output are removed then.
+    """
+    target, output = opus_paths(filename)
+    if filename == target:
+        return filename
+    codec_args = ['-c:a', 'copy'] if acodec == 'opus' else ['-c:a', 'libopus', '-b:a', '128k']
+    # Written under another name, so an interrupted conversion never leaves a complete-looking Opus file
+    process = await asyncio.create_subprocess_exec(
+        ffmpeg, '-y', '-loglevel', 'error', '-i', filename, '-vn', *codec_args, '-f', 'opus', output,
+        stdin=asyncio.subprocess.DEVNULL, stdout=asyncio.subprocess.DEVNULL, stderr=asyncio.subprocess.PIPE)
+    try:
+        _, stderr = await process.communicate()
+    except asyncio.CancelledError:
+        process.kill()
+        for path in (filename, output):
+            if os.path.exists(path):
+                os.remove(path)
+        raise
+    if process.returncode != 0:
+        if os.path.exists(output):
+            os.remove(output)
+        raise RuntimeError(f"FFmpeg could not convert {filename}: {stderr.decode(errors='replace').strip()[-300:]}")
+    os.replace(output, target)
+    os.remove(filename)
+    return target
+
+
+async def measure_loudness(ffmpeg, filename):
+    """Return the EBU R128 integrated loudness (LUFS) and true peak (dBTP) of a file.
+
+    The file is decoded once by FFmpeg's ebur128 filter, which is killed if this is cancelled.
+    """
+    process = await asyncio.create_subprocess_exec(
+        ffmpeg, '-nostats', '-hide_banner', '-i', filename, '-vn', '-af', 'ebur128=peak=true:framelog=verbose',
+        '-f', 'null', '-',
+        stdin=asyncio.subprocess.DEVNULL, stdout=asyncio.subprocess.DEVNULL, stderr=asyncio.subprocess.PIPE)
+    try:
+        _, stderr = await process.communicate()
+    except asyncio.CancelledError:
+        process.kill()
+        raise
+    output = stderr.decode(errors='replace')
+    summary = LOUDNESS_SUMMARY.search(output[output.rfind('Summary:'):])
+    if process.returncode != 0 or summary is None:
+        raise RuntimeError(f"FFmpeg could not measure {filename}: {output.strip()[-300:]}")
+    return float(summary[1]), float(summary[2])